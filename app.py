@@ -1,324 +1,165 @@
-from flask import Flask, render_template, request, redirect, url_for
+from flask import Flask, Response, current_app, render_template, stream_template, stream_with_context, request, redirect, url_for, jsonify
+from flask.cli import with_appcontext
 import sqlite3
 import datetime
-import pytz
+import click
+import csv
+import io
 import os
-
-app = Flask(__name__)
-
-# Define the path to your database folder and file
-db_folder = 'database'
-db_file = 'inventory.db'
-db_path = os.path.join(db_folder, db_file)
-
-# Create the folder if it doesn't exist
-if not os.path.exists(db_folder):
-    os.makedirs(db_folder)
-
-# Define the East Africa Time timezone
-eat = pytz.timezone('Africa/Nairobi')
-
-# Initialize the database (creating tables if they don't exist)
-def init_db():
-    conn = sqlite3.connect(db_path, timeout=30)
-    cursor = conn.cursor()
-
-    cursor.execute('DROP TABLE IF EXISTS boulder_archive')
-    cursor.execute('DROP TABLE IF EXISTS slab')
-
-    # Drop and recreate the boulder table
-    #cursor.execute('DROP TABLE IF EXISTS boulder')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS boulder (
-            boulder_id TEXT PRIMARY KEY,
-            date TEXT,
-            boulder_description TEXT,
-            color TEXT,
-            good_boulder INTEGER,
-            defect_line INTEGER,
-            natural_cracks INTEGER,
-            mining_cracks INTEGER,
-            undersize INTEGER,
-            total_boulders INTEGER
-        )
-    ''')
-
-    # Drop and recreate the factory table
-    #cursor.execute('DROP TABLE IF EXISTS factory')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS factory (
-            boulder_id TEXT PRIMARY KEY,
-            boulder_description TEXT,
-            good_boulder INTEGER,
-            defect_line INTEGER,
-            natural_cracks INTEGER,
-            mining_cracks INTEGER,
-            undersize INTEGER,
-            total_boulders INTEGER,
-            received_timestamp TEXT,
-            FOREIGN KEY(boulder_id) REFERENCES boulder(boulder_id)
-        )
-    ''')
-
-    # Slabs table
-    #cursor.execute('DROP TABLE IF EXISTS slabs')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS slabs (
-            slab_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            boulder_id TEXT,
-            description TEXT,
-            good_slabs INTEGER,
-            defect_line INTEGER,
-            natural_cracks INTEGER,
-            cutting_cracks INTEGER,
-            thickness_issue INTEGER,
-            total_slabs INTEGER,
-            FOREIGN KEY(boulder_id) REFERENCES boulder(boulder_id)
-        )
-    ''')
-
-    # Cutting Machine 1
-    #cursor.execute('DROP TABLE IF EXISTS cutting_machine_1')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS cutting_machine_1 (
-            machine_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            boulder_id TEXT,
-            boulder_description TEXT,
-            num_slabs_cut INTEGER,
-            start_time TEXT,
-            end_time TEXT,
-            machine_hours REAL,
-            FOREIGN KEY(boulder_id) REFERENCES boulder(boulder_id)
-        )
-    ''')
-
-    # Cutting Machine 2
-    #cursor.execute('DROP TABLE IF EXISTS cutting_machine_2')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS cutting_machine_2 (
-            machine_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            boulder_id TEXT,
-            boulder_description TEXT,
-            num_slabs_cut INTEGER,
-            start_time TEXT,
-            end_time TEXT,
-            machine_hours REAL,
-            FOREIGN KEY(boulder_id) REFERENCES boulder(boulder_id)
-        )
-    ''')
-
-    # Separation table
-    #cursor.execute('DROP TABLE IF EXISTS separation')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS separation (
-            separation_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            boulder_id TEXT,
-            boulder_description TEXT,
-            slab_id TEXT,
-            slab_description TEXT,
-            good_slabs INTEGER,
-            defect_line INTEGER,
-            natural_cracks INTEGER,
-            cutting_cracks INTEGER,
-            thickness_issue INTEGER,
-            total_slabs INTEGER,
-            separation_time TEXT,
-            FOREIGN KEY(boulder_id) REFERENCES boulder(boulder_id)
-        )
-    ''')
-
-    #Polishing table
-    #cursor.execute('DROP TABLE IF EXISTS polishing')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS polishing (
-            polishing_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            slab_id TEXT,
-            slab_description TEXT,
-            original_status TEXT,
-            polishing_description TEXT,
-            good_slab INTEGER, 
-            defect_line INTEGER,
-            natural_cracks INTEGER, 
-            cutting_cracks INTEGER, 
-            thickness_issue INTEGER,
-            polishing_time TEXT,                  
-            FOREIGN KEY(slab_id) REFERENCES separation(slab_id) 
-        ) 
-    ''')
-    
-    # Edge Cutting Standard Table 
-    #cursor.execute('DROP TABLE IF EXISTS edge_cutting_standard')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS edge_cutting_standard ( 
-            edge_cutting_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            slab_id TEXT, 
-            polishing_description TEXT, 
-            edge_cutting_description TEXT,
-            good_slab INTEGER, 
-            defect_line INTEGER, 
-            natural_cracks INTEGER,
-            cutting_cracks INTEGER, 
-            thickness_issue INTEGER, 
-            edge_cutting_time TEXT, 
-            FOREIGN KEY(slab_id) REFERENCES polishing(slab_id)
-        ) 
-    ''')
-
-    # Edge Cutting Special Orders Table 
-    #cursor.execute('DROP TABLE IF EXISTS edge_cutting_special_orders')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS edge_cutting_special_orders (
-            edge_cutting_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            slab_id TEXT, 
-            polishing_description TEXT, 
-            edge_cutting_description TEXT, 
-            special_order_details TEXT, 
-            good_slab INTEGER,
-            defect_line INTEGER, 
-            natural_cracks INTEGER, 
-            cutting_cracks INTEGER,
-            thickness_issue INTEGER, 
-            edge_cutting_time TEXT, 
-            FOREIGN KEY(slab_id) REFERENCES polishing(slab_id)
-        ) 
-    ''')
-
-    # Bullnose Table 
-    #cursor.execute('DROP TABLE IF EXISTS bullnose')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS bullnose (
-        bullnose_id INTEGER PRIMARY KEY AUTOINCREMENT, 
-        slab_id TEXT, 
-        edge_cutting_description TEXT,
-        bullnose_description TEXT, 
-        good_slab INTEGER, 
-        defect_line INTEGER,
-        natural_cracks INTEGER, 
-        cutting_cracks INTEGER, 
-        thickness_issue INTEGER,
-        bullnose_time TEXT,
-        FOREIGN KEY(slab_id) REFERENCES edge_cutting_standard(slab_id) ON DELETE CASCADE, 
-        FOREIGN KEY(slab_id) REFERENCES edge_cutting_special_orders(slab_id) ON DELETE CASCADE
-        ) 
-    ''')
-
-    # Sealant Table 
-    #cursor.execute('DROP TABLE IF EXISTS sealant')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS sealant (
-            sealant_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            slab_id TEXT, 
-            bullnose_description TEXT, 
-            sealant_description TEXT,
-            good_slab INTEGER, 
-            defect_line INTEGER, 
-            natural_cracks INTEGER,
-            cutting_cracks INTEGER, 
-            thickness_issue INTEGER, 
-            sealant_time TEXT,
-            FOREIGN KEY(slab_id) REFERENCES bullnose(slab_id)
-        ) 
-    ''')
-
-    # Ready Slabs Table 
-    #cursor.execute('DROP TABLE IF EXISTS ready_slabs')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS ready_slabs (
-            ready_slab_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            slab_id TEXT,
-            sealant_description TEXT,
-            good_slab INTEGER, 
-            defect_line INTEGER, 
-            natural_cracks INTEGER,
-            cutting_cracks INTEGER, 
-            thickness_issue INTEGER, 
-            ready_time TEXT,
-            FOREIGN KEY(slab_id) REFERENCES sealant(slab_id)
-        ) 
-    ''')
-
-    # Movement table
-    #cursor.execute('DROP TABLE IF EXISTS movement')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS movement (
-            movement_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            boulder_id TEXT,
-            slab_id TEXT,
-            stage TEXT,
-            details TEXT,
-            date TEXT,
-            FOREIGN KEY(boulder_id) REFERENCES boulder(boulder_id)
-            FOREIGN KEY(slab_id) REFERENCES separation(slab_id)
-        )
-    ''')
-
-    # Inventory table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS inventory (
-            slab_id TEXT PRIMARY KEY,
-            slab_description TEXT,
-            stage TEXT,
-            good_slab INTEGER,
-            defect_line INTEGER,
-            natural_cracks INTEGER,
-            cutting_cracks INTEGER,
-            thickness_issue INTEGER,
-            FOREIGN KEY(slab_id) REFERENCES separation(slab_id)
-        )
-    ''')
-
-    # Archive table
-    #cursor.execute('DROP TABLE IF EXISTS archived_boulder')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS archived_boulder (
-            boulder_id TEXT PRIMARY KEY,
-            date TEXT,
-            boulder_description TEXT,
-            good_boulder TEXT,
-            defect_line TEXT,
-            natural_cracks TEXT,
-            mining_cracks TEXT,
-            undersize TEXT,
-            total_boulders INTEGER
-        )
-    ''')
-
-    conn.commit()
-    conn.close()
-
-# Initialize the database
-init_db()
-
-# Helper function to log movements
+import re
+
+import archive
+import cutting
+import db
+import export
+import genealogy
+import metrics
+import migrations
+import movement_log
+import page_cache
+import pagination
+import rollups
+import search
+import slab_state
+import storage
+import timestamps
+import transitions
+import writer
+from cache import LRUCache
+from db import get_db
+from storage import QUEUE_QUERIES
+
+# Views register themselves here with @route; create_app adds them to each app
+ROUTES = []
+
+
+def route(rule, **options):
+    def decorator(view):
+        ROUTES.append((rule, view, options))
+        return view
+    return decorator
+
+
+# Build the app. Importing this module has no side effects: the database
+# folder, log file and connection pool are set up here, and the writer and
+# movement log threads start on first use, so each server worker (or a
+# forking server after create_app) gets its own. `config` overrides the
+# defaults below. Serve it with `flask --app app run`, or for several worker
+# processes e.g. `gunicorn -w 4 'app:create_app()'`.
+def create_app(config=None):
+    app = Flask(__name__)
+
+    # Define the path to your database folder and file
+    db_folder = 'database'
+    db_file = 'inventory.db'
+    db_path = os.environ.get('INVENTORY_DB_PATH', os.path.join(db_folder, db_file))
+    db_folder = os.path.dirname(db_path) or '.'
+
+    # One pooled connection per request (see db.py)
+    app.config['DATABASE'] = db_path
+    app.config['DB_POOL_SIZE'] = int(os.environ.get('INVENTORY_DB_POOL_SIZE', 5))
+    app.config['DB_TIMEOUT'] = 30
+
+    # Writes run one at a time on a writer thread per process, retried with
+    # exponential backoff while another process holds the lock (see writer.py)
+    app.config['WRITE_BUSY_TIMEOUT'] = 5
+    app.config['WRITE_ATTEMPTS'] = 5
+    app.config['WRITE_BACKOFF'] = 0.05
+    app.config['WRITE_MAX_BACKOFF'] = 2.0
+
+    # Movement rows are written in batches by a background thread (see movement_log.py)
+    app.config['MOVEMENT_BATCH_SIZE'] = 200
+    app.config['MOVEMENT_FLUSH_INTERVAL'] = 1.0
+
+    # Request/SQL metrics at /metrics; statements slower than SLOW_QUERY_MS are
+    # logged to LOG_FILE (see metrics.py)
+    app.config['SLOW_QUERY_MS'] = int(os.environ.get('INVENTORY_SLOW_QUERY_MS', 200))
+    app.config['LOG_FILE'] = os.environ.get('INVENTORY_LOG_FILE', os.path.join('logs', 'app.log'))
+
+    # Finished boulders are moved to a separate archive database by
+    # `flask --app app archive` (see archive.py); ?archive=1 on the history pages
+    # and exports includes them
+    app.config['ARCHIVE_DATABASE'] = os.environ.get('INVENTORY_ARCHIVE_DB_PATH', os.path.join(db_folder, 'archive.db'))
+    app.config['ARCHIVE_AFTER_DAYS'] = 30
+    app.config['ARCHIVE_BATCH_SIZE'] = 500
+
+    # Rows per page on the stage history tables (see pagination.py). With
+    # HISTORY_STREAMING, or ?stream=1 on a single request, the whole filtered
+    # history is streamed to the browser instead of paged.
+    app.config['HISTORY_PAGE_SIZE'] = 50
+    app.config['HISTORY_STREAMING'] = False
+
+    # Rendered stage pages are cached against per-table version counters and
+    # carry ETags, so an unchanged page costs one small query (see page_cache.py)
+    app.config['PAGE_CACHE_SIZE'] = 256
+
+    # Async serving mode (uvicorn --factory asgi:create_app, see asgi.py):
+    # aiosqlite connections for the async JSON routes, and threads for the
+    # Flask routes it mounts
+    app.config['ASGI_READ_POOL_SIZE'] = int(os.environ.get('INVENTORY_ASGI_READ_POOL_SIZE', 8))
+    app.config['ASGI_WSGI_THREADS'] = 10
+
+    # Largest batch accepted by the bulk stage transition API
+    app.config['TRANSITION_BATCH_LIMIT'] = 1000
+
+    # Quarry manifest imports commit every IMPORT_CHUNK_SIZE rows and report at
+    # most IMPORT_MAX_ERRORS bad rows individually
+    app.config['IMPORT_CHUNK_SIZE'] = 500
+    app.config['IMPORT_MAX_ERRORS'] = 1000
+
+    app.config.update(config or {})
+
+    # Create the folder if it doesn't exist
+    os.makedirs(os.path.dirname(app.config['DATABASE']) or '.', exist_ok=True)
+
+    db.init_app(app)
+    writer.init_app(app)
+    # Workflow reads and writes go through the repository (see storage.py)
+    storage.init_app(app)
+    movement_log.init_app(app)
+    metrics.init_app(app)
+    metrics.add_gauge(app, 'movement_log_queue_depth', 'Movement rows waiting to be written.',
+                      lambda: app.extensions['movement_writer'].metrics()['queue_depth'])
+    metrics.add_gauge(app, 'movement_log_dropped_total', 'Movement rows dropped after failed writes.',
+                      lambda: app.extensions['movement_writer'].metrics()['dropped'])
+    # Slabs cut per boulder (see get_slabs_cut)
+    app.extensions['slabs_cut_cache'] = LRUCache(maxsize=4096)
+    # Genealogy trees (see get_trace)
+    trace_cache = app.extensions['trace_cache'] = LRUCache(maxsize=1024)
+    metrics.add_gauge(app, 'trace_cache_hits_total', 'Genealogy trees served from the cache.', lambda: trace_cache.hits)
+    metrics.add_gauge(app, 'trace_cache_misses_total', 'Genealogy trees read from the database.', lambda: trace_cache.misses)
+
+    # Schema changes live in migrations.py; startup only checks the version
+    migrations.init_app(app)
+    slab_state.init_app(app)
+    rollups.init_app(app)
+    cutting.init_app(app)
+    export.init_app(app)
+    search.init_app(app)
+    archive.init_app(app)
+    page_cache.init_app(app)
+
+    # Times are stored as epoch seconds and shown in Africa/Nairobi time (see timestamps.py)
+    timestamps.init_app(app)
+
+    app.context_processor(inject_cutting_machines)
+    app.register_error_handler(writer.DatabaseBusy, database_busy)
+    app.cli.add_command(check_query_plans_command)
+    app.cli.add_command(import_boulders_command)
+    for rule, view, options in ROUTES:
+        app.add_url_rule(rule, view_func=view, **options)
+    return app
+
+# Helper function to log movements (queued for the background movement writer)
 def log_movement(stage, details, boulder_id=None, slab_id=None):
-    conn = sqlite3.connect(db_path, timeout=30)
-    cursor = conn.cursor()
-    date = datetime.datetime.now(pytz.utc).astimezone(eat).strftime("%Y-%m-%d %H:%M:%S")
-    cursor.execute('''
-        INSERT INTO movement (boulder_id, slab_id, stage, details, date)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (boulder_id, slab_id, stage, details, date))
-    conn.commit()
-    conn.close()
-
-#Helper function to update inventory
-def update_inventory(slab_id, description, stage, good_slab, defect_line, natural_cracks, cutting_cracks, thickness_issue):
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO inventory (slab_id, slab_description, stage, good_slab, defect_line, natural_cracks, cutting_cracks, thickness_issue)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(slab_id) DO UPDATE SET
-                slab_description=excluded.slab_description,
-                stage=excluded.stage,
-                good_slab=excluded.good_slab,
-                defect_line=excluded.defect_line,
-                natural_cracks=excluded.natural_cracks,
-                cutting_cracks=excluded.cutting_cracks,
-                thickness_issue=excluded.thickness_issue
-        ''', (slab_id, description, stage, good_slab, defect_line, natural_cracks, cutting_cracks, thickness_issue))
-        conn.commit()
+    log_movements([(stage, details, boulder_id, slab_id)])
 
+# Helper function to log a batch of (stage, details, boulder_id, slab_id) movements
+def log_movements(movements):
+    date = timestamps.now()
+    movement_log.get_writer().submit(
+        (boulder_id, slab_id, stage, details, date) for stage, details, boulder_id, slab_id in movements
+    )
 
 # Helper function to convert Yes/No to integers
 def convert_to_int(value): 
@@ -332,81 +173,262 @@ def convert_to_int(value):
         except ValueError: 
             return 0 # or handle error as needed
 
+# Helper function to move the slab posted by a finishing stage form on to
+# `stage` (see transitions.py); `description_field` names the form's
+# description input
+def post_stage_form(stage, description_field=None):
+    transition = {'slab_id': request.form['slab_id']}
+    if description_field:
+        transition['description'] = request.form[description_field]
+    for name in transitions.FLAGS:
+        transition[name] = convert_to_int(request.form[name])
+    log_movements(storage.get_storage().apply_transitions(stage, [transition], timestamps.now()))
+
+# Helper function to fetch the history table of a stage page, paged or streamed;
+# keyword arguments restrict it to rows with those column values, and
+# ?archive=1 includes archived rows
+def history_page(table, **scope):
+    conn = get_db()
+    with_archive = request.args.get('archive') == '1' and archive.attach(conn, current_app.config['ARCHIVE_DATABASE'])
+    if current_app.config['HISTORY_STREAMING'] or request.args.get('stream') == '1':
+        return pagination.history_stream(conn, table, request.args, scope, with_archive)
+    return pagination.history_page(conn, table, request.args, current_app.config['HISTORY_PAGE_SIZE'], scope, with_archive)
+
+# Helper function to render a stage page. A streamed history is rendered with
+# stream_template so rows go out as they are read from the cursor; the request
+# context (and its pooled connection) stays open until the last row is sent.
+def render_history(template, page, **context):
+    if page['streamed']:
+        return stream_template(template, page=page, **context)
+    page_cache.cacheable()
+    return render_template(template, page=page, **context)
+
+# Helper function to list queue queries whose anti-join or slab_state lookups do not use an index
+def queue_query_problems(conn):
+    problems = []
+    for name, sql in QUEUE_QUERIES.items():
+        plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+        lookups = re.findall(r'NOT EXISTS \(SELECT 1 FROM (\w+) (\w+) WHERE', sql)
+        lookups += re.findall(r'FROM (slab_state) (\w+)', sql)
+        for table, alias in sorted(set(lookups)):
+            steps = [detail for detail in plan if re.match(rf'(SCAN|SEARCH) {alias}\b', detail)]
+            if not steps or any(not detail.startswith('SEARCH') for detail in steps):
+                problems.append((name, table, plan))
+    return problems
+
+# The nav bar on every page links each configured cutting machine
+def inject_cutting_machines():
+    return {'cutting_machines': storage.get_storage().cutting_machines()}
+
+# A write that still found the database locked after every retry: ask the
+# client to try again rather than failing with a 500
+def database_busy(e):
+    current_app.logger.warning('Database busy on %s: %s', request.path, e)
+    headers = {'Retry-After': '1'}
+    if request.path.startswith('/api/'):
+        return jsonify(error='The database is busy, try again.'), 503, headers
+    return 'The database is busy, try again.', 503, headers
+
 # Route: Index page
-@app.route('/')
+@route('/')
 def index():
     return render_template('index.html')
 
+# Route: Production dashboard (reads only the rollup tables, see rollups.py)
+@route('/dashboard')
+def dashboard():
+    days = min(max(request.args.get('days', 30, type=int), 1), 3660)
+    since = (timestamps.today() - datetime.timedelta(days=days - 1)).isoformat()
+    return render_template('dashboard.html', days=days, **rollups.dashboard(get_db(), since, days))
+
+# Route: Cutting machine utilization per hour or day, for saw capacity planning
+# (?by=hour|day, ?days=N, default the last 7 days)
+@route('/api/cutting_machines/utilization')
+def cutting_utilization():
+    days = min(max(request.args.get('days', 7, type=int), 1), 3660)
+    by = request.args.get('by', 'day')
+    if by not in ('hour', 'day'):
+        return jsonify(error="by must be 'hour' or 'day'"), 400
+    since = (timestamps.today() - datetime.timedelta(days=days - 1)).isoformat()
+    return jsonify([
+        {by: period, 'machine_id': machine_id, 'machine': name, 'runs': runs, 'slabs_cut': slabs_cut,
+         'busy_hours': round(busy_hours, 3), 'utilization': round(utilization, 4)}
+        for period, machine_id, name, runs, slabs_cut, busy_hours, utilization in rollups.utilization(get_db(), since, by)
+    ])
+
+# Route: Full-text search over descriptions and movement details (see search.py)
+@route('/search')
+def search_page():
+    text = request.args.get('q', '').strip()
+    hits = search.query(get_db(), text, request.args.get('limit', 50, type=int)) if text else []
+    return render_template('search.html', q=text, hits=hits)
+
+# Route: Search results as JSON, best match first (?q=text, ?limit=N)
+@route('/api/search')
+def search_api():
+    text = request.args.get('q', '').strip()
+    if not text:
+        return jsonify(error='q is required'), 400
+    return jsonify([
+        dict(hit, url=url_for(hit['page'], q=hit['page_filter']))
+        for hit in search.query(get_db(), text, request.args.get('limit', 50, type=int))
+    ])
+
+# Genealogy trees by (boulder ID, boulder state). The state is the boulder's
+# own rows and its slabs' stages (see genealogy.STATE_SQL), so a move of that
+# boulder or one of its slabs, made by any worker, CLI import or archive run,
+# makes its cached trees unreachable while other boulders' trees stay cached;
+# old entries age out of the app's LRU (app.extensions['trace_cache']).
+
+# Helper function to fetch a boulder's genealogy tree, cached; archived
+# boulders are read from the archive database
+def get_trace(boulder_id):
+    conn = get_db()
+    trace_cache = current_app.extensions['trace_cache']
+    key = (boulder_id, genealogy.state(conn, boulder_id))
+    tree = trace_cache.get(key)
+    if tree is None:
+        with_archive = genealogy.is_archived(conn, boulder_id) and archive.attach(conn, current_app.config['ARCHIVE_DATABASE'])
+        tree = genealogy.trace(conn, boulder_id, with_archive)
+        if tree is not None:
+            trace_cache.set(key, tree)
+    return tree
+
+# Route: Everything that happened to a boulder and its slabs
+@route('/trace/<boulder_id>')
+def trace(boulder_id):
+    tree = get_trace(boulder_id)
+    if tree is None:
+        return f'Unknown boulder {boulder_id}', 404
+    return render_template('trace.html', tree=tree)
+
+# Route: Boulder -> slab -> special-order tree as JSON
+@route('/api/trace/<boulder_id>')
+def trace_api(boulder_id):
+    tree = get_trace(boulder_id)
+    if tree is None:
+        return jsonify(error=f'boulder {boulder_id} not found'), 404
+    return jsonify(tree)
+
+# Route: Request and SQL metrics in the Prometheus text format
+@route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(current_app.extensions['metrics_gauges']), mimetype='text/plain; version=0.0.4')
+
+# Route: Movement log writer queue metrics
+@route('/movement_log/metrics')
+def movement_log_metrics():
+    return jsonify(movement_log.get_writer().metrics())
+
 # Route: Quarry
-@app.route('/quarry', methods=['GET', 'POST'])
+@route('/quarry', methods=['GET', 'POST'])
+@page_cache.cached('boulder')
 def quarry():
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
     if request.method == 'POST':
         date = request.form['date']
         boulder_description = request.form['boulder_description']
 
-        # Extract color from the boulder description
-        color = boulder_description.split()[0]
-        color_prefix = color[0].upper()
-
-        # Function to convert Yes/No to integers
-        def convert_to_int(value):
-            if value.lower() == 'yes':
-                return 1
-            elif value.lower() == 'no':
-                return 0
-            else:
-                try:
-                    return int(value)
-                except ValueError:
-                    return 0  # or handle error as needed
-
         good_boulder = convert_to_int(request.form['good_boulder'])
         defect_line = convert_to_int(request.form['defect_line'])
         natural_cracks = convert_to_int(request.form['natural_cracks'])
         mining_cracks = convert_to_int(request.form['mining_cracks'])
         undersize = convert_to_int(request.form['undersize'])
-        total_boulders = good_boulder + defect_line + natural_cracks + mining_cracks + undersize
-
-        # Generate boulder_id
-        cursor.execute("SELECT COUNT(*) FROM boulder WHERE color = ?", (color,))
-        count = cursor.fetchone()[0] + 1
-        boulder_id = f"M{color_prefix}{count:03d}"
+        flags = (good_boulder, defect_line, natural_cracks, mining_cracks, undersize)
 
-        cursor.execute('''
-            INSERT INTO boulder 
-            (boulder_id, date, boulder_description, color, good_boulder, defect_line, natural_cracks, mining_cracks, undersize, total_boulders)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (boulder_id, date, boulder_description, color, good_boulder, defect_line, natural_cracks, mining_cracks, undersize, total_boulders))
-        conn.commit()
+        # The boulder ID comes from its color's sequence (see boulder_ids.py)
+        try:
+            boulder_id = storage.get_storage().add_boulder(date, boulder_description, flags)
+        except (sqlite3.OperationalError, storage.StorageError):
+            current_app.logger.exception('Could not add boulder')
+            return "An error occurred during the transaction."
 
         # Log movement
         log_movement(stage="Quarry", details=f"Boulder {boulder_id} added to the quarry.", boulder_id=boulder_id)
-
-        conn.close()
         return redirect(url_for('quarry'))
 
-    cursor.execute('SELECT * FROM boulder')
-    boulders = cursor.fetchall()
-    conn.close()
-    return render_template('quarry.html', boulders=boulders)
+    page = history_page('boulder')
+    boulders = page['rows']
+    return render_history('quarry.html', page, boulders=boulders)
+
+# Columns of a quarry manifest CSV. Only date and boulder_description are
+# required; the others take Yes/No (or a number) like the quarry form and default to No.
+QUARRY_CSV_COLUMNS = ('date', 'boulder_description', 'good_boulder', 'defect_line', 'natural_cracks', 'mining_cracks', 'undersize')
+
+# Helper function to turn one manifest row into (date, description, color, flags..., total)
+def parse_boulder_row(row):
+    date = (row.get('date') or '').strip()
+    try:
+        datetime.date.fromisoformat(date)
+    except ValueError:
+        raise ValueError(f"invalid date '{date}' (expected YYYY-MM-DD)")
+    boulder_description = (row.get('boulder_description') or '').strip()
+    if not boulder_description:
+        raise ValueError('boulder_description is required')
+    color = boulder_description.split()[0]
+    flags = [convert_to_int((row.get(name) or 'No').strip()) for name in QUARRY_CSV_COLUMNS[2:]]
+    return (date, boulder_description, color, *flags, sum(flags))
+
+# Helper function to write one chunk of parsed manifest rows in its own
+# transaction (see storage.py) and add it to the report
+def write_boulder_chunk(chunk, report):
+    imported, errors = storage.get_storage().import_boulders(chunk)
+    for line, error in errors:
+        add_import_error(report, line, error)
+    report['imported'] += len(imported)
+    log_movements(("Quarry", f"Boulder {row[0]} added to the quarry.", row[0], None) for _, row in imported)
+
+# Helper function to record a failed manifest row
+def add_import_error(report, line, error):
+    report['failed'] += 1
+    if len(report['errors']) < current_app.config['IMPORT_MAX_ERRORS']:
+        report['errors'].append({'line': line, 'error': error})
+
+# Helper function to import a quarry manifest from an iterable of CSV lines.
+# Rows are parsed as they are read and written a chunk at a time, so memory
+# stays bounded however long the file is. Bad rows are reported by line
+# number and skipped; the rest of the file is still imported.
+def import_boulders(lines):
+    report = {'imported': 0, 'failed': 0, 'errors': []}
+    reader = csv.DictReader(lines)
+    missing = [name for name in QUARRY_CSV_COLUMNS[:2] if name not in (reader.fieldnames or [])]
+    if missing:
+        report['error'] = f"missing column(s): {', '.join(missing)}"
+        return report
+
+    chunk_size = current_app.config['IMPORT_CHUNK_SIZE']
+    chunk = []
+    for row in reader:
+        try:
+            chunk.append((reader.line_num, parse_boulder_row(row)))
+        except ValueError as e:
+            add_import_error(report, reader.line_num, str(e))
+        if len(chunk) >= chunk_size:
+            write_boulder_chunk(chunk, report)
+            chunk = []
+    if chunk:
+        write_boulder_chunk(chunk, report)
+    return report
+
+# Route: Bulk import of a quarry manifest (CSV upload as "file", or a text/csv body)
+@route('/quarry/import', methods=['POST'])
+def quarry_import():
+    upload = request.files.get('file')
+    stream = upload.stream if upload else request.stream
+    try:
+        report = import_boulders(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    except (UnicodeDecodeError, csv.Error) as e:
+        return jsonify(error=f'Could not read the CSV: {e}'), 400
+    except (sqlite3.OperationalError, storage.StorageError):
+        current_app.logger.exception('Could not import boulders')
+        return jsonify(error='An error occurred during the import.'), 500
+    return jsonify(report), 400 if 'error' in report else 200
 
 # Route: Factory
-@app.route('/factory', methods=['GET', 'POST'])
+@route('/factory', methods=['GET', 'POST'])
+@page_cache.cached('boulder', 'factory')
 def factory():
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
     # Fetch only good boulders from the quarry that are not already in the factory
-    cursor.execute('''
-        SELECT boulder_id, boulder_description 
-        FROM boulder 
-        WHERE good_boulder = 1 
-        AND boulder_id NOT IN (SELECT boulder_id FROM factory)
-    ''')
-    boulders = cursor.fetchall()
+    _, boulders = storage.get_storage().queue('factory')
     boulder_ids = [row[0] for row in boulders]
     boulder_dict = {row[0]: row[1] for row in boulders}  # Dictionary to map boulder_id to description
 
@@ -414,596 +436,397 @@ def factory():
         boulder_id = request.form['boulder_id']
         description = request.form.get('description', boulder_dict.get(boulder_id, ''))
 
-        # Function to convert Yes/No to integers
-        def convert_to_int(value):
-            if value.lower() == 'yes':
-                return 1
-            elif value.lower() == 'no':
-                return 0
-            else:
-                try:
-                    return int(value)
-                except ValueError:
-                    return 0  # or handle error as needed
-
         good_boulder = convert_to_int(request.form.get('good_boulder', 'no'))
         defect_line = convert_to_int(request.form.get('defect_line', 'no'))
         natural_cracks = convert_to_int(request.form.get('natural_cracks', 'no'))
         mining_cracks = convert_to_int(request.form.get('mining_cracks', 'no'))
         undersize = convert_to_int(request.form.get('undersize', 'no'))
-        total_boulders = good_boulder + defect_line + natural_cracks + mining_cracks + undersize
-        received_timestamp = datetime.datetime.now(pytz.utc).astimezone(eat).strftime("%Y-%m-%d %H:%M:%S")
-
-        cursor.execute('''
-            INSERT OR REPLACE INTO factory 
-            (boulder_id, boulder_description, good_boulder, defect_line, natural_cracks, 
-            mining_cracks, undersize, total_boulders, received_timestamp)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (boulder_id, description, good_boulder, defect_line, natural_cracks, 
-              mining_cracks, undersize, total_boulders, received_timestamp))
-        conn.commit()
+        flags = (good_boulder, defect_line, natural_cracks, mining_cracks, undersize)
+
+        try:
+            storage.get_storage().receive_boulder(boulder_id, description, flags, timestamps.now())
+        except (sqlite3.OperationalError, storage.StorageError):
+            current_app.logger.exception('Could not receive boulder %s', boulder_id)
+            return "An error occurred during the transaction."
 
         # Log movement
         log_movement(stage="Factory", details=f"Boulder {boulder_id} received at the factory.", boulder_id=boulder_id)
-        conn.close()
         return redirect(url_for('factory'))
 
-    cursor.execute('SELECT * FROM factory')
-    factories = cursor.fetchall()
-    conn.close()
-    return render_template('factory.html', factories=factories, boulder_ids=boulder_ids, boulder_dict=boulder_dict)
-
-
-# Route: Cutting Machine 1
-@app.route('/cutting_machine_1', methods=['GET', 'POST'])
-def cutting_machine_1():
-    return cutting_machine(machine_id=1)
+    page = history_page('factory')
+    factories = page['rows']
+    return render_history('factory.html', page, factories=factories, boulder_ids=boulder_ids, boulder_dict=boulder_dict)
 
-# Route: Cutting Machine 2
-@app.route('/cutting_machine_2', methods=['GET', 'POST'])
-def cutting_machine_2():
-    return cutting_machine(machine_id=2)
 
-# Helper function to handle Cutting Machines
+# Route: Cutting Machines, one page per machine in the cutting_machine table
+@route('/cutting_machine_<int:machine_id>', methods=['GET', 'POST'])
+@page_cache.cached('factory', 'cutting_run')
 def cutting_machine(machine_id):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    repository = storage.get_storage()
 
-    table = f"cutting_machine_{machine_id}"  # Dynamic table selection
+    name = dict(repository.cutting_machines()).get(machine_id)
+    if name is None:
+        return f'Unknown cutting machine {machine_id}', 404
 
     # Fetch only boulders received in the factory that have not been cut yet
-    cursor.execute('''
-        SELECT boulder_id, boulder_description 
-        FROM factory 
-        WHERE boulder_id NOT IN (SELECT boulder_id FROM cutting_machine_1 UNION SELECT boulder_id FROM cutting_machine_2)
-    ''')
-    boulders = cursor.fetchall()
+    _, boulders = repository.queue('cutting_machine')
     boulder_ids = [row[0] for row in boulders]
     boulder_dict = {row[0]: row[1] for row in boulders}
 
     if request.method == 'POST':
         boulder_id = request.form['boulder_id']
         description = request.form.get('description', boulder_dict.get(boulder_id, ''))
-        start_time = request.form['start_time']  # This will be set via JavaScript
-        end_time = request.form['end_time']      # This will be set via JavaScript
+        start_time = timestamps.parse(request.form['start_time'])  # Local time, set via JavaScript
+        end_time = timestamps.parse(request.form['end_time'])      # Local time, set via JavaScript
         num_slabs_cut = int(request.form['num_slabs_cut'])
 
         # Calculate machine hours
-        start_time_dt = datetime.datetime.fromisoformat(start_time)
-        end_time_dt = datetime.datetime.fromisoformat(end_time)
-        machine_hours = (end_time_dt - start_time_dt).total_seconds() / 3600
+        machine_hours = (end_time - start_time) / 3600
 
-        cursor.execute(f'''
-            INSERT INTO {table} 
-            (boulder_id, boulder_description, num_slabs_cut, start_time, end_time, machine_hours)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (boulder_id, description, num_slabs_cut, start_time, end_time, machine_hours))
-        conn.commit()
+        try:
+            repository.record_cutting_run(machine_id, boulder_id, description, num_slabs_cut, start_time, end_time, machine_hours)
+        except (sqlite3.OperationalError, storage.StorageError):
+            current_app.logger.exception('Could not record cutting run of boulder %s', boulder_id)
+            return "An error occurred during the transaction."
+        current_app.extensions['slabs_cut_cache'].invalidate(boulder_id)
 
         # Log movement
-        log_movement(stage=f"Cutting Machine {machine_id}", details=f"Boulder {boulder_id} cut with {num_slabs_cut} slabs.", boulder_id=boulder_id)
-
-        conn.close()
-        return redirect(url_for('cutting_machine_1' if machine_id == 1 else 'cutting_machine_2'))
-
-    cursor.execute(f'SELECT * FROM {table}')
-    cuts = cursor.fetchall()
-    conn.close()
-    return render_template(f'cutting_machine_{machine_id}.html', cuts=cuts, machine_id=machine_id, boulder_ids=boulder_ids, boulder_dict=boulder_dict)
+        log_movement(stage=name, details=f"Boulder {boulder_id} cut with {num_slabs_cut} slabs.", boulder_id=boulder_id)
+        return redirect(url_for('cutting_machine', machine_id=machine_id))
+
+    page = history_page('cutting_run', machine_id=machine_id)
+    cuts = page['rows']
+    return render_history('cutting_machine.html', page, cuts=cuts, machine_id=machine_id, machine_name=name, boulder_ids=boulder_ids, boulder_dict=boulder_dict)
+
+# Slabs cut per boulder, from the app's cache (app.extensions['slabs_cut_cache']).
+# A count only changes through the cutting machine POST, which invalidates
+# it; boulders that have not been cut yet are never cached.
+def get_slabs_cut(boulder_ids):
+    cache = current_app.extensions['slabs_cut_cache']
+    slabs_cut = {}
+    missing = []
+    for boulder_id in boulder_ids:
+        count = cache.get(boulder_id)
+        if count is None:
+            missing.append(boulder_id)
+        else:
+            slabs_cut[boulder_id] = count
+    for boulder_id, count in cutting.slabs_cut(get_db(), missing).items():
+        slabs_cut[boulder_id] = count
+        cache.set(boulder_id, count)
+    return slabs_cut
 
 # Helper function to fetch the number of slabs cut for a boulder ID
 def get_num_slabs_cut(boulder_id):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT SUM(num_slabs_cut) 
-        FROM (
-            SELECT num_slabs_cut FROM cutting_machine_1 WHERE boulder_id = ?
-            UNION ALL
-            SELECT num_slabs_cut FROM cutting_machine_2 WHERE boulder_id = ?
-        )
-    ''', (boulder_id, boulder_id))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result[0] else 0
+    return get_slabs_cut([boulder_id]).get(boulder_id, 0)
 
 # Route: Separation
-@app.route('/separation', methods=['GET', 'POST'])
+@route('/separation', methods=['GET', 'POST'])
+@page_cache.cached('cutting_run', 'separation')
 def separation():
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
-    # Fetch only cut boulders that have not been separated
-    cursor.execute('''
-        SELECT boulder_id, boulder_description 
-        FROM (
-            SELECT boulder_id, boulder_description FROM cutting_machine_1 
-            UNION 
-            SELECT boulder_id, boulder_description FROM cutting_machine_2
-        )
-        WHERE boulder_id NOT IN (SELECT boulder_id FROM separation)
-    ''')
-    boulders = cursor.fetchall()
+    # Fetch only cut boulders that have not been separated, with the number
+    # of slabs cut for each, in one grouped query
+    _, boulders = storage.get_storage().queue('separation')
     boulder_ids = [row[0] for row in boulders]
     boulder_dict = {row[0]: row[1] for row in boulders}
-
-    # Fetch the number of slabs cut for each boulder
-    slabs_cut = {boulder_id: get_num_slabs_cut(boulder_id) for boulder_id in boulder_ids}
+    slabs_cut = {row[0]: row[2] or 0 for row in boulders}
+    cache = current_app.extensions['slabs_cut_cache']
+    for boulder_id, count in slabs_cut.items():
+        cache.set(boulder_id, count)
 
     if request.method == 'POST':
-        boulder_id = request.form['boulder_id']
-        boulder_description = request.form.get('boulder_description', boulder_dict.get(boulder_id, ''))
-        slab_description = request.form['slab_description']
-        
-        # Extract color from the slab description
-        slab_color = slab_description.split()[0]
-        slab_color_prefix = slab_color[0].upper()
-
-        good_slabs = int(request.form['good_slabs'])
-        defect_line = int(request.form['defect_line'])
-        natural_cracks = int(request.form['natural_cracks'])
-        cutting_cracks = int(request.form['cutting_cracks'])
-        thickness_issue = int(request.form['thickness_issue'])
-        total_slabs = good_slabs + defect_line + natural_cracks + cutting_cracks + thickness_issue
-        separation_time = datetime.datetime.now(pytz.utc).astimezone(eat).strftime("%Y-%m-%d %H:%M:%S")
-
-        for i in range(1, total_slabs + 1):
-            slab_id = f"{boulder_id}_S{slab_color_prefix}{i:03d}"
-            cursor.execute('''
-                INSERT INTO separation 
-                (boulder_id, boulder_description, slab_id, slab_description, good_slabs, defect_line, natural_cracks, cutting_cracks, 
-                thickness_issue, total_slabs, separation_time)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (boulder_id, boulder_description, slab_id, slab_description, 1 if i <= good_slabs else 0, 1 if i > good_slabs and i <= good_slabs + defect_line else 0, 
-                  1 if i > good_slabs + defect_line and i <= good_slabs + defect_line + natural_cracks else 0, 1 if i > good_slabs + defect_line + natural_cracks and i <= good_slabs + defect_line + natural_cracks + cutting_cracks else 0, 
-                  1 if i > good_slabs + defect_line + natural_cracks + cutting_cracks and i <= total_slabs else 0, total_slabs, separation_time))
-        
-        conn.commit()
-
-        # Log movement for each slab
-        for i in range(1, total_slabs + 1):
-            slab_id = f"{boulder_id}_S{slab_color_prefix}{i:03d}"
-            #log_movement(boulder_id, "Separation", f"Slab {slab_id} from Boulder {boulder_id} separated.")
-            log_movement(stage="Separation", details=f"Slab {slab_id} from Boulder {boulder_id} separated.", boulder_id=boulder_id, slab_id=slab_id)
-        conn.close()
+        # The form repeats one entry per boulder (fields named like "boulder_id[]")
+        def entries(name):
+            return request.form.getlist(f'{name}[]') or request.form.getlist(name)
+
+        count_fields = ('good_slabs', 'defect_line', 'natural_cracks', 'cutting_cracks', 'thickness_issue')
+        boulder_entries = [
+            (boulder_id, boulder_dict.get(boulder_id, ''), slab_description, [int(count) for count in counts])
+            for boulder_id, slab_description, *counts in zip(entries('boulder_id'), entries('slab_description'), *(entries(name) for name in count_fields))
+            if boulder_id
+        ]
+
+        # Write every slab in a single transaction, then queue the movement rows
+        try:
+            movements = storage.get_storage().separate(boulder_entries, timestamps.now())
+            log_movements(movements)
+
+        except (sqlite3.OperationalError, transitions.TransitionError, storage.StorageError):
+            current_app.logger.exception('Could not separate boulders %s', ', '.join(entry[0] for entry in boulder_entries))
+            return "An error occurred during the transaction."
+
         return redirect(url_for('separation'))
 
-    cursor.execute('SELECT * FROM separation')
-    separations = cursor.fetchall()
-    conn.close()
-    return render_template('separation.html', separations=separations, boulder_ids=boulder_ids, boulder_dict=boulder_dict, slabs_cut=slabs_cut)
+    page = history_page('separation')
+    separations = page['rows']
+    return render_history('separation.html', page, separations=separations, boulder_ids=boulder_ids, boulder_dict=boulder_dict, slabs_cut=slabs_cut)
 
 
-@app.route('/polishing', methods=['GET', 'POST'])
+@route('/polishing', methods=['GET', 'POST'])
+@page_cache.cached('slab_state', 'polishing')
 def polishing():
     if request.method == 'POST':
         try:
-            slab_id = request.form['slab_id']
-            with sqlite3.connect(db_path, timeout=30) as conn:
-                cursor = conn.cursor()
-
-                # Fetch slab description and original status from separation table
-                cursor.execute('''
-                    SELECT slab_description, 
-                           CASE 
-                               WHEN good_slabs = 1 THEN 'Good'
-                               WHEN defect_line = 1 THEN 'Defect Line'
-                               WHEN natural_cracks = 1 THEN 'Natural Cracks'
-                               WHEN cutting_cracks = 1 THEN 'Cutting Cracks'
-                               WHEN thickness_issue = 1 THEN 'Thickness Issue'
-                               ELSE 'Unknown'
-                           END as original_status
-                    FROM separation WHERE slab_id = ?
-                ''', (slab_id,))
-                result = cursor.fetchone()
-                slab_description = result[0]
-                original_status = result[1]
-
-                polishing_description = request.form['polishing_description']
-                good_slab = convert_to_int(request.form['good_slab'])
-                defect_line = convert_to_int(request.form['defect_line'])
-                natural_cracks = convert_to_int(request.form['natural_cracks'])
-                cutting_cracks = convert_to_int(request.form['cutting_cracks'])
-                thickness_issue = convert_to_int(request.form['thickness_issue'])
-
-                polishing_time = datetime.datetime.now(pytz.utc).astimezone(eat).strftime("%Y-%m-%d %H:%M:%S")
-
-                cursor.execute('''
-                    INSERT INTO polishing (slab_id, slab_description, original_status, polishing_description, 
-                                           good_slab, defect_line, natural_cracks, cutting_cracks, 
-                                           thickness_issue, polishing_time)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (slab_id, slab_description, original_status, polishing_description, good_slab, defect_line, natural_cracks, cutting_cracks, thickness_issue, polishing_time))
-                conn.commit()
-
-            # Log movement
-            log_movement(stage="Polishing", details=f"Slab {slab_id} polished with description: {polishing_description}.", slab_id=slab_id)
-
-        except sqlite3.OperationalError as e:
-            print(f"Error: {e}")
+            post_stage_form('polishing', 'polishing_description')
+
+        except (sqlite3.OperationalError, transitions.TransitionError, storage.StorageError):
+            current_app.logger.exception('Could not apply polishing transitions')
             return "An error occurred during the transaction."
 
         return redirect(url_for('polishing'))
 
     # Fetch slabs that have been separated but not polished
     try:
-        with sqlite3.connect(db_path, timeout=30) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT slab_id, slab_description, 
-                       CASE 
-                           WHEN good_slabs = 1 THEN 'Good'
-                           WHEN defect_line = 1 THEN 'Defect Line'
-                           WHEN natural_cracks = 1 THEN 'Natural Cracks'
-                           WHEN cutting_cracks = 1 THEN 'Cutting Cracks'
-                           WHEN thickness_issue = 1 THEN 'Thickness Issue'
-                           ELSE 'Unknown'
-                       END as original_status
-                FROM separation 
-                WHERE slab_id NOT IN (SELECT slab_id FROM polishing)
-            ''')
-            slabs = cursor.fetchall()
-            
-            # Fetch polished slabs
-            cursor.execute('SELECT * FROM polishing')
-            polished_slabs = cursor.fetchall()
-    except sqlite3.OperationalError as e:
-        print(f"Fetch Error: {e}")
+        _, slabs = storage.get_storage().queue('polishing')
+
+        # Fetch polished slabs
+        page = history_page('polishing')
+        polished_slabs = page['rows']
+    except sqlite3.OperationalError:
+        current_app.logger.exception('Could not load the polishing page')
         return "An error occurred during fetching data."
 
-    return render_template('polishing.html', slabs=slabs, polished_slabs=polished_slabs)
+    return render_history('polishing.html', page, slabs=slabs, polished_slabs=polished_slabs)
 
 
 #Route: Edge Cutting Standard
-@app.route('/edge_cutting_standard', methods=['GET', 'POST'])
+@route('/edge_cutting_standard', methods=['GET', 'POST'])
+@page_cache.cached('slab_state', 'edge_cutting_standard')
 def edge_cutting_standard():
     if request.method == 'POST':
         try:
-            slab_id = request.form['slab_id']
-            with sqlite3.connect(db_path, timeout=30) as conn:
-                cursor = conn.cursor()
-
-                # Fetch polishing description from the polishing table
-                cursor.execute('SELECT polishing_description FROM polishing WHERE slab_id = ?', (slab_id,))
-                polishing_description = cursor.fetchone()[0]
-
-                edge_cutting_description = request.form['edge_cutting_description']
-                good_slab = convert_to_int(request.form['good_slab'])
-                defect_line = convert_to_int(request.form['defect_line'])
-                natural_cracks = convert_to_int(request.form['natural_cracks'])
-                cutting_cracks = convert_to_int(request.form['cutting_cracks'])
-                thickness_issue = convert_to_int(request.form['thickness_issue'])
-
-                edge_cutting_time = datetime.datetime.now(pytz.utc).astimezone(eat).strftime("%Y-%m-%d %H:%M:%S")
-
-                cursor.execute('''
-                    INSERT INTO edge_cutting_standard (slab_id, polishing_description, edge_cutting_description, 
-                                                       good_slab, defect_line, natural_cracks, cutting_cracks, 
-                                                       thickness_issue, edge_cutting_time)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (slab_id, polishing_description, edge_cutting_description, good_slab, defect_line, natural_cracks, cutting_cracks, thickness_issue, edge_cutting_time))
-                conn.commit()
-
-            # Update inventory
-            update_inventory(slab_id, edge_cutting_description, 'Awaiting Bullnose', good_slab, defect_line, natural_cracks, cutting_cracks, thickness_issue)
-
-            # Log movement
-            log_movement(stage="Edge Cutting Standard", details=f"Slab {slab_id} edge cut with description: {edge_cutting_description}.", slab_id=slab_id)
-
-        except sqlite3.OperationalError as e:
-            print(f"Error: {e}")
+            post_stage_form('edge_cutting', 'edge_cutting_description')
+
+        except (sqlite3.OperationalError, transitions.TransitionError, storage.StorageError):
+            current_app.logger.exception('Could not apply edge_cutting transitions')
             return "An error occurred during the transaction."
 
         return redirect(url_for('edge_cutting_standard'))
 
     # Fetch slabs that have been polished but not edge cut
     try:
-        with sqlite3.connect(db_path, timeout=30) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT slab_id, polishing_description 
-                FROM polishing
-                WHERE slab_id NOT IN (SELECT slab_id FROM edge_cutting_standard) 
-                AND slab_id NOT IN (SELECT slab_id FROM edge_cutting_special_orders)
-            ''')
-            slabs = cursor.fetchall()
-            
-            # Fetch edge cut slabs
-            cursor.execute('SELECT * FROM edge_cutting_standard')
-            edge_cut_slabs = cursor.fetchall()
-    except sqlite3.OperationalError as e:
-        print(f"Fetch Error: {e}")
+        _, slabs = storage.get_storage().queue('edge_cutting')
+
+        # Fetch edge cut slabs
+        page = history_page('edge_cutting_standard')
+        edge_cut_slabs = page['rows']
+    except sqlite3.OperationalError:
+        current_app.logger.exception('Could not load the edge_cutting_standard page')
         return "An error occurred during fetching data."
 
-    return render_template('edge_cutting_standard.html', slabs=slabs, edge_cut_slabs=edge_cut_slabs)
+    return render_history('edge_cutting_standard.html', page, slabs=slabs, edge_cut_slabs=edge_cut_slabs)
 
 
 #Route: Edge Cutting Special Orders
-@app.route('/edge_cutting_special_orders', methods=['GET', 'POST'])
+@route('/edge_cutting_special_orders', methods=['GET', 'POST'])
+@page_cache.cached('slab_state', 'edge_cutting_special_orders')
 def edge_cutting_special_orders():
     if request.method == 'POST':
         slab_id = request.form['slab_id']
         try:
-            with sqlite3.connect(db_path, timeout=30) as conn:
-                cursor = conn.cursor()
-
-                # Fetch polishing description from the polishing table
-                cursor.execute('SELECT polishing_description FROM polishing WHERE slab_id = ?', (slab_id,))
-                polishing_description = cursor.fetchone()[0]
-                conn.commit()
-
-            slab_sizes = request.form.getlist('special_order_size[]')
-            edge_cutting_descriptions = request.form.getlist('special_order_description[]')
-            good_slab = convert_to_int(request.form['good_slab'])
-            defect_line = convert_to_int(request.form['defect_line'])
-            natural_cracks = convert_to_int(request.form['natural_cracks'])
-            cutting_cracks = convert_to_int(request.form['cutting_cracks'])
-            thickness_issue = convert_to_int(request.form['thickness_issue'])
-            edge_cutting_time = datetime.datetime.now(pytz.utc).astimezone(eat).strftime("%Y-%m-%d %H:%M:%S")
-
-            with sqlite3.connect(db_path, timeout=30) as conn:
-                cursor = conn.cursor()
-                for i, size in enumerate(slab_sizes):
-                    special_order_id = f"OS{(i + 1):03d}"
-                    special_slab_id = f"{slab_id}_{special_order_id}"
-                    special_edge_cutting_description = edge_cutting_descriptions[i]
-                    cursor.execute('''
-                        INSERT INTO edge_cutting_special_orders (slab_id, polishing_description, edge_cutting_description, 
-                                                                 special_order_details, good_slab, defect_line, natural_cracks, cutting_cracks, 
-                                                                 thickness_issue, edge_cutting_time)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (special_slab_id, polishing_description, special_edge_cutting_description, 
-                          size, good_slab, defect_line, natural_cracks, cutting_cracks, thickness_issue, edge_cutting_time))
-                    # Log movement for each special slab
-                    log_movement(stage="Edge Cutting Special Orders", details=f"Special Order Slab {special_slab_id} edge cut from {slab_id} with size: {size}.", slab_id=special_slab_id)
-                conn.commit()
-
-                # Update inventory for each special slab
-                for i, size in enumerate(slab_sizes):
-                    special_order_id = f"OS{(i + 1):03d}"
-                    special_slab_id = f"{slab_id}_{special_order_id}"
-                    special_edge_cutting_description = edge_cutting_descriptions[i]
-                    update_inventory(special_slab_id, special_edge_cutting_description, 'Awaiting Bullnose', good_slab, defect_line, natural_cracks, cutting_cracks, thickness_issue)
-
-        except sqlite3.OperationalError as e:
-            print(f"Error: {e}")
+            # One (size, description) pair per special order cut from the slab
+            orders = list(zip(request.form.getlist('special_order_size[]'), request.form.getlist('special_order_description[]')))
+            flags = [convert_to_int(request.form[name]) for name in transitions.FLAGS]
+            movements = storage.get_storage().cut_special_orders(slab_id, orders, flags, timestamps.now())
+
+            # Log movement for each special slab
+            log_movements(movements)
+
+        except (sqlite3.OperationalError, transitions.TransitionError, storage.StorageError):
+            current_app.logger.exception('Could not cut special orders from slab %s', slab_id)
             return "An error occurred during the transaction."
 
         return redirect(url_for('edge_cutting_special_orders'))
 
     # Fetch slabs that have been polished but not edge cut
     try:
-        with sqlite3.connect(db_path, timeout=30) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT slab_id, polishing_description 
-                FROM polishing
-                WHERE slab_id NOT IN (SELECT slab_id FROM edge_cutting_special_orders) 
-                AND slab_id NOT IN (SELECT slab_id FROM edge_cutting_standard)
-            ''')
-            slabs = cursor.fetchall()
-            
-            # Fetch edge cut slabs
-            cursor.execute('SELECT * FROM edge_cutting_special_orders')
-            edge_cut_slabs = cursor.fetchall()
-    except sqlite3.OperationalError as e:
-        print(f"Fetch Error: {e}")
+        _, slabs = storage.get_storage().queue('edge_cutting')
+
+        # Fetch edge cut slabs
+        page = history_page('edge_cutting_special_orders')
+        edge_cut_slabs = page['rows']
+    except sqlite3.OperationalError:
+        current_app.logger.exception('Could not load the edge_cutting_special_orders page')
         return "An error occurred during fetching data."
 
-    return render_template('edge_cutting_special_orders.html', slabs=slabs, edge_cut_slabs=edge_cut_slabs)
+    return render_history('edge_cutting_special_orders.html', page, slabs=slabs, edge_cut_slabs=edge_cut_slabs)
 
 
 #Route: Bullnose
-@app.route('/bullnose', methods=['GET', 'POST'])
+@route('/bullnose', methods=['GET', 'POST'])
+@page_cache.cached('slab_state', 'bullnose')
 def bullnose():
     if request.method == 'POST':
         try:
-            slab_id = request.form['slab_id']
-            with sqlite3.connect(db_path, timeout=30) as conn:
-                cursor = conn.cursor()
-
-                # Fetch edge cutting description from edge cutting tables
-                cursor.execute('''
-                    SELECT edge_cutting_description 
-                    FROM edge_cutting_standard 
-                    WHERE slab_id = ? 
-                    UNION 
-                    SELECT edge_cutting_description 
-                    FROM edge_cutting_special_orders 
-                    WHERE slab_id = ?
-                ''', (slab_id, slab_id))
-                edge_cutting_description = cursor.fetchone()[0]
-
-                bullnose_description = request.form['bullnose_description']
-                good_slab = convert_to_int(request.form['good_slab'])
-                defect_line = convert_to_int(request.form['defect_line'])
-                natural_cracks = convert_to_int(request.form['natural_cracks'])
-                cutting_cracks = convert_to_int(request.form['cutting_cracks'])
-                thickness_issue = convert_to_int(request.form['thickness_issue'])
-
-                bullnose_time = datetime.datetime.now(pytz.utc).astimezone(eat).strftime("%Y-%m-%d %H:%M:%S")
-
-                cursor.execute('''
-                    INSERT INTO bullnose (slab_id, edge_cutting_description, bullnose_description, 
-                                          good_slab, defect_line, natural_cracks, cutting_cracks, 
-                                          thickness_issue, bullnose_time)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (slab_id, edge_cutting_description, bullnose_description, good_slab, defect_line, natural_cracks, cutting_cracks, thickness_issue, bullnose_time))
-                conn.commit()
-
-            # Log movement
-            log_movement(stage="Bullnose", details=f"Slab {slab_id} bullnosed with description: {bullnose_description}.", slab_id=slab_id)
-
-        except sqlite3.OperationalError as e:
-            print(f"Error: {e}")
+            post_stage_form('bullnose', 'bullnose_description')
+
+        except (sqlite3.OperationalError, transitions.TransitionError, storage.StorageError):
+            current_app.logger.exception('Could not apply bullnose transitions')
             return "An error occurred during the transaction."
 
         return redirect(url_for('bullnose'))
 
     # Fetch slabs that have been edge cut but not bullnosed
     try:
-        with sqlite3.connect(db_path, timeout=30) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT slab_id, edge_cutting_description 
-                FROM edge_cutting_standard 
-                WHERE slab_id NOT IN (SELECT slab_id FROM bullnose) 
-                UNION 
-                SELECT slab_id, edge_cutting_description 
-                FROM edge_cutting_special_orders 
-                WHERE slab_id NOT IN (SELECT slab_id FROM bullnose)
-            ''')
-            slabs = cursor.fetchall()
-            
-            # Fetch bullnosed slabs
-            cursor.execute('SELECT * FROM bullnose')
-            bullnosed_slabs = cursor.fetchall()
-    except sqlite3.OperationalError as e:
-        print(f"Fetch Error: {e}")
+        _, slabs = storage.get_storage().queue('bullnose')
+
+        # Fetch bullnosed slabs
+        page = history_page('bullnose')
+        bullnosed_slabs = page['rows']
+    except sqlite3.OperationalError:
+        current_app.logger.exception('Could not load the bullnose page')
         return "An error occurred during fetching data."
 
-    return render_template('bullnose.html', slabs=slabs, bullnosed_slabs=bullnosed_slabs)
+    return render_history('bullnose.html', page, slabs=slabs, bullnosed_slabs=bullnosed_slabs)
 
 
 #Route: Sealant Application
-@app.route('/sealant', methods=['GET', 'POST'])
+@route('/sealant', methods=['GET', 'POST'])
+@page_cache.cached('slab_state', 'sealant')
 def sealant():
     if request.method == 'POST':
         try:
-            slab_id = request.form['slab_id']
-            with sqlite3.connect(db_path, timeout=30) as conn:
-                cursor = conn.cursor()
-
-                # Fetch bullnose description from bullnose table
-                cursor.execute('SELECT bullnose_description FROM bullnose WHERE slab_id = ?', (slab_id,))
-                bullnose_description = cursor.fetchone()[0]
-
-                sealant_description = request.form['sealant_description']
-                good_slab = convert_to_int(request.form['good_slab'])
-                defect_line = convert_to_int(request.form['defect_line'])
-                natural_cracks = convert_to_int(request.form['natural_cracks'])
-                cutting_cracks = convert_to_int(request.form['cutting_cracks'])
-                thickness_issue = convert_to_int(request.form['thickness_issue'])
-
-                sealant_time = datetime.datetime.now(pytz.utc).astimezone(eat).strftime("%Y-%m-%d %H:%M:%S")
-
-                cursor.execute('''
-                    INSERT INTO sealant (slab_id, bullnose_description, sealant_description, 
-                                         good_slab, defect_line, natural_cracks, cutting_cracks, 
-                                         thickness_issue, sealant_time)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (slab_id, bullnose_description, sealant_description, good_slab, defect_line, natural_cracks, cutting_cracks, thickness_issue, sealant_time))
-                conn.commit()
-
-            # Log movement
-            log_movement(stage="Sealant", details=f"Slab {slab_id} sealed with description: {sealant_description}.", slab_id=slab_id)
-
-        except sqlite3.OperationalError as e:
-            print(f"Error: {e}")
+            post_stage_form('sealant', 'sealant_description')
+
+        except (sqlite3.OperationalError, transitions.TransitionError, storage.StorageError):
+            current_app.logger.exception('Could not apply sealant transitions')
             return "An error occurred during the transaction."
 
         return redirect(url_for('sealant'))
 
     # Fetch slabs that have been bullnosed but not sealed
     try:
-        with sqlite3.connect(db_path, timeout=30) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT slab_id, bullnose_description 
-                FROM bullnose 
-                WHERE slab_id NOT IN (SELECT slab_id FROM sealant)
-            ''')
-            slabs = cursor.fetchall()
-            
-            # Fetch sealed slabs
-            cursor.execute('SELECT * FROM sealant')
-            sealed_slabs = cursor.fetchall()
-    except sqlite3.OperationalError as e:
-        print(f"Fetch Error: {e}")
+        _, slabs = storage.get_storage().queue('sealant')
+
+        # Fetch sealed slabs
+        page = history_page('sealant')
+        sealed_slabs = page['rows']
+    except sqlite3.OperationalError:
+        current_app.logger.exception('Could not load the sealant page')
         return "An error occurred during fetching data."
 
-    return render_template('sealant.html', slabs=slabs, sealed_slabs=sealed_slabs)
+    return render_history('sealant.html', page, slabs=slabs, sealed_slabs=sealed_slabs)
 
 
 #Route: Ready Slabs
-@app.route('/ready_slabs', methods=['GET', 'POST'])
+@route('/ready_slabs', methods=['GET', 'POST'])
+@page_cache.cached('slab_state', 'ready_slabs')
 def ready_slabs():
     if request.method == 'POST':
         try:
-            slab_id = request.form['slab_id']
-            with sqlite3.connect(db_path, timeout=30) as conn:
-                cursor = conn.cursor()
-
-                # Fetch sealant description from sealant table
-                cursor.execute('SELECT sealant_description FROM sealant WHERE slab_id = ?', (slab_id,))
-                sealant_description = cursor.fetchone()[0]
-
-                good_slab = convert_to_int(request.form['good_slab'])
-                defect_line = convert_to_int(request.form['defect_line'])
-                natural_cracks = convert_to_int(request.form['natural_cracks'])
-                cutting_cracks = convert_to_int(request.form['cutting_cracks'])
-                thickness_issue = convert_to_int(request.form['thickness_issue'])
-
-                ready_time = datetime.datetime.now(pytz.utc).astimezone(eat).strftime("%Y-%m-%d %H:%M:%S")
-
-                cursor.execute('''
-                    INSERT INTO ready_slabs (slab_id, sealant_description, 
-                                             good_slab, defect_line, natural_cracks, cutting_cracks, 
-                                             thickness_issue, ready_time)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (slab_id, sealant_description, good_slab, defect_line, natural_cracks, cutting_cracks, thickness_issue, ready_time))
-                conn.commit()
-
-            # Log movement
-            log_movement(stage="Ready Slabs", details=f"Slab {slab_id} ready with description: {sealant_description}.", slab_id=slab_id)
-
-        except sqlite3.OperationalError as e:
-            print(f"Error: {e}")
+            post_stage_form('ready')
+
+        except (sqlite3.OperationalError, transitions.TransitionError, storage.StorageError):
+            current_app.logger.exception('Could not apply ready transitions')
             return "An error occurred during the transaction."
 
         return redirect(url_for('ready_slabs'))
 
     # Fetch slabs that have been sealed but not marked as ready
     try:
-        with sqlite3.connect(db_path, timeout=30) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT slab_id, sealant_description 
-                FROM sealant 
-                WHERE slab_id NOT IN (SELECT slab_id FROM ready_slabs)
-            ''')
-            slabs = cursor.fetchall()
-            
-            # Fetch ready slabs
-            cursor.execute('SELECT * FROM ready_slabs')
-            ready_slabs_data = cursor.fetchall()
-    except sqlite3.OperationalError as e:
-        print(f"Fetch Error: {e}")
+        _, slabs = storage.get_storage().queue('ready_slabs')
+
+        # Fetch ready slabs
+        page = history_page('ready_slabs')
+        ready_slabs_data = page['rows']
+    except sqlite3.OperationalError:
+        current_app.logger.exception('Could not load the ready_slabs page')
         return "An error occurred during fetching data."
 
-    return render_template('ready_slabs.html', slabs=slabs, ready_slabs_data=ready_slabs_data)
+    return render_history('ready_slabs.html', page, slabs=slabs, ready_slabs_data=ready_slabs_data)
+
+
+# API: a stage's work queue as JSON objects, e.g. /api/stages/polishing/queue
+@route('/api/stages/<stage>/queue')
+def stage_queue(stage):
+    if stage not in QUEUE_QUERIES:
+        return jsonify(error=f"unknown stage '{stage}'", stages=list(QUEUE_QUERIES)), 404
+    names, rows = storage.get_storage().queue(stage)
+    return jsonify([dict(zip(names, row)) for row in rows])
+
+# API: move a batch of slabs into a finishing stage in one transaction. The
+# body is a list of {"slab_id", "description", "good_slab", ...} objects (or
+# {"transitions": [...]}); either every slab moves or none does.
+@route('/api/stages/<stage>/transitions', methods=['POST'])
+def stage_transitions(stage):
+    if stage not in transitions.TRANSITIONS:
+        return jsonify(error=f"unknown stage '{stage}'", stages=list(transitions.TRANSITIONS)), 404
+
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict):
+        payload = payload.get('transitions')
+    if not isinstance(payload, list) or not payload:
+        return jsonify(error='expected a non-empty list of transitions'), 400
+    if len(payload) > current_app.config['TRANSITION_BATCH_LIMIT']:
+        return jsonify(error=f"at most {current_app.config['TRANSITION_BATCH_LIMIT']} transitions per request"), 413
+
+    timestamp = timestamps.now()
+    try:
+        movements = storage.get_storage().apply_transitions(stage, payload, timestamp)
+    except transitions.TransitionError as e:
+        return jsonify(error=str(e), errors=e.errors), 409
+    except (sqlite3.OperationalError, storage.StorageError):
+        current_app.logger.exception('Could not apply %s transitions', stage)
+        return jsonify(error='An error occurred during the transaction.'), 500
+
+    log_movements(movements)
+    return jsonify(stage=stage, applied=len(movements), time=timestamps.to_text(timestamp))
+
+
+# Route: Export a table as CSV or newline-delimited JSON, e.g.
+# /export/movement.ndjson?date_from=2024-01-01&date_to=2024-01-31&stage=Polishing
+# (add archive=1 to include archived rows)
+@route('/export/<table>.<fmt>')
+def export_table(table, fmt):
+    if table not in export.EXPORT_TABLES or fmt not in export.FORMATS:
+        return jsonify(error='unknown table or format', tables=sorted(export.EXPORT_TABLES), formats=sorted(export.FORMATS)), 404
+    filters = {name: request.args.get(name) for name in ('date_from', 'date_to', 'stage')}
+    try:
+        export.export_filters(table, **filters)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    conn = get_db()
+    with_archive = request.args.get('archive') == '1' and archive.attach(conn, current_app.config['ARCHIVE_DATABASE'])
+    chunks = export.generate(conn, table, fmt, with_archive=with_archive, **filters)
+    return Response(stream_with_context(chunks), mimetype=export.FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename={table}.{fmt}'})
+
+
+# CLI: fail when a stage work-queue query stops using an index for its lookups
+@click.command('check-query-plans')
+@with_appcontext
+def check_query_plans_command():
+    """Check that every stage queue query uses an index."""
+    problems = queue_query_problems(get_db())
+    for name, table, plan in problems:
+        click.echo(f'{name}: lookup on {table} does not use an index', err=True)
+        for detail in plan:
+            click.echo(f'    {detail}', err=True)
+    if problems:
+        raise SystemExit(1)
+    click.echo(f'All {len(QUEUE_QUERIES)} queue queries use an index.')
+
+
+# CLI: import a quarry manifest CSV
+@click.command('import-boulders')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@with_appcontext
+def import_boulders_command(path):
+    """Import boulders from a quarry manifest CSV."""
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        report = import_boulders(f)
+    movement_log.get_writer().flush()
+    if 'error' in report:
+        raise click.ClickException(report['error'])
+    for error in report['errors']:
+        click.echo(f"line {error['line']}: {error['error']}", err=True)
+    click.echo(f"Imported {report['imported']} boulders, {report['failed']} rows failed.")
+    if report['failed']:
+        raise SystemExit(1)
 
 
 if __name__ == '__main__':
-    init_db()  # Call this to initialize the database schema
+    app = create_app()
+    migrations.migrate(app.config['DATABASE'])  # Bring the schema up to date for local runs
     app.run(debug=True)
@@ -0,0 +1,303 @@
+import datetime
+import os
+import re
+import sqlite3
+
+import click
+
+import db
+import timestamps
+
+# Cold storage for finished work. Boulders whose slabs have all reached the
+# ready stage are moved, with every stage and movement row that belongs to
+# them, into a separate archive database attached as `archive`. The hot tables
+# then only hold work in progress and recent history, so the stage queues and
+# history pages stay small. Archived boulders are listed in the hot
+# archived_boulder table.
+#
+# Reads never touch the archive unless they ask for it: source() gives a
+# table's hot rows plus its archived rows for history pages, exports and
+# rollup rebuilds that want the whole record.
+
+BOULDER_ROWS = 'boulder_id IN (SELECT boulder_id FROM temp.archiving_boulder)'
+SLAB_ROWS = 'slab_id IN (SELECT slab_id FROM temp.archiving_slab)'
+
+# Archived tables, in copy order: table -> (key column, rows to move). The
+# inventory balance stays hot; it is stock on hand, not history.
+TABLES = {
+    'boulder': ('boulder_id', BOULDER_ROWS),
+    'factory': ('boulder_id', BOULDER_ROWS),
+    'cutting_run': ('run_id', BOULDER_ROWS),
+    'separation': ('separation_id', BOULDER_ROWS),
+    'polishing': ('polishing_id', SLAB_ROWS),
+    'edge_cutting_standard': ('edge_cutting_id', SLAB_ROWS),
+    'edge_cutting_special_orders': ('edge_cutting_id', SLAB_ROWS),
+    'bullnose': ('bullnose_id', SLAB_ROWS),
+    'sealant': ('sealant_id', SLAB_ROWS),
+    'ready_slabs': ('ready_slab_id', SLAB_ROWS),
+    'slab_state': ('slab_id', SLAB_ROWS),
+    'movement': ('movement_id', f'{BOULDER_ROWS} OR {SLAB_ROWS}'),
+}
+
+# Hot rowids of the tables keyed on text (boulder, factory, slab_state) are
+# reused once their top rows are archived, so archived copies of those tables
+# get rowids of their own, counting up from -ARCHIVED_ROWID_BASE: unique
+# across the hot and archived rows, in archiving order, and ahead of every hot
+# row. Tables with an INTEGER PRIMARY KEY keep theirs, which AUTOINCREMENT
+# never hands out again.
+ARCHIVED_ROWID_BASE = 1 << 48
+
+# Boulders whose every slab is ready (a slab cut into special orders counts
+# once its pieces are), oldest first
+ELIGIBLE_SQL = '''
+    SELECT s.boulder_id
+    FROM slab_state s
+    JOIN boulder b ON b.boulder_id = s.boulder_id
+    GROUP BY s.boulder_id
+    HAVING SUM(s.stage NOT IN ('ready', 'special_order_cut')) = 0 AND MAX(s.updated_at) < ?
+    ORDER BY MAX(s.updated_at)
+    LIMIT ?
+'''
+
+
+# Attach the archive database as `archive` if it is not already. With
+# create=False a missing archive file is left alone and False is returned.
+# ATTACH cannot run inside a transaction, so call this before writing.
+def attach(conn, path, create=False):
+    if any(row[1] == 'archive' for row in conn.execute('PRAGMA database_list')):
+        return True
+    if not path or not (create or os.path.exists(path)):
+        return False
+    conn.execute('ATTACH DATABASE ? AS archive', (path,))
+    return True
+
+
+# Whether the connection has an archive with this table
+def has_table(conn, table):
+    try:
+        return conn.execute(
+            "SELECT 1 FROM archive.sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone() is not None
+    except sqlite3.OperationalError:
+        return False
+
+
+# FROM-clause source for a table: the hot table alone, or with its archived
+# rows when asked and available. Either way `rowid` can be selected, filtered
+# and ordered on, and is unique across both (see ARCHIVED_ROWID_BASE).
+def source(conn, table, with_archive=True):
+    if not (with_archive and has_table(conn, table)):
+        return table
+    columns = ', '.join(_columns(conn, 'main', table))
+    return (f'(SELECT {columns}, rowid AS rowid FROM main.{table} '
+            f'UNION ALL SELECT {columns}, rowid FROM archive.{table}) AS {table}')
+
+
+def _columns(conn, schema, table):
+    return [row[1] for row in conn.execute(f'PRAGMA {schema}.table_info({table})')]
+
+
+# Whether a table's key column is its rowid (an INTEGER PRIMARY KEY)
+def _key_is_rowid(conn, table):
+    return any(row[1] == TABLES[table][0] and row[5] == 1 and row[2].upper() == 'INTEGER'
+               for row in conn.execute(f'PRAGMA main.table_info({table})'))
+
+
+# Create an archive table from its hot definition, without foreign keys
+# (which cannot point across databases)
+def _create(conn, table, name):
+    create_sql = conn.execute(
+        "SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone()[0]
+    create_sql = re.sub(r',\s*FOREIGN KEY\([^)]*\) REFERENCES \w+\([^)]*\)[^,)]*', '', create_sql)
+    create_sql = re.sub(r'CREATE TABLE (IF NOT EXISTS )?"?\w+"?', f'CREATE TABLE archive.{name}', create_sql, count=1)
+    conn.execute(create_sql)
+
+
+def _create_indexes(conn, table):
+    for column in ('boulder_id', 'slab_id') + timestamps.COLUMNS.get(table, ()):
+        if column in _columns(conn, 'archive', table) and column != TABLES[table][0]:
+            conn.execute(f'CREATE INDEX IF NOT EXISTS archive.ix_{table}_{column} ON {table} ({column})')
+
+
+# Create any missing archive table, add columns the hot table has gained
+# since, and rebuild tables archived before event times became epoch seconds
+# (migration 12) with their times converted
+def sync_schema(conn):
+    conn.create_function('epoch', 1, timestamps.parse, deterministic=True)
+    for table in TABLES:
+        archived = _columns(conn, 'archive', table)
+        if not archived:
+            _create(conn, table, table)
+            _create_indexes(conn, table)
+            continue
+        hot_types = {row[1]: row[2] for row in conn.execute(f'PRAGMA main.table_info({table})').fetchall()}
+        for column, column_type in hot_types.items():
+            if column not in archived:
+                conn.execute(f'ALTER TABLE archive.{table} ADD COLUMN {column} {column_type}')
+                archived.append(column)
+
+        # Rows archived before ARCHIVED_ROWID_BASE kept their hot rowids
+        if not _key_is_rowid(conn, table):
+            conn.execute(f'UPDATE archive.{table} SET rowid = rowid - ? WHERE rowid > 0', (ARCHIVED_ROWID_BASE,))
+
+        time_columns = timestamps.COLUMNS.get(table, ())
+        types = {row[1]: row[2] for row in conn.execute(f'PRAGMA archive.table_info({table})').fetchall()}
+        if all(types[column] == hot_types[column] for column in time_columns):
+            continue
+        columns = ', '.join(archived)
+        select = ', '.join(f'epoch({column})' if column in time_columns else column for column in archived)
+        _create(conn, table, f'{table}_new')
+        conn.execute(f'INSERT INTO archive.{table}_new (rowid, {columns}) SELECT rowid, {select} FROM archive.{table}')
+        conn.execute(f'DROP TABLE archive.{table}')
+        conn.execute(f'ALTER TABLE archive.{table}_new RENAME TO {table}')
+        _create_indexes(conn, table)
+
+
+# Bring an existing archive database in line with the hot schema, after a
+# migration. A missing archive file is left alone.
+def upgrade(database, archive_path):
+    conn = db.connect(database)
+    conn.isolation_level = None
+    try:
+        if not attach(conn, archive_path):
+            return False
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            sync_schema(conn)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    finally:
+        conn.close()
+    return True
+
+
+# Move one batch of boulders. SQLite only commits attached databases together
+# atomically in rollback-journal mode, and the hot database runs in WAL, so
+# the move is two transactions: copy into the archive (INSERT OR REPLACE, so
+# a repeat is harmless), then delete from the hot tables exactly the rows the
+# archive now holds. A crash in between leaves copies in both databases,
+# which the next run finishes moving. If a row for one of the boulders was
+# written in between (a late movement row, say), deleting the boulder fails
+# its foreign key check; the batch is then rolled back and None returned so
+# the caller can copy it again.
+def _move(conn, boulder_ids):
+    conn.execute('DELETE FROM temp.archiving_boulder')
+    conn.execute('DELETE FROM temp.archiving_slab')
+    conn.executemany('INSERT INTO temp.archiving_boulder (boulder_id) VALUES (?)', [(b,) for b in boulder_ids])
+    conn.execute(f'INSERT INTO temp.archiving_slab (slab_id) SELECT slab_id FROM main.slab_state WHERE {BOULDER_ROWS}')
+
+    moved = {}
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for table, (key, rows) in TABLES.items():
+            columns = ', '.join(_columns(conn, 'main', table))
+            if _key_is_rowid(conn, table):
+                moved[table] = conn.execute(
+                    f'INSERT OR REPLACE INTO archive.{table} ({columns}) SELECT {columns} FROM main.{table} WHERE {rows}'
+                ).rowcount
+                continue
+            last = conn.execute(f'SELECT COALESCE(MAX(rowid), ?) FROM archive.{table}', (-ARCHIVED_ROWID_BASE,)).fetchone()[0]
+            moved[table] = conn.execute(f'''
+                INSERT OR REPLACE INTO archive.{table} (rowid, {columns})
+                SELECT ? + ROW_NUMBER() OVER (ORDER BY rowid), {columns} FROM main.{table} WHERE {rows}
+            ''', (last,)).rowcount
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute(f'''
+            INSERT OR REPLACE INTO main.archived_boulder (boulder_id, date, boulder_description, good_boulder, defect_line,
+                                                          natural_cracks, mining_cracks, undersize, total_boulders)
+            SELECT boulder_id, date, boulder_description, good_boulder, defect_line, natural_cracks, mining_cracks,
+                   undersize, total_boulders
+            FROM archive.boulder WHERE {BOULDER_ROWS}
+        ''')
+        for table, (key, rows) in reversed(TABLES.items()):
+            conn.execute(f'''
+                DELETE FROM main.{table}
+                WHERE ({rows}) AND EXISTS (SELECT 1 FROM archive.{table} a WHERE a.{key} = main.{table}.{key})
+            ''')
+        conn.execute('COMMIT')
+    except sqlite3.IntegrityError:
+        conn.execute('ROLLBACK')
+        return None
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return moved
+
+
+# Archive every eligible boulder whose last slab became ready before
+# `ready_before` (epoch seconds), in batches of `batch_size` boulders.
+# Returns the number of boulders and the rows moved per table.
+def run(conn, archive_path, ready_before, batch_size=500, limit=None):
+    conn.isolation_level = None
+    attach(conn, archive_path, create=True)
+    conn.execute('PRAGMA archive.journal_mode=WAL')
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS archiving_boulder (boulder_id TEXT PRIMARY KEY)')
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS archiving_slab (slab_id TEXT PRIMARY KEY)')
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        sync_schema(conn)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+    boulders = 0
+    retries = 0
+    totals = dict.fromkeys(TABLES, 0)
+    while limit is None or boulders < limit:
+        count = batch_size if limit is None else min(batch_size, limit - boulders)
+        boulder_ids = [row[0] for row in conn.execute(ELIGIBLE_SQL, (ready_before, count))]
+        if not boulder_ids:
+            break
+        moved = _move(conn, boulder_ids)
+        if moved is None:
+            retries += 1
+            if retries > 3:
+                raise RuntimeError('boulders kept changing while being archived; try again later')
+            continue
+        retries = 0
+        for table, rows in moved.items():
+            totals[table] += rows
+        boulders += len(boulder_ids)
+        if len(boulder_ids) < count:
+            break
+    return boulders, totals
+
+
+# Start of the oldest day kept by `archive --days N`: boulders whose last slab
+# became ready before it are archived, so today and the N full days before it
+# stay in the main database
+def ready_cutoff(days, today=None):
+    return timestamps.day_start((today or timestamps.today()) - datetime.timedelta(days=days))
+
+
+# Register the archive command
+def init_app(app):
+    @app.cli.command('archive')
+    @click.option('--days', type=int, default=None,
+                  help='keep boulders whose last slab became ready today or in the last this many full days '
+                       '(default ARCHIVE_AFTER_DAYS; 0 archives everything finished before today)')
+    @click.option('--limit', type=int, default=None, help='archive at most this many boulders')
+    def archive_command(days, limit):
+        """Move finished boulders and their history into the archive database."""
+        days = app.config.get('ARCHIVE_AFTER_DAYS', 30) if days is None else days
+        ready_before = ready_cutoff(days)
+        conn = db.connect(app.config['DATABASE'], app.config.get('DB_TIMEOUT', 30))
+        try:
+            boulders, totals = run(conn, app.config['ARCHIVE_DATABASE'], ready_before,
+                                   app.config.get('ARCHIVE_BATCH_SIZE', 500), limit)
+        finally:
+            conn.close()
+        click.echo(f'Archived {boulders} boulders to {app.config["ARCHIVE_DATABASE"]}.')
+        for table, rows in totals.items():
+            if rows:
+                click.echo(f'  {table}: {rows} rows')
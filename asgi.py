@@ -0,0 +1,179 @@
+import asyncio
+import contextlib
+import sqlite3
+
+import aiosqlite
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+from uvicorn.middleware.wsgi import WSGIMiddleware
+
+import app as inventory
+import migrations
+import search
+import storage
+import timestamps
+import transitions
+import writer
+
+# Async serving mode, for an ASGI server instead of `python app.py`:
+#
+#     uvicorn --factory asgi:create_app --host 0.0.0.0 --port 8000
+#
+# The terminals' JSON workflow (stage queues, bulk stage transitions and
+# search) is served by async handlers. Queues and transitions go through the
+# app's repository (see storage.py), so they work on any backend. On SQLite
+# its async reads use a pool of aiosqlite connections, each running its
+# queries on its own thread, so a slow read holds only its connection while
+# the event loop keeps answering other terminals; writes run the same stage
+# code as the Flask routes on the Flask app's writer thread (see writer.py),
+# so a write waiting for the lock ties up that thread, never the loop or the
+# readers, and in WAL mode readers never wait for the writer. Search reads
+# the SQLite full-text index through the same pool. Every other route (the
+# HTML stage pages, exports, metrics) is the Flask app itself, mounted
+# through uvicorn's WSGI adapter, which runs each request on a thread pool.
+
+
+# Bounded pool of read-only aiosqlite connections
+class AsyncConnectionPool:
+    def __init__(self, database, size=8, timeout=30):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self._idle = []
+        self._slots = asyncio.Semaphore(size)
+
+    async def _connect(self):
+        conn = await aiosqlite.connect(self.database, timeout=self.timeout)
+        await conn.execute(f'PRAGMA busy_timeout={int(self.timeout * 1000)}')
+        await conn.execute('PRAGMA query_only=ON')
+        return conn
+
+    # Borrow a connection for the duration of an `async with` block
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise sqlite3.OperationalError('database connection pool exhausted')
+        try:
+            conn = self._idle.pop() if self._idle else await self._connect()
+            try:
+                yield conn
+            finally:
+                self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+    async def close(self):
+        while self._idle:
+            await self._idle.pop().close()
+
+
+# JSON response encoded like Flask's jsonify, so both modes answer alike
+def _json(request, data, status=200, headers=None):
+    return Response(request.app.state.flask.json.dumps(data), status_code=status, headers=headers,
+                    media_type='application/json')
+
+
+def _int_arg(request, name, default):
+    try:
+        return int(request.query_params[name])
+    except (KeyError, ValueError):
+        return default
+
+
+# API: a stage's work queue as JSON objects (as /api/stages/<stage>/queue in app.py)
+async def stage_queue(request):
+    stage = request.path_params['stage']
+    if stage not in storage.QUEUE_QUERIES:
+        return _json(request, {'error': f"unknown stage '{stage}'", 'stages': list(storage.QUEUE_QUERIES)}, 404)
+    names, rows = await storage.get_storage_of(request.app.state.flask).queue_async(stage)
+    return _json(request, [dict(zip(names, row)) for row in rows])
+
+
+# API: search results as JSON, best match first (as /api/search in app.py)
+async def search_api(request):
+    text = request.query_params.get('q', '').strip()
+    if not text:
+        return _json(request, {'error': 'q is required'}, 400)
+    expression = search.match_expression(text)
+    hits = []
+    if expression is not None:
+        limit = min(_int_arg(request, 'limit', 50), search.MAX_RESULTS)
+        async with request.app.state.readers.connection() as conn:
+            async with conn.execute(search.QUERY_SQL, (expression, limit)) as cursor:
+                hits = [search.hit(row) for row in await cursor.fetchall()]
+    urls = request.app.state.flask.url_map.bind('localhost')
+    return _json(request, [dict(hit, url=urls.build(hit['page'], {'q': hit['page_filter']})) for hit in hits])
+
+
+# API: move a batch of slabs into a finishing stage in one transaction (as
+# /api/stages/<stage>/transitions in app.py)
+async def stage_transitions(request):
+    stage = request.path_params['stage']
+    if stage not in transitions.TRANSITIONS:
+        return _json(request, {'error': f"unknown stage '{stage}'", 'stages': list(transitions.TRANSITIONS)}, 404)
+
+    try:
+        payload = await request.json()
+    except ValueError:
+        payload = None
+    if isinstance(payload, dict):
+        payload = payload.get('transitions')
+    if not isinstance(payload, list) or not payload:
+        return _json(request, {'error': 'expected a non-empty list of transitions'}, 400)
+    flask_app = request.app.state.flask
+    limit = flask_app.config['TRANSITION_BATCH_LIMIT']
+    if len(payload) > limit:
+        return _json(request, {'error': f'at most {limit} transitions per request'}, 413)
+
+    timestamp = timestamps.now()
+    try:
+        movements = await storage.get_storage_of(flask_app).apply_transitions_async(stage, payload, timestamp)
+    except transitions.TransitionError as e:
+        return _json(request, {'error': str(e), 'errors': e.errors}, 409)
+    except (sqlite3.OperationalError, storage.StorageError):
+        flask_app.logger.exception('Could not apply %s transitions', stage)
+        return _json(request, {'error': 'An error occurred during the transaction.'}, 500)
+    except writer.DatabaseBusy as e:
+        flask_app.logger.warning('Database busy on %s: %s', request.url.path, e)
+        return _json(request, {'error': 'The database is busy, try again.'}, 503, {'Retry-After': '1'})
+
+    with flask_app.app_context():
+        inventory.log_movements(movements)
+    return _json(request, {'stage': stage, 'applied': len(movements), 'time': timestamps.to_text(timestamp)})
+
+
+# Open the read pool on startup, close it on shutdown
+@contextlib.asynccontextmanager
+async def lifespan(asgi_app):
+    config = asgi_app.state.flask.config
+    migrations.check_schema(config['DATABASE'])
+    asgi_app.state.readers = AsyncConnectionPool(config['DATABASE'], config['ASGI_READ_POOL_SIZE'], config['DB_TIMEOUT'])
+    repository = storage.get_storage_of(asgi_app.state.flask)
+    if isinstance(repository, storage.SQLiteRepository):
+        repository.readers = asgi_app.state.readers
+    try:
+        yield
+    finally:
+        if isinstance(repository, storage.SQLiteRepository):
+            repository.readers = None
+        await asgi_app.state.readers.close()
+
+
+# Build the ASGI app around a new Flask app (see app.create_app); `config`
+# overrides its settings
+def create_app(config=None):
+    flask_app = inventory.create_app(config)
+    asgi_app = Starlette(
+        routes=[
+            Route('/api/stages/{stage}/queue', stage_queue),
+            Route('/api/stages/{stage}/transitions', stage_transitions, methods=['POST']),
+            Route('/api/search', search_api),
+            Mount('/', WSGIMiddleware(flask_app, workers=flask_app.config['ASGI_WSGI_THREADS'])),
+        ],
+        lifespan=lifespan,
+    )
+    asgi_app.state.flask = flask_app
+    return asgi_app
@@ -0,0 +1,225 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import synthetic
+
+# Time GET and POST on every route against synthetic databases of growing
+# size and save the results as JSON, so runs from different commits can be
+# compared:
+#
+#     python benchmark.py --sizes 1000 10000 100000 --output bench-$(git rev-parse --short HEAD).json
+#
+# Each size runs in a fresh process with INVENTORY_DB_PATH pointing at its
+# scratch database, so no caches or pooled connections carry over.
+
+STAGE_ROUTES = (
+    '/quarry', '/factory', '/cutting_machine_1', '/cutting_machine_2', '/separation', '/polishing',
+    '/edge_cutting_standard', '/edge_cutting_special_orders', '/bullnose', '/sealant', '/ready_slabs',
+)
+
+GET_ROUTES = ('/',) + STAGE_ROUTES + (
+    '/quarry?stream=1', '/polishing?stream=1', '/movement_log/metrics', '/dashboard',
+    '/api/cutting_machines/utilization?by=hour',
+    '/search?q=leathered', '/api/search?q=special+order',
+    '/export/movement.csv', '/export/ready_slabs.ndjson',
+)
+
+FLAGS = {'good_slab': '1', 'defect_line': '0', 'natural_cracks': '0', 'cutting_cracks': '0', 'thickness_issue': '0'}
+
+
+def summarize(samples, status, size):
+    return {
+        'runs': len(samples),
+        'min_ms': round(min(samples), 3),
+        'median_ms': round(statistics.median(samples), 3),
+        'max_ms': round(max(samples), 3),
+        'status': status,
+        'bytes': size,
+    }
+
+
+def timed(call):
+    start = time.perf_counter()
+    response = call()
+    body = response.get_data()  # read streamed bodies to the end
+    return (time.perf_counter() - start) * 1000, response.status_code, len(body)
+
+
+# The requests to time for each POST route: (route, [request kwargs...]),
+# one entry per run, built from whatever is waiting in each queue
+def post_requests(app, conn, repeat):
+    queues = app.QUEUE_QUERIES
+
+    def waiting(queue, count=repeat):
+        return [row[0] for row in conn.execute(queues[queue]).fetchmany(count)]
+
+    now = datetime.datetime(2024, 6, 1, 8, 0)
+    quarry = dict(date='2024-06-01', boulder_description='Black 250x120x120', good_boulder='Yes',
+                  defect_line='No', natural_cracks='No', mining_cracks='No', undersize='No')
+    cutting = waiting('cutting_machine', 2 * repeat)
+    edge = waiting('edge_cutting', 2 * repeat)
+    bulk = waiting('sealant', repeat * 51)
+    manifest = 'date,boulder_description\n' + ''.join(f'2024-06-01,Grey {n}\n' for n in range(100))
+
+    return {
+        'POST /quarry': [dict(data=quarry)] * repeat,
+        'POST /factory': [dict(data={'boulder_id': b, 'good_boulder': 'yes'}) for b in waiting('factory')],
+        'POST /cutting_machine_1': [
+            dict(data={'boulder_id': b, 'start_time': now.isoformat(), 'end_time': (now + datetime.timedelta(hours=3)).isoformat(),
+                       'num_slabs_cut': '12'})
+            for b in cutting[:repeat]
+        ],
+        'POST /separation': [
+            dict(data={'boulder_id[]': b, 'slab_description[]': 'Black 2400x600', 'good_slabs[]': '10', 'defect_line[]': '1',
+                       'natural_cracks[]': '0', 'cutting_cracks[]': '1', 'thickness_issue[]': '0'})
+            for b in waiting('separation')
+        ],
+        'POST /polishing': [dict(data={'slab_id': s, 'polishing_description': 'Gloss', **FLAGS}) for s in waiting('polishing')],
+        'POST /edge_cutting_standard': [
+            dict(data={'slab_id': s, 'edge_cutting_description': 'Straight edge', **FLAGS}) for s in edge[:repeat]
+        ],
+        'POST /edge_cutting_special_orders': [
+            dict(data={'slab_id': s, 'special_order_size[]': ['1', '2'], 'special_order_description[]': ['Top', 'Splash'], **FLAGS})
+            for s in edge[repeat:]
+        ],
+        'POST /bullnose': [dict(data={'slab_id': s, 'bullnose_description': 'Full bullnose', **FLAGS}) for s in waiting('bullnose')],
+        'POST /sealant': [dict(data={'slab_id': s, 'sealant_description': 'Penetrating sealer', **FLAGS}) for s in bulk[:repeat]],
+        'POST /ready_slabs': [dict(data={'slab_id': s, **FLAGS}) for s in waiting('ready_slabs')],
+        'POST /api/stages/sealant/transitions (50 slabs)': [
+            dict(json=[{'slab_id': s, 'description': 'Enhancing sealer', **FLAGS} for s in bulk[start:start + 50]])
+            for start in range(repeat, len(bulk) - 49, 50)
+        ][:repeat],
+        'POST /quarry/import (100 rows)': [dict(data=manifest, content_type='text/csv')] * repeat,
+    }
+
+
+# Time every route of the app in this process and return the results
+def run_routes(repeat):
+    import app as inventory
+
+    app = inventory.create_app()
+    client = app.test_client()
+    results = {}
+
+    for route in GET_ROUTES:
+        timed(lambda: client.get(route))  # warm up
+        runs = [timed(lambda: client.get(route)) for _ in range(repeat)]
+        results[f'GET {route}'] = summarize([r[0] for r in runs], runs[-1][1], runs[-1][2])
+
+    # The stage pages again with the page cache emptied first, i.e. after a write
+    for route in STAGE_ROUTES:
+        def uncached_page():
+            inventory.page_cache.clear(app)
+            return client.get(route)
+
+        runs = [timed(uncached_page) for _ in range(repeat)]
+        results[f'GET {route} (uncached)'] = summarize([r[0] for r in runs], runs[-1][1], runs[-1][2])
+
+    conn = sqlite3.connect(app.config['DATABASE'])
+    try:
+        # A boulder's genealogy, read from the database and then from the cache
+        boulder = conn.execute('SELECT boulder_id FROM separation ORDER BY separation_id LIMIT 1').fetchone()
+        if boulder:
+            route = f'/api/trace/{boulder[0]}'
+
+            def uncached():
+                app.extensions['trace_cache'].clear()
+                return client.get(route)
+
+            runs = [timed(uncached) for _ in range(repeat)]
+            results[f'GET {route} (uncached)'] = summarize([r[0] for r in runs], runs[-1][1], runs[-1][2])
+            runs = [timed(lambda: client.get(route)) for _ in range(repeat)]
+            results[f'GET {route} (cached)'] = summarize([r[0] for r in runs], runs[-1][1], runs[-1][2])
+        requests = post_requests(inventory, conn, repeat)
+    finally:
+        conn.close()
+    for name, calls in requests.items():
+        path = name.split()[1]
+        runs = [timed(lambda: client.post(path, **kwargs)) for kwargs in calls]
+        if runs:
+            results[name] = summarize([r[0] for r in runs], runs[-1][1], runs[-1][2])
+        else:
+            results[name] = {'runs': 0, 'note': 'nothing waiting in the queue'}
+
+    app.extensions['movement_writer'].flush()
+    return results
+
+
+def commit_id():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark every route against synthetic databases.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='slab counts to test')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per route')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON file to write (default: benchmark-<commit>.json)')
+    parser.add_argument('--workdir', help='keep the scratch databases here instead of a temporary directory')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        # Child process: INVENTORY_DB_PATH is already set to the scratch database
+        results = run_routes(args.repeat)
+        with open(args.output, 'w') as f:
+            json.dump(results, f)
+        return
+
+    commit = commit_id()
+    report = {
+        'commit': commit,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'repeat': args.repeat,
+        'sizes': {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.workdir or tmp
+        for size in args.sizes:
+            database = os.path.join(workdir, f'bench-{size}.db')
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(database + suffix):
+                    os.remove(database + suffix)
+            start = time.perf_counter()
+            boulders, slabs = synthetic.generate(database, slabs=size, seed=args.seed)
+            print(f'{size} slabs: generated {boulders} boulders/{slabs} slabs in {time.perf_counter() - start:.1f}s', file=sys.stderr)
+
+            results = os.path.join(workdir, f'bench-{size}.json')
+            worker = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--worker', database, '--repeat', str(args.repeat),
+                 '--output', results],
+                env={**os.environ, 'INVENTORY_DB_PATH': database, 'INVENTORY_LOG_FILE': os.path.join(workdir, 'app.log')}, capture_output=True, text=True,
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+            )
+            if worker.returncode != 0:
+                sys.exit(f'benchmark at {size} slabs failed:\n{worker.stderr}')
+            with open(results) as f:
+                routes = json.load(f)
+            report['sizes'][str(size)] = {'boulders': boulders, 'slabs': slabs, 'routes': routes}
+            for name, result in routes.items():
+                if result['runs']:
+                    print(f"  {name:50} {result['median_ms']:10.2f} ms", file=sys.stderr)
+
+    output = args.output or f"benchmark-{commit or 'local'}.json"
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Wrote {output}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+
+import synthetic
+
+# Side-by-side load test of the two serving modes on copies of one synthetic
+# database:
+#
+#   sync  the Flask app on Werkzeug's threaded server, as `python app.py` runs it
+#   asgi  asgi.py under uvicorn (aiosqlite reads, one writer thread)
+#
+# For each mode, READERS clients keep reading stage queues and search results
+# while WRITERS clients push slabs through the finishing stages with the bulk
+# transition API, and another process takes the write lock every
+# LOCK_INTERVAL seconds and holds it for LOCK_HOLD seconds, so writes hit
+# busy waits. Read and write latencies are reported per mode:
+#
+#     python benchmark_serving.py --slabs 10000 --seconds 20 --output serving.json
+
+MODES = {
+    'sync': lambda port: [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--port', str(port),
+                          '--with-threads', '--no-reload', '--no-debugger'],
+    'asgi': lambda port: [sys.executable, '-m', 'uvicorn', '--factory', 'asgi:create_app', '--port', str(port), '--log-level', 'warning'],
+}
+
+READS = ('/api/stages/polishing/queue', '/api/stages/sealant/queue', '/api/search?q=special+order&limit=20')
+
+# A slab goes through these with one request each
+STAGES = ('edge_cutting', 'bullnose', 'sealant', 'ready')
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))], 3)
+
+
+def summarize(samples, errors, seconds):
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'per_second': round(len(samples) / seconds, 1),
+        'median_ms': round(statistics.median(samples), 3) if samples else None,
+        'p95_ms': percentile(samples, 0.95),
+        'p99_ms': percentile(samples, 0.99),
+        'max_ms': round(max(samples), 3) if samples else None,
+    }
+
+
+# Take the write lock from a separate connection every `interval` seconds for
+# `hold` seconds until `stop` is set
+def hold_lock(database, interval, hold, stop):
+    conn = sqlite3.connect(database, isolation_level=None, timeout=60)
+    try:
+        while not stop.wait(interval):
+            conn.execute('BEGIN IMMEDIATE')
+            time.sleep(hold)
+            conn.execute('COMMIT')
+    finally:
+        conn.close()
+
+
+async def reader(client, deadline, index, samples, errors):
+    while time.perf_counter() < deadline:
+        path = READS[index % len(READS)]
+        index += 1
+        start = time.perf_counter()
+        try:
+            response = await client.get(path)
+            ok = response.status_code == 200
+        except httpx.HTTPError:
+            ok = False
+        if ok:
+            samples.append((time.perf_counter() - start) * 1000)
+        else:
+            errors.append(path)
+
+
+async def writer(client, deadline, slab_ids, samples, errors):
+    for slab_id in slab_ids:
+        for stage in STAGES:
+            if time.perf_counter() >= deadline:
+                return
+            body = [{'slab_id': slab_id, 'description': f'{stage} load test'}]
+            start = time.perf_counter()
+            try:
+                response = await client.post(f'/api/stages/{stage}/transitions', json=body)
+                ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                samples.append((time.perf_counter() - start) * 1000)
+            else:
+                errors.append(stage)
+
+
+async def load(base, readers, writers, seconds, slab_ids):
+    limits = httpx.Limits(max_connections=readers + writers)
+    async with httpx.AsyncClient(base_url=base, limits=limits, timeout=120) as client:
+        deadline = time.perf_counter() + seconds
+        reads, read_errors, writes, write_errors = [], [], [], []
+        tasks = [reader(client, deadline, n, reads, read_errors) for n in range(readers)]
+        tasks += [writer(client, deadline, slab_ids[n::writers], writes, write_errors) for n in range(writers)]
+        await asyncio.gather(*tasks)
+    return {'reads': summarize(reads, len(read_errors), seconds), 'writes': summarize(writes, len(write_errors), seconds)}
+
+
+def wait_for(base, server, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            sys.exit(f'server exited with {server.returncode}')
+        try:
+            httpx.get(base + READS[0], timeout=5)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    sys.exit(f'server at {base} did not start')
+
+
+def run_mode(mode, database, port, args):
+    env = {**os.environ, 'INVENTORY_DB_PATH': database,
+           'INVENTORY_LOG_FILE': os.path.join(os.path.dirname(database), 'app.log')}
+    server = subprocess.Popen(MODES[mode](port), env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    stop = threading.Event()
+    try:
+        base = f'http://127.0.0.1:{port}'
+        wait_for(base, server)
+        slab_ids = [slab['slab_id'] for slab in httpx.get(base + '/api/stages/edge_cutting/queue', timeout=60).json()]
+        locker = threading.Thread(target=hold_lock, args=(database, args.lock_interval, args.lock_hold, stop), daemon=True)
+        locker.start()
+        results = asyncio.run(load(base, args.readers, args.writers, args.seconds, slab_ids))
+    finally:
+        stop.set()
+        server.terminate()
+        server.wait()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the sync and ASGI serving modes side by side.')
+    parser.add_argument('--slabs', type=int, default=10000, help='size of the synthetic database')
+    parser.add_argument('--seconds', type=float, default=20, help='load duration per mode')
+    parser.add_argument('--readers', type=int, default=20, help='concurrent reading clients')
+    parser.add_argument('--writers', type=int, default=2, help='concurrent writing clients')
+    parser.add_argument('--lock-interval', type=float, default=1.0, help='seconds between outside write locks')
+    parser.add_argument('--lock-hold', type=float, default=0.2, help='seconds each outside write lock is held')
+    parser.add_argument('--modes', nargs='+', choices=sorted(MODES), default=['sync', 'asgi'])
+    parser.add_argument('--port', type=int, default=8710)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON file to write (default: print only)')
+    args = parser.parse_args()
+
+    report = {
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'settings': {name: getattr(args, name) for name in ('slabs', 'seconds', 'readers', 'writers', 'lock_interval', 'lock_hold')},
+        'modes': {},
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        source = os.path.join(workdir, 'source.db')
+        synthetic.generate(source, slabs=args.slabs, seed=args.seed)
+        for number, mode in enumerate(args.modes):
+            # Every mode starts from the same data
+            database = os.path.join(workdir, f'{mode}.db')
+            shutil.copy(source, database)
+            results = report['modes'][mode] = run_mode(mode, database, args.port + number, args)
+            for kind in ('reads', 'writes'):
+                r = results[kind]
+                print(f"{mode:5} {kind:6} {r['per_second']:8.1f}/s  median {r['median_ms']} ms  p95 {r['p95_ms']} ms  "
+                      f"p99 {r['p99_ms']} ms  max {r['max_ms']} ms  errors {r['errors']}", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Wrote {args.output}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+# Boulder IDs are M<prefix><nnn>, where the prefix is the first letter of the
+# boulder's color. boulder_sequence keeps the last number handed out for each
+# prefix, so an ID is never reused, even after its boulder is deleted or archived.
+
+RESERVE_SQL = '''
+    INSERT INTO boulder_sequence (prefix, last_number) VALUES (?, ?)
+    ON CONFLICT(prefix) DO UPDATE SET last_number = last_number + excluded.last_number
+    RETURNING last_number
+'''
+
+
+# The ID prefix of a color, e.g. 'Black' -> 'B'
+def color_prefix(color):
+    return color[0].upper()
+
+
+# Reserve `count` consecutive numbers for a prefix and return them as a range.
+# The increment is a single upsert on the caller's connection: it takes the
+# write lock, so concurrent workers are serialized and the block belongs to
+# the caller's transaction (a rollback hands the numbers back).
+def reserve(conn, prefix, count=1):
+    last = conn.execute(RESERVE_SQL, (prefix, count)).fetchone()[0]
+    return range(last - count + 1, last + 1)
+
+
+# Allocate `count` new boulder IDs for a color
+def allocate(conn, color, count=1):
+    prefix = color_prefix(color)
+    return [f'M{prefix}{number:03d}' for number in reserve(conn, prefix, count)]
+
+
+# Start every prefix after the highest number already used by a current or
+# archived boulder
+def seed(conn):
+    conn.execute('''
+        INSERT INTO boulder_sequence (prefix, last_number)
+        SELECT substr(boulder_id, 2, 1), MAX(CAST(substr(boulder_id, 3) AS INTEGER))
+        FROM (SELECT boulder_id FROM boulder UNION ALL SELECT boulder_id FROM archived_boulder)
+        WHERE boulder_id GLOB 'M[A-Z][0-9]*'
+        GROUP BY substr(boulder_id, 2, 1)
+        ON CONFLICT(prefix) DO UPDATE SET last_number = MAX(last_number, excluded.last_number)
+    ''')
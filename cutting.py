@@ -0,0 +1,58 @@
+import click
+
+import rollups
+import storage
+
+# The cutting section: every saw is a row in cutting_machine, and every boulder
+# cut is one cutting_run row tagged with the saw's machine_id. Adding a saw is
+#
+#     flask --app app add-cutting-machine "Cutting Machine 3"
+#
+# and needs no query, route or template changes.
+
+RUN_INSERT_SQL = '''
+    INSERT INTO cutting_run (machine_id, boulder_id, boulder_description, num_slabs_cut, start_time, end_time, machine_hours)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+# Every configured machine as (machine_id, name), in ID order
+def machines(conn):
+    return conn.execute('SELECT machine_id, name FROM cutting_machine ORDER BY machine_id').fetchall()
+
+
+# Slabs cut per boulder for the given boulder IDs, with one grouped query per
+# 500 IDs; boulders that have not been cut are left out
+def slabs_cut(conn, boulder_ids):
+    counts = {}
+    for start in range(0, len(boulder_ids), 500):
+        chunk = boulder_ids[start:start + 500]
+        placeholders = ', '.join('?' * len(chunk))
+        counts.update(conn.execute(f'''
+            SELECT boulder_id, COALESCE(SUM(num_slabs_cut), 0)
+            FROM cutting_run
+            WHERE boulder_id IN ({placeholders})
+            GROUP BY boulder_id
+        ''', chunk).fetchall())
+    return counts
+
+
+# Record one run on the caller's connection, with its production and
+# utilization rollups, so they all commit together
+def record_run(conn, machine_id, boulder_id, description, num_slabs_cut, start_time, end_time, machine_hours):
+    conn.execute(RUN_INSERT_SQL, (machine_id, boulder_id, description, num_slabs_cut, start_time, end_time, machine_hours))
+    rollups.add_boulders(conn, 'cutting', [(start_time, 0, 0, 0, 0, 0, num_slabs_cut, machine_hours)])
+    rollups.add_cutting_runs(conn, [(machine_id, start_time, end_time, num_slabs_cut, machine_hours)])
+
+
+# Register the add-cutting-machine command
+def init_app(app):
+    @app.cli.command('add-cutting-machine')
+    @click.argument('name')
+    def add_machine_command(name):
+        """Add a cutting machine; it gets its own page at /cutting_machine_<id>."""
+        try:
+            machine_id = storage.get_storage().add_cutting_machine(name)
+        except storage.Conflict:
+            raise click.ClickException(f'A cutting machine named "{name}" already exists.')
+        click.echo(f'Added {name} as machine {machine_id} (/cutting_machine_{machine_id}).')
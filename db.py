@@ -0,0 +1,86 @@
+import queue
+import sqlite3
+import threading
+
+from flask import current_app, g
+
+import metrics
+
+
+# Open a connection and apply the per-connection pragmas once. Statements are
+# counted and timed for /metrics and the slow-query log (see metrics.py).
+def connect(database, timeout=30):
+    conn = sqlite3.connect(database, timeout=timeout, check_same_thread=False, factory=metrics.TracedConnection)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA foreign_keys=ON')
+    conn.execute(f'PRAGMA busy_timeout={int(timeout * 1000)}')
+    return conn
+
+
+# Bounded pool of SQLite connections shared by all requests of an app
+class ConnectionPool:
+    def __init__(self, database, size=5, timeout=30):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    # Hand out an idle connection, opening one if the pool is not yet full
+    def acquire(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError('database connection pool exhausted')
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return connect(self.database, self.timeout)
+        except Exception:
+            self._slots.release()
+            raise
+
+    # Return a connection to the pool, discarding any uncommitted work
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+        else:
+            self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    # Close every idle connection (used on shutdown and in scripts)
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+# Get the connection bound to the current request, acquiring it on first use
+def get_db():
+    if 'db' not in g:
+        g.db = current_app.extensions['db_pool'].acquire()
+    return g.db
+
+
+# Give the request's connection back to the pool when the app context ends
+def close_db(exc=None):
+    conn = g.pop('db', None)
+    if conn is not None:
+        current_app.extensions['db_pool'].release(conn)
+
+
+# Attach a connection pool to the Flask app
+def init_app(app):
+    app.extensions['db_pool'] = ConnectionPool(
+        app.config['DATABASE'],
+        size=app.config.get('DB_POOL_SIZE', 5),
+        timeout=app.config.get('DB_TIMEOUT', 30),
+    )
+    app.teardown_appcontext(close_db)
@@ -0,0 +1,150 @@
+import csv
+import datetime
+import io
+import json
+import sys
+
+import click
+
+import archive
+import db
+import timestamps
+from pagination import HISTORY_TABLES
+
+# Exportable tables: table -> (timestamp column or None, has a stage column)
+EXPORT_TABLES = {
+    'movement': ('date', True),
+    'inventory': (None, True),
+}
+EXPORT_TABLES.update({table: (time_column, False) for table, (time_column, _) in HISTORY_TABLES.items()})
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+# Build the WHERE clause and parameters for an export's filters. Dates are
+# YYYY-MM-DD and inclusive, compared as epoch seconds on event times; stage
+# only applies to movement and inventory.
+def export_filters(table, date_from=None, date_to=None, stage=None):
+    time_column, has_stage = EXPORT_TABLES[table]
+    bound = timestamps.day_start if time_column in timestamps.COLUMNS.get(table, ()) else datetime.date.isoformat
+    clauses = []
+    params = []
+    if time_column and date_from:
+        clauses.append(f'{time_column} >= ?')
+        params.append(bound(datetime.date.fromisoformat(date_from)))
+    if time_column and date_to:
+        clauses.append(f'{time_column} < ?')
+        params.append(bound(datetime.date.fromisoformat(date_to) + datetime.timedelta(days=1)))
+    if has_stage and stage:
+        clauses.append('stage = ?')
+        params.append(stage)
+    return clauses, params
+
+
+# Column names of a table, in order
+def columns(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+
+# Yield the matching rows of a table in rowid order. Each chunk is its own
+# short query that resumes after the last rowid seen, so no read transaction
+# stays open between chunks and WAL checkpoints are never held back by a
+# long export; rows are pulled off each chunk's cursor with fetchmany.
+# With `with_archive` (the archive must be attached) archived rows are included.
+def export_rows(conn, table, date_from=None, date_to=None, stage=None, chunk_size=5000, with_archive=False):
+    clauses, params = export_filters(table, date_from, date_to, stage)
+    select = ', '.join(columns(conn, table))
+    source = archive.source(conn, table, with_archive)
+    last = None
+    while True:
+        where = clauses + (['rowid > ?'] if last is not None else [])
+        sql = f"SELECT {select}, rowid FROM {source} {'WHERE ' + ' AND '.join(where) if where else ''} ORDER BY rowid LIMIT ?"
+        cursor = conn.execute(sql, params + ([last] if last is not None else []) + [chunk_size])
+        count = 0
+        while True:
+            rows = cursor.fetchmany(500)
+            if not rows:
+                break
+            for row in rows:
+                yield row[:-1]
+            count += len(rows)
+            last = rows[-1][-1]
+        if count < chunk_size:
+            return
+
+
+# Encode rows as CSV text with a header line, a batch of rows at a time
+def to_csv(names, rows, batch_size=500):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+# Encode rows as one JSON object per line, a batch of rows at a time
+def to_ndjson(names, rows, batch_size=500):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(names, row)), ensure_ascii=False) + '\n')
+        if len(lines) >= batch_size:
+            yield ''.join(lines)
+            lines = []
+    yield ''.join(lines)
+
+
+# Local 'YYYY-MM-DD HH:MM:SS' text in place of the epoch times of each row
+def _local_times(rows, positions):
+    for row in rows:
+        row = list(row)
+        for position in positions:
+            row[position] = timestamps.to_text(row[position])
+        yield row
+
+
+# Stream an export as text chunks in the given format. Event times are written
+# as local time text, as they are shown on the pages.
+def generate(conn, table, fmt, date_from=None, date_to=None, stage=None, with_archive=False):
+    names = columns(conn, table)
+    rows = export_rows(conn, table, date_from, date_to, stage, with_archive=with_archive)
+    positions = [names.index(column) for column in timestamps.COLUMNS.get(table, ()) if column in names]
+    if positions:
+        rows = _local_times(rows, positions)
+    encode = to_csv if fmt == 'csv' else to_ndjson
+    return encode(names, rows)
+
+
+# Register the export command
+def init_app(app):
+    @app.cli.command('export')
+    @click.argument('table', type=click.Choice(sorted(EXPORT_TABLES)))
+    @click.option('--format', 'fmt', type=click.Choice(sorted(FORMATS)), default='csv', show_default=True)
+    @click.option('--from', 'date_from', help='First day to include (YYYY-MM-DD).')
+    @click.option('--to', 'date_to', help='Last day to include (YYYY-MM-DD).')
+    @click.option('--stage', help='Only rows at this stage (movement and inventory).')
+    @click.option('--archive', 'with_archive', is_flag=True, help='Include archived rows.')
+    @click.option('--output', '-o', type=click.Path(dir_okay=False), help='File to write instead of stdout.')
+    def export_command(table, fmt, date_from, date_to, stage, with_archive, output):
+        """Export a table as CSV or newline-delimited JSON."""
+        try:
+            export_filters(table, date_from, date_to, stage)
+        except ValueError as e:
+            raise click.BadParameter(str(e))
+        conn = db.connect(app.config['DATABASE'], app.config.get('DB_TIMEOUT', 30))
+        with_archive = with_archive and archive.attach(conn, app.config.get('ARCHIVE_DATABASE'))
+        out = open(output, 'w', encoding='utf-8', newline='') if output else sys.stdout
+        try:
+            for chunk in generate(conn, table, fmt, date_from, date_to, stage, with_archive):
+                out.write(chunk)
+        finally:
+            if output:
+                out.close()
+            conn.close()
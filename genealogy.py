@@ -0,0 +1,156 @@
+import archive
+import timestamps
+
+# Everything that happened to one boulder: quarry, factory and cutting, then
+# every slab separated from it with its finishing stages, and the special
+# orders cut from each slab with theirs. One query reads it all; the slab tree
+# comes from a recursive CTE that follows '<slab>_OS###' children down from the
+# separated slabs through the slab_id index of edge_cutting_special_orders.
+#
+# Every row is one event: (stage, slab_id, parent_id, time, description, five
+# flags, detail, end_time, slabs_cut, hours). Boulder events have no slab_id
+# and carry the boulder flags (good, defect_line, natural_cracks,
+# mining_cracks, undersize); slab events carry the slab flags (good,
+# defect_line, natural_cracks, cutting_cracks, thickness_issue). A 'current'
+# row per slab gives its slab_state stage in `detail`.
+
+BOULDER_FLAGS = ('good_boulder', 'defect_line', 'natural_cracks', 'mining_cracks', 'undersize')
+SLAB_FLAGS = ('good_slab', 'defect_line', 'natural_cracks', 'cutting_cracks', 'thickness_issue')
+
+TRACE_SQL = '''
+    WITH RECURSIVE slabs (slab_id, parent_id) AS (
+        SELECT slab_id, NULL FROM {separation} WHERE boulder_id = :boulder_id
+        UNION
+        SELECT edge_cutting_special_orders.slab_id, s.slab_id
+        FROM slabs s
+        JOIN {edge_cutting_special_orders}
+            ON edge_cutting_special_orders.slab_id > s.slab_id || '_OS'
+           AND edge_cutting_special_orders.slab_id < s.slab_id || '_OT'
+    )
+    SELECT 'quarry', NULL, NULL, date, boulder_description, good_boulder, defect_line, natural_cracks,
+           mining_cracks, undersize, color, NULL, NULL, NULL
+    FROM {boulder} WHERE boulder_id = :boulder_id
+    UNION ALL
+    SELECT 'factory', NULL, NULL, received_timestamp, boulder_description, good_boulder, defect_line,
+           natural_cracks, mining_cracks, undersize, NULL, NULL, NULL, NULL
+    FROM {factory} WHERE boulder_id = :boulder_id
+    UNION ALL
+    SELECT 'cutting', NULL, NULL, start_time, boulder_description, NULL, NULL, NULL, NULL, NULL,
+           COALESCE(m.name, 'Machine ' || cutting_run.machine_id), end_time, num_slabs_cut, machine_hours
+    FROM {cutting_run} LEFT JOIN cutting_machine m ON m.machine_id = cutting_run.machine_id
+    WHERE boulder_id = :boulder_id
+    UNION ALL
+    SELECT 'separation', slab_id, NULL, separation_time, slab_description, good_slabs, defect_line,
+           natural_cracks, cutting_cracks, thickness_issue, NULL, NULL, NULL, NULL
+    FROM {separation} WHERE boulder_id = :boulder_id
+    UNION ALL
+    SELECT 'polishing', slab_id, parent_id, polishing_time, polishing_description, good_slab,
+           defect_line, natural_cracks, cutting_cracks, thickness_issue, original_status, NULL, NULL, NULL
+    FROM slabs JOIN {polishing} USING (slab_id)
+    UNION ALL
+    SELECT 'edge_cutting', slab_id, parent_id, edge_cutting_time, edge_cutting_description, good_slab,
+           defect_line, natural_cracks, cutting_cracks, thickness_issue, NULL, NULL, NULL, NULL
+    FROM slabs JOIN {edge_cutting_standard} USING (slab_id)
+    UNION ALL
+    SELECT 'special_order', slab_id, parent_id, edge_cutting_time, edge_cutting_description, good_slab,
+           defect_line, natural_cracks, cutting_cracks, thickness_issue, special_order_details, NULL, NULL, NULL
+    FROM slabs JOIN {edge_cutting_special_orders} USING (slab_id)
+    UNION ALL
+    SELECT 'bullnose', slab_id, parent_id, bullnose_time, bullnose_description, good_slab,
+           defect_line, natural_cracks, cutting_cracks, thickness_issue, NULL, NULL, NULL, NULL
+    FROM slabs JOIN {bullnose} USING (slab_id)
+    UNION ALL
+    SELECT 'sealant', slab_id, parent_id, sealant_time, sealant_description, good_slab,
+           defect_line, natural_cracks, cutting_cracks, thickness_issue, NULL, NULL, NULL, NULL
+    FROM slabs JOIN {sealant} USING (slab_id)
+    UNION ALL
+    SELECT 'ready', slab_id, parent_id, ready_time, sealant_description, good_slab,
+           defect_line, natural_cracks, cutting_cracks, thickness_issue, NULL, NULL, NULL, NULL
+    FROM slabs JOIN {ready_slabs} USING (slab_id)
+    UNION ALL
+    SELECT 'current', slab_id, parent_id, updated_at, description, good_slab,
+           defect_line, natural_cracks, cutting_cracks, thickness_issue, stage, NULL, NULL, NULL
+    FROM slabs JOIN {slab_state} USING (slab_id)
+    ORDER BY 4, 2
+'''
+
+# What a boulder's cached tree depends on, read through primary keys and the
+# boulder_id indexes: its quarry and factory rows, its cutting runs, and its
+# slabs' stages. A transition always changes a slab's stage, so any move of
+# one of the boulder's slabs changes this row while writes to other boulders
+# leave it alone.
+STATE_SQL = '''
+    SELECT b.date, b.boulder_description, b.color, b.good_boulder, b.defect_line, b.natural_cracks,
+           b.mining_cracks, b.undersize, f.received_timestamp, f.boulder_description, f.good_boulder,
+           f.defect_line, f.natural_cracks, f.mining_cracks, f.undersize,
+           (SELECT COUNT(*) || ':' || COALESCE(MAX(rowid), '') FROM cutting_run WHERE boulder_id = :boulder_id),
+           (SELECT COUNT(*) || ':' || COALESCE(MAX(updated_at), '') || ':' || COALESCE(GROUP_CONCAT(stage), '')
+            FROM slab_state WHERE boulder_id = :boulder_id)
+    FROM (SELECT :boulder_id AS boulder_id) k
+    LEFT JOIN boulder b USING (boulder_id)
+    LEFT JOIN factory f USING (boulder_id)
+'''
+
+TABLES = ('boulder', 'factory', 'cutting_run', 'separation', 'polishing', 'edge_cutting_standard',
+          'edge_cutting_special_orders', 'bullnose', 'sealant', 'ready_slabs', 'slab_state')
+
+
+# Whether a boulder has been moved to the archive database
+def is_archived(conn, boulder_id):
+    return conn.execute('SELECT 1 FROM archived_boulder WHERE boulder_id = ?', (boulder_id,)).fetchone() is not None
+
+
+# The boulder's current STATE_SQL row, to key its cached tree on
+def state(conn, boulder_id):
+    return tuple(conn.execute(STATE_SQL, {'boulder_id': boulder_id}).fetchone())
+
+
+def _flags(names, row):
+    return dict(zip(names, row[5:10]))
+
+
+# The boulder's genealogy as a nested dict, or None if there is no such
+# boulder. Archived rows are read too when the archive is attached and
+# with_archive is set.
+def trace(conn, boulder_id, with_archive=False):
+    sources = {table: archive.source(conn, table, with_archive) for table in TABLES}
+    rows = conn.execute(TRACE_SQL.format(**sources), {'boulder_id': boulder_id}).fetchall()
+    if not rows:
+        return None
+
+    tree = {'boulder_id': boulder_id, 'quarry': None, 'factory': None, 'cutting': [], 'slabs': []}
+    slabs = {}
+    for row in rows:
+        stage, slab_id, parent_id, time, description = row[:5]
+        time = timestamps.to_text(time)
+        if slab_id is None:
+            event = {'time': time, 'description': description}
+            if stage == 'cutting':
+                event.update(machine=row[10], end_time=timestamps.to_text(row[11]), slabs_cut=row[12], machine_hours=row[13])
+                tree['cutting'].append(event)
+            else:
+                event.update(_flags(BOULDER_FLAGS, row))
+                if stage == 'quarry':
+                    event['color'] = row[10]
+                tree[stage] = event
+            continue
+
+        slab = slabs.get(slab_id)
+        if slab is None:
+            slab = slabs[slab_id] = {'slab_id': slab_id, 'parent_id': parent_id, 'stage': None,
+                                     'updated_at': None, 'history': [], 'special_orders': []}
+        if stage == 'current':
+            slab.update(stage=row[10], updated_at=time, description=description, **_flags(SLAB_FLAGS, row))
+            continue
+        event = {'stage': stage, 'time': time, 'description': description, **_flags(SLAB_FLAGS, row)}
+        if row[10] is not None:
+            event['original_status' if stage == 'polishing' else 'details'] = row[10]
+        slab['history'].append(event)
+
+    for slab in slabs.values():
+        parent = slabs.get(slab['parent_id'])
+        (parent['special_orders'] if parent else tree['slabs']).append(slab)
+    for slab in slabs.values():
+        slab['special_orders'].sort(key=lambda child: child['slab_id'])
+    tree['slabs'].sort(key=lambda slab: slab['slab_id'])
+    return tree
@@ -0,0 +1,258 @@
+import contextlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+from flask import g, request
+
+# In-process request and SQL metrics, exposed in the Prometheus text format
+# at /metrics. Everything is a few counter updates per statement or request,
+# so it stays on in production.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+slow_query_log = logging.getLogger('inventory.slow_query')
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        lines += [f'{self.name}{_labels(self.labelnames, labels)} {value}' for labels, value in values]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._values = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+            counts[-1] += value
+
+    def collect(self):
+        with self._lock:
+            values = sorted((labels, list(counts)) for labels, counts in self._values.items())
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        names = self.labelnames + ('le',)
+        for labels, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{_labels(names, labels + (le,))} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {counts[-1]}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+
+request_duration = Histogram('http_request_duration_seconds', 'Time to handle a request, by endpoint.',
+                             ('endpoint', 'method'))
+requests_total = Counter('http_requests_total', 'Requests handled, by endpoint and status.',
+                         ('endpoint', 'method', 'status'))
+sql_statements = Counter('sqlite_statements_total', 'SQL statements run (each executemany row counts), by endpoint.',
+                         ('endpoint',))
+sql_duration = Histogram('sqlite_request_query_seconds', 'Time spent in SQL per request, by endpoint.',
+                         ('endpoint',))
+slow_statements = Counter('sqlite_slow_statements_total', 'Statements slower than SLOW_QUERY_MS, by endpoint.',
+                          ('endpoint',))
+
+REGISTRY = [request_duration, requests_total, sql_statements, sql_duration, slow_statements]
+
+# Per-thread SQL totals of the request being handled (None outside requests)
+_current = threading.local()
+_slow_query_seconds = 0.2
+
+
+# Render every metric, and an app's gauges, in the Prometheus text exposition format
+def render(gauges=None):
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.collect()
+    for name, (documentation, read) in sorted((gauges or {}).items()):
+        lines += [f'# HELP {name} {documentation}', f'# TYPE {name} gauge', f'{name} {read()}']
+    return '\n'.join(lines) + '\n'
+
+
+# SQL totals of the request handled on this thread (None outside requests)
+def current_stats():
+    return getattr(_current, 'stats', None)
+
+
+# Count this thread's statements into `stats` for the duration of the block;
+# the writer thread runs each write under the stats of the request that
+# submitted it, so writes are counted for that endpoint
+@contextlib.contextmanager
+def bound(stats):
+    previous = getattr(_current, 'stats', None)
+    _current.stats = stats
+    try:
+        yield
+    finally:
+        _current.stats = previous
+
+
+def _endpoint():
+    stats = getattr(_current, 'stats', None)
+    return stats['endpoint'] if stats else 'background'
+
+
+def _record(sql, seconds):
+    stats = getattr(_current, 'stats', None)
+    if stats is not None:
+        stats['seconds'] += seconds
+    if seconds >= _slow_query_seconds:
+        endpoint = _endpoint()
+        slow_statements.inc(endpoint)
+        slow_query_log.warning('%.1f ms on %s: %s', seconds * 1000, endpoint, re.sub(r'\s+', ' ', sql).strip()[:1000])
+
+
+# The trace hook fires for every statement SQLite runs, including each row of
+# an executemany and implicit BEGIN/COMMIT, so it counts statements; it has no
+# timing, so durations come from the timed execute calls below.
+def _on_statement(sql):
+    stats = getattr(_current, 'stats', None)
+    if stats is not None:
+        stats['statements'] += 1
+    else:
+        sql_statements.inc('background')
+
+
+class TracedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record(sql, time.perf_counter() - start)
+
+
+# Connection class for db.connect: times every execute and counts statements
+class TracedConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.set_trace_callback(_on_statement)
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            _record('COMMIT', time.perf_counter() - start)
+
+
+def _start_request():
+    g.metrics_start = time.perf_counter()
+    _current.stats = {'endpoint': request.endpoint or 'unmatched', 'statements': 0, 'seconds': 0.0}
+
+
+def _finish_request(response):
+    stats = getattr(_current, 'stats', None)
+    if stats is not None:
+        stats['status'] = str(response.status_code)
+    return response
+
+
+# Account for the request once it is completely done; for a streamed
+# response that is after the last chunk has been sent
+def _end_request(exc=None):
+    stats = getattr(_current, 'stats', None)
+    start = g.pop('metrics_start', None)
+    _current.stats = None
+    if stats is None or start is None:
+        return
+    endpoint = stats['endpoint']
+    status = stats.get('status', '500')
+    request_duration.observe(time.perf_counter() - start, endpoint, request.method)
+    requests_total.inc(endpoint, request.method, status)
+    sql_statements.inc(endpoint, amount=stats['statements'])
+    sql_duration.observe(stats['seconds'], endpoint)
+
+
+# Attach request timing and the slow-query log to the Flask app
+def init_app(app):
+    global _slow_query_seconds
+    _slow_query_seconds = app.config.get('SLOW_QUERY_MS', 200) / 1000
+
+    log_file = app.config.get('LOG_FILE')
+    if log_file and not slow_query_log.handlers:
+        os.makedirs(os.path.dirname(log_file) or '.', exist_ok=True)
+        handler = RotatingFileHandler(log_file, maxBytes=10 * 1024 * 1024, backupCount=5)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s %(message)s'))
+        slow_query_log.addHandler(handler)
+        slow_query_log.setLevel(logging.WARNING)
+        # Only to the log file, not through the root logger to stderr
+        slow_query_log.propagate = False
+    # The app's own error log (failed writes, busy database) goes to the same
+    # file, and to stderr as Flask sets it up
+    for handler in slow_query_log.handlers:
+        if handler not in app.logger.handlers:
+            app.logger.addHandler(handler)
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_end_request)
+    # Extra gauges of this app, collected at scrape time: name -> (help, function returning a number)
+    app.extensions['metrics_gauges'] = {}
+
+
+# Add a gauge to the app's /metrics output
+def add_gauge(app, name, documentation, read):
+    app.extensions['metrics_gauges'][name] = (documentation, read)
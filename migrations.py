@@ -0,0 +1,648 @@
+import datetime
+import logging
+import re
+import sqlite3
+
+import click
+
+import archive
+import boulder_ids
+import page_cache
+import rollups
+import search
+import slab_state
+import timestamps
+
+logger = logging.getLogger(__name__)
+
+# Raised when the database is behind the migrations shipped with the code
+class SchemaOutOfDate(RuntimeError):
+    pass
+
+
+# Migration 1: the original schema, as init_db used to create it
+def create_base_schema(cursor):
+    cursor.execute('DROP TABLE IF EXISTS boulder_archive')
+    cursor.execute('DROP TABLE IF EXISTS slab')
+
+    # Drop and recreate the boulder table
+    #cursor.execute('DROP TABLE IF EXISTS boulder')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS boulder (
+            boulder_id TEXT PRIMARY KEY,
+            date TEXT,
+            boulder_description TEXT,
+            color TEXT,
+            good_boulder INTEGER,
+            defect_line INTEGER,
+            natural_cracks INTEGER,
+            mining_cracks INTEGER,
+            undersize INTEGER,
+            total_boulders INTEGER
+        )
+    ''')
+
+    # Drop and recreate the factory table
+    #cursor.execute('DROP TABLE IF EXISTS factory')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS factory (
+            boulder_id TEXT PRIMARY KEY,
+            boulder_description TEXT,
+            good_boulder INTEGER,
+            defect_line INTEGER,
+            natural_cracks INTEGER,
+            mining_cracks INTEGER,
+            undersize INTEGER,
+            total_boulders INTEGER,
+            received_timestamp TEXT,
+            FOREIGN KEY(boulder_id) REFERENCES boulder(boulder_id)
+        )
+    ''')
+
+    # Slabs table
+    #cursor.execute('DROP TABLE IF EXISTS slabs')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS slabs (
+            slab_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            boulder_id TEXT,
+            description TEXT,
+            good_slabs INTEGER,
+            defect_line INTEGER,
+            natural_cracks INTEGER,
+            cutting_cracks INTEGER,
+            thickness_issue INTEGER,
+            total_slabs INTEGER,
+            FOREIGN KEY(boulder_id) REFERENCES boulder(boulder_id)
+        )
+    ''')
+
+    # Cutting Machine 1
+    #cursor.execute('DROP TABLE IF EXISTS cutting_machine_1')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cutting_machine_1 (
+            machine_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            boulder_id TEXT,
+            boulder_description TEXT,
+            num_slabs_cut INTEGER,
+            start_time TEXT,
+            end_time TEXT,
+            machine_hours REAL,
+            FOREIGN KEY(boulder_id) REFERENCES boulder(boulder_id)
+        )
+    ''')
+
+    # Cutting Machine 2
+    #cursor.execute('DROP TABLE IF EXISTS cutting_machine_2')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cutting_machine_2 (
+            machine_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            boulder_id TEXT,
+            boulder_description TEXT,
+            num_slabs_cut INTEGER,
+            start_time TEXT,
+            end_time TEXT,
+            machine_hours REAL,
+            FOREIGN KEY(boulder_id) REFERENCES boulder(boulder_id)
+        )
+    ''')
+
+    # Separation table
+    #cursor.execute('DROP TABLE IF EXISTS separation')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS separation (
+            separation_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            boulder_id TEXT,
+            boulder_description TEXT,
+            slab_id TEXT,
+            slab_description TEXT,
+            good_slabs INTEGER,
+            defect_line INTEGER,
+            natural_cracks INTEGER,
+            cutting_cracks INTEGER,
+            thickness_issue INTEGER,
+            total_slabs INTEGER,
+            separation_time TEXT,
+            FOREIGN KEY(boulder_id) REFERENCES boulder(boulder_id)
+        )
+    ''')
+
+    #Polishing table
+    #cursor.execute('DROP TABLE IF EXISTS polishing')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS polishing (
+            polishing_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            slab_id TEXT,
+            slab_description TEXT,
+            original_status TEXT,
+            polishing_description TEXT,
+            good_slab INTEGER, 
+            defect_line INTEGER,
+            natural_cracks INTEGER, 
+            cutting_cracks INTEGER, 
+            thickness_issue INTEGER,
+            polishing_time TEXT
+        ) 
+    ''')
+    
+    # Edge Cutting Standard Table 
+    #cursor.execute('DROP TABLE IF EXISTS edge_cutting_standard')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS edge_cutting_standard ( 
+            edge_cutting_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            slab_id TEXT, 
+            polishing_description TEXT, 
+            edge_cutting_description TEXT,
+            good_slab INTEGER, 
+            defect_line INTEGER, 
+            natural_cracks INTEGER,
+            cutting_cracks INTEGER, 
+            thickness_issue INTEGER, 
+            edge_cutting_time TEXT
+        ) 
+    ''')
+
+    # Edge Cutting Special Orders Table 
+    #cursor.execute('DROP TABLE IF EXISTS edge_cutting_special_orders')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS edge_cutting_special_orders (
+            edge_cutting_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            slab_id TEXT, 
+            polishing_description TEXT, 
+            edge_cutting_description TEXT, 
+            special_order_details TEXT, 
+            good_slab INTEGER,
+            defect_line INTEGER, 
+            natural_cracks INTEGER, 
+            cutting_cracks INTEGER,
+            thickness_issue INTEGER, 
+            edge_cutting_time TEXT
+        ) 
+    ''')
+
+    # Bullnose Table 
+    #cursor.execute('DROP TABLE IF EXISTS bullnose')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS bullnose (
+        bullnose_id INTEGER PRIMARY KEY AUTOINCREMENT, 
+        slab_id TEXT, 
+        edge_cutting_description TEXT,
+        bullnose_description TEXT, 
+        good_slab INTEGER, 
+        defect_line INTEGER,
+        natural_cracks INTEGER, 
+        cutting_cracks INTEGER, 
+        thickness_issue INTEGER,
+        bullnose_time TEXT
+        ) 
+    ''')
+
+    # Sealant Table 
+    #cursor.execute('DROP TABLE IF EXISTS sealant')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sealant (
+            sealant_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            slab_id TEXT, 
+            bullnose_description TEXT, 
+            sealant_description TEXT,
+            good_slab INTEGER, 
+            defect_line INTEGER, 
+            natural_cracks INTEGER,
+            cutting_cracks INTEGER, 
+            thickness_issue INTEGER, 
+            sealant_time TEXT
+        ) 
+    ''')
+
+    # Ready Slabs Table 
+    #cursor.execute('DROP TABLE IF EXISTS ready_slabs')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ready_slabs (
+            ready_slab_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            slab_id TEXT,
+            sealant_description TEXT,
+            good_slab INTEGER, 
+            defect_line INTEGER, 
+            natural_cracks INTEGER,
+            cutting_cracks INTEGER, 
+            thickness_issue INTEGER, 
+            ready_time TEXT
+        ) 
+    ''')
+
+    # Movement table
+    #cursor.execute('DROP TABLE IF EXISTS movement')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS movement (
+            movement_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            boulder_id TEXT,
+            slab_id TEXT,
+            stage TEXT,
+            details TEXT,
+            date TEXT,
+            FOREIGN KEY(boulder_id) REFERENCES boulder(boulder_id)
+        )
+    ''')
+
+    # Inventory table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS inventory (
+            slab_id TEXT PRIMARY KEY,
+            slab_description TEXT,
+            stage TEXT,
+            good_slab INTEGER,
+            defect_line INTEGER,
+            natural_cracks INTEGER,
+            cutting_cracks INTEGER,
+            thickness_issue INTEGER
+        )
+    ''')
+
+    # Archive table
+    #cursor.execute('DROP TABLE IF EXISTS archived_boulder')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archived_boulder (
+            boulder_id TEXT PRIMARY KEY,
+            date TEXT,
+            boulder_description TEXT,
+            good_boulder TEXT,
+            defect_line TEXT,
+            natural_cracks TEXT,
+            mining_cracks TEXT,
+            undersize TEXT,
+            total_boulders INTEGER
+        )
+    ''')
+
+
+# Migration 2: databases created before foreign keys were enforced still carry
+# references to non-unique slab_id columns, which reject every insert
+def drop_slab_foreign_keys(cursor):
+    for table in ('polishing', 'edge_cutting_standard', 'edge_cutting_special_orders',
+                  'bullnose', 'sealant', 'ready_slabs', 'movement', 'inventory'):
+        references = cursor.execute(f'PRAGMA foreign_key_list({table})').fetchall()
+        if all(ref[3] != 'slab_id' for ref in references):
+            continue
+        # Rebuild the table without them (create, copy, drop, rename)
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+        create_sql = cursor.fetchone()[0]
+        create_sql = re.sub(r',?\s*FOREIGN KEY\(slab_id\) REFERENCES \w+\(slab_id\)(\s+ON DELETE CASCADE)?', '', create_sql)
+        create_sql = create_sql.replace(f'CREATE TABLE {table}', f'CREATE TABLE {table}_new', 1)
+        cursor.execute(create_sql)
+        cursor.execute(f'INSERT INTO {table}_new SELECT * FROM {table}')
+        cursor.execute(f'DROP TABLE {table}')
+        cursor.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+
+
+# Migration 3: a slab passes through each stage exactly once, and quarry IDs
+# are allocated per color. The old forms accepted the same slab twice, so
+# repeats are dropped first, keeping the earliest row per slab
+def add_stage_constraints(cursor):
+    for table in ('separation', 'polishing', 'edge_cutting_standard', 'edge_cutting_special_orders',
+                  'bullnose', 'sealant', 'ready_slabs'):
+        cursor.execute(f'''
+            DELETE FROM {table}
+            WHERE slab_id IS NOT NULL
+              AND rowid NOT IN (SELECT MIN(rowid) FROM {table} WHERE slab_id IS NOT NULL GROUP BY slab_id)
+        ''')
+        if cursor.rowcount:
+            logger.warning('Removed %d duplicate %s rows before adding ux_%s_slab_id', cursor.rowcount, table, table)
+        cursor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS ux_{table}_slab_id ON {table} (slab_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS ix_boulder_color ON boulder (color)')
+
+
+# Migration 4: index every boulder_id/slab_id column the stage queues and
+# per-slab lookups join on (stage slab_id columns are covered by migration 3)
+def add_lookup_indexes(cursor):
+    cursor.execute('CREATE INDEX IF NOT EXISTS ix_cutting_machine_1_boulder_id ON cutting_machine_1 (boulder_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS ix_cutting_machine_2_boulder_id ON cutting_machine_2 (boulder_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS ix_separation_boulder_id ON separation (boulder_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS ix_movement_boulder_id ON movement (boulder_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS ix_movement_slab_id ON movement (slab_id)')
+
+
+# Migration 5: one row per slab with its current stage, so every stage queue
+# is an indexed equality lookup instead of an anti-join over the history
+def create_slab_state(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS slab_state (
+            slab_id TEXT PRIMARY KEY,
+            boulder_id TEXT,
+            stage TEXT NOT NULL,
+            description TEXT,
+            good_slab INTEGER,
+            defect_line INTEGER,
+            natural_cracks INTEGER,
+            cutting_cracks INTEGER,
+            thickness_issue INTEGER,
+            updated_at TEXT
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS ix_slab_state_stage ON slab_state (stage)')
+    slab_state.rebuild(cursor)
+
+
+# Migration 6: per-prefix boulder ID counters, seeded past every ID in use
+def create_boulder_sequence(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS boulder_sequence (
+            prefix TEXT PRIMARY KEY,
+            last_number INTEGER NOT NULL
+        )
+    ''')
+    boulder_ids.seed(cursor)
+
+
+# Migration 7: daily per-stage production totals for the dashboard
+def create_rollups(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS slab_rollup (
+            day TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            slabs INTEGER NOT NULL DEFAULT 0,
+            good INTEGER NOT NULL DEFAULT 0,
+            defect_line INTEGER NOT NULL DEFAULT 0,
+            natural_cracks INTEGER NOT NULL DEFAULT 0,
+            cutting_cracks INTEGER NOT NULL DEFAULT 0,
+            thickness_issue INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, stage)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS boulder_rollup (
+            day TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            boulders INTEGER NOT NULL DEFAULT 0,
+            good INTEGER NOT NULL DEFAULT 0,
+            defect_line INTEGER NOT NULL DEFAULT 0,
+            natural_cracks INTEGER NOT NULL DEFAULT 0,
+            mining_cracks INTEGER NOT NULL DEFAULT 0,
+            undersize INTEGER NOT NULL DEFAULT 0,
+            slabs_cut INTEGER NOT NULL DEFAULT 0,
+            machine_hours REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, stage)
+        )
+    ''')
+    _fill_rollups_v7(cursor)
+
+
+# The rollups as migration 7 computes them, from the per-machine cutting
+# tables of that schema. A frozen copy of rollups.rebuild at version 7, which
+# has since moved on to cutting_run; migration 8 recomputes them all.
+def _fill_rollups_v7(cursor):
+    slab_sources = (
+        ('separation', 'separation', 'separation_time', 'good_slabs'),
+        ('polishing', 'polishing', 'polishing_time', 'good_slab'),
+        ('edge_cutting', 'edge_cutting_standard', 'edge_cutting_time', 'good_slab'),
+        ('edge_cutting', 'edge_cutting_special_orders', 'edge_cutting_time', 'good_slab'),
+        ('bullnose', 'bullnose', 'bullnose_time', 'good_slab'),
+        ('sealant', 'sealant', 'sealant_time', 'good_slab'),
+        ('ready', 'ready_slabs', 'ready_time', 'good_slab'),
+    )
+    for stage, table, time_column, good_column in slab_sources:
+        cursor.execute(f'''
+            INSERT INTO slab_rollup (day, stage, slabs, good, defect_line, natural_cracks, cutting_cracks, thickness_issue)
+            SELECT substr({time_column}, 1, 10), '{stage}', COUNT(*), TOTAL({good_column}), TOTAL(defect_line),
+                   TOTAL(natural_cracks), TOTAL(cutting_cracks), TOTAL(thickness_issue)
+            FROM {table}
+            WHERE {time_column} IS NOT NULL
+            GROUP BY substr({time_column}, 1, 10)
+            ON CONFLICT(day, stage) DO UPDATE SET
+                slabs = slabs + excluded.slabs,
+                good = good + excluded.good,
+                defect_line = defect_line + excluded.defect_line,
+                natural_cracks = natural_cracks + excluded.natural_cracks,
+                cutting_cracks = cutting_cracks + excluded.cutting_cracks,
+                thickness_issue = thickness_issue + excluded.thickness_issue
+        ''')
+
+    boulder_sources = (
+        ('quarry', 'boulder', 'date', 'good_boulder, defect_line, natural_cracks, mining_cracks, undersize', '0, 0'),
+        ('factory', 'factory', 'received_timestamp', 'good_boulder, defect_line, natural_cracks, mining_cracks, undersize', '0, 0'),
+        ('cutting_machine_1', 'cutting_machine_1', 'start_time', '0, 0, 0, 0, 0', 'num_slabs_cut, machine_hours'),
+        ('cutting_machine_2', 'cutting_machine_2', 'start_time', '0, 0, 0, 0, 0', 'num_slabs_cut, machine_hours'),
+    )
+    for stage, table, time_column, flags, output in boulder_sources:
+        totals = ', '.join(f'TOTAL({column.strip()})' for column in f'{flags}, {output}'.split(','))
+        cursor.execute(f'''
+            INSERT INTO boulder_rollup (day, stage, boulders, good, defect_line, natural_cracks, mining_cracks, undersize,
+                                        slabs_cut, machine_hours)
+            SELECT substr({time_column}, 1, 10), '{stage}', COUNT(*), {totals}
+            FROM {table}
+            WHERE {time_column} IS NOT NULL
+            GROUP BY substr({time_column}, 1, 10)
+        ''')
+    # Boulders separated, on the day their first slab was separated
+    cursor.execute('''
+        INSERT INTO boulder_rollup (day, stage, boulders, good, defect_line, natural_cracks, mining_cracks, undersize,
+                                    slabs_cut, machine_hours)
+        SELECT day, 'separation', COUNT(*), 0, 0, 0, 0, 0, TOTAL(slabs), 0
+        FROM (
+            SELECT boulder_id, substr(MIN(separation_time), 1, 10) AS day, COUNT(*) AS slabs
+            FROM separation GROUP BY boulder_id
+        )
+        WHERE day IS NOT NULL
+        GROUP BY day
+    ''')
+
+
+# Migration 8: one cutting_run table for every cutting machine instead of a
+# table per machine, plus hourly machine utilization
+def create_cutting_runs(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cutting_machine (
+            machine_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE
+        )
+    ''')
+    cursor.execute('''
+        INSERT OR IGNORE INTO cutting_machine (machine_id, name)
+        VALUES (1, 'Cutting Machine 1'), (2, 'Cutting Machine 2')
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cutting_run (
+            run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            machine_id INTEGER NOT NULL,
+            boulder_id TEXT,
+            boulder_description TEXT,
+            num_slabs_cut INTEGER,
+            start_time TEXT,
+            end_time TEXT,
+            machine_hours REAL,
+            FOREIGN KEY(machine_id) REFERENCES cutting_machine(machine_id),
+            FOREIGN KEY(boulder_id) REFERENCES boulder(boulder_id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS ix_cutting_run_boulder_id ON cutting_run (boulder_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS ix_cutting_run_machine_id ON cutting_run (machine_id)')
+
+    # Both machines' runs in the order they started, so run_id (and the
+    # history pages) keep following the cutting order
+    cursor.execute('''
+        INSERT INTO cutting_run (machine_id, boulder_id, boulder_description, num_slabs_cut, start_time, end_time,
+                                 machine_hours)
+        SELECT machine, boulder_id, boulder_description, num_slabs_cut, start_time, end_time, machine_hours
+        FROM (
+            SELECT 1 AS machine, machine_id AS id, * FROM cutting_machine_1
+            UNION ALL
+            SELECT 2, machine_id, * FROM cutting_machine_2
+        )
+        ORDER BY start_time, machine, id
+    ''')
+    cursor.execute('DROP TABLE cutting_machine_1')
+    cursor.execute('DROP TABLE cutting_machine_2')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS machine_utilization (
+            hour TEXT NOT NULL,
+            machine_id INTEGER NOT NULL,
+            runs INTEGER NOT NULL DEFAULT 0,
+            slabs_cut INTEGER NOT NULL DEFAULT 0,
+            busy_hours REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (hour, machine_id)
+        )
+    ''')
+    rollups.rebuild(cursor)
+
+
+# Migration 9: find a boulder's slabs without scanning slab_state, for the
+# archive job (see archive.py)
+def add_slab_state_boulder_index(cursor):
+    cursor.execute('CREATE INDEX IF NOT EXISTS ix_slab_state_boulder_id ON slab_state (boulder_id)')
+
+
+# Migration 10: full-text index over descriptions and movement details, kept
+# up to date by triggers (see search.py)
+def create_search_index(cursor):
+    search.create(cursor)
+
+
+# Migration 11: per-table version counters for the page cache (see page_cache.py)
+def create_table_versions(cursor):
+    page_cache.create(cursor)
+
+
+# Migration 12: event times as INTEGER epoch seconds instead of local time
+# text (see timestamps.py), each with an index for date-range filters. Each
+# table is rebuilt in place (create, copy, drop, rename) so its column order,
+# rowids, indexes and triggers stay as they were.
+def convert_timestamps(cursor):
+    cursor.connection.create_function('epoch', 1, timestamps.parse, deterministic=True)
+    for table, time_columns in timestamps.COLUMNS.items():
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+        create_sql = cursor.fetchone()[0]
+        for column in time_columns:
+            create_sql = re.sub(rf'\b{column} TEXT\b', f'{column} INTEGER', create_sql)
+        create_sql = re.sub(r'CREATE TABLE (IF NOT EXISTS )?"?\w+"?', f'CREATE TABLE {table}_new', create_sql, count=1)
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type IN ('index', 'trigger') AND tbl_name = ? AND sql IS NOT NULL",
+                       (table,))
+        dependents = [row[0] for row in cursor.fetchall()]
+        columns = [row[1] for row in cursor.execute(f'PRAGMA table_info({table})').fetchall()]
+        select = ', '.join(f'epoch({column})' if column in time_columns else column for column in columns)
+
+        cursor.execute(create_sql)
+        cursor.execute(f'INSERT INTO {table}_new ({", ".join(columns)}) SELECT {select} FROM {table}')
+        cursor.execute(f'DROP TABLE {table}')
+        cursor.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+        for sql in dependents:
+            cursor.execute(sql)
+        for column in time_columns:
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS ix_{table}_{column} ON {table} ({column})')
+
+
+# Ordered list of (version, name, step); append new steps, never reorder
+MIGRATIONS = [
+    (1, 'base schema', create_base_schema),
+    (2, 'drop slab_id foreign keys', drop_slab_foreign_keys),
+    (3, 'stage constraints', add_stage_constraints),
+    (4, 'lookup indexes', add_lookup_indexes),
+    (5, 'slab state', create_slab_state),
+    (6, 'boulder sequence', create_boulder_sequence),
+    (7, 'production rollups', create_rollups),
+    (8, 'cutting runs', create_cutting_runs),
+    (9, 'slab state boulder index', add_slab_state_boulder_index),
+    (10, 'search index', create_search_index),
+    (11, 'table versions', create_table_versions),
+    (12, 'epoch timestamps', convert_timestamps),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+# Read the version recorded in schema_version (0 for an unmanaged database)
+def current_version(conn):
+    row = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+    ).fetchone()
+    if row is None:
+        return 0
+    return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+
+# Apply every pending migration in one write transaction; safe to run from
+# several workers at once since the version is re-read under the write lock
+def migrate(database, timeout=30):
+    conn = sqlite3.connect(database, timeout=timeout, isolation_level=None)
+    applied = []
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT,
+                applied_at TEXT
+            )
+        ''')
+        version = current_version(conn)
+        cursor = conn.cursor()
+        for number, name, step in MIGRATIONS:
+            if number <= version:
+                continue
+            step(cursor)
+            cursor.execute(
+                'INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)',
+                (number, name, datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")),
+            )
+            applied.append((number, name))
+        conn.execute('COMMIT')
+    except Exception:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+    return applied
+
+
+# Raise SchemaOutOfDate unless the database is at LATEST_VERSION
+def check_schema(database):
+    conn = sqlite3.connect(database)
+    try:
+        version = current_version(conn)
+    finally:
+        conn.close()
+    if version != LATEST_VERSION:
+        raise SchemaOutOfDate(
+            f'Database schema is at version {version}, expected {LATEST_VERSION}. '
+            f'Run "flask --app app migrate" to upgrade it.'
+        )
+
+
+# Register the migrate command and a once-per-process version check
+def init_app(app):
+    checked = []
+
+    @app.before_request
+    def ensure_schema():
+        if not checked:
+            check_schema(app.config['DATABASE'])
+            checked.append(True)
+
+    @app.cli.command('migrate')
+    def migrate_command():
+        """Apply pending schema migrations."""
+        applied = migrate(app.config['DATABASE'])
+        for number, name in applied:
+            click.echo(f'Applied migration {number}: {name}')
+        if applied and archive.upgrade(app.config['DATABASE'], app.config.get('ARCHIVE_DATABASE')):
+            click.echo(f'Upgraded the archive at {app.config["ARCHIVE_DATABASE"]}.')
+        click.echo(f'Database schema is at version {LATEST_VERSION}.')
@@ -0,0 +1,163 @@
+import atexit
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+from flask import current_app
+
+import storage as repository
+import writer as db_writer
+
+# Queue markers understood by the writer thread
+_STOP = object()
+
+
+# Background thread that batches movement rows into the movement table so
+# requests do not pay for a second durable write on every stage transition.
+# Each batch is one transaction in the app's repository (see storage.py).
+class MovementWriter:
+    def __init__(self, storage, batch_size=200, flush_interval=1.0, max_queue_size=10000, logger=None):
+        self.storage = storage
+        self.logger = logger or logging.getLogger(__name__)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.max_queue_depth = 0
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+
+    # Queue (boulder_id, slab_id, stage, details, date) rows for writing;
+    # blocks once the queue is full so a stalled writer slows requests down
+    # instead of growing without bound
+    def submit(self, rows):
+        self._ensure_started()
+        for row in rows:
+            self._queue.put(tuple(row))
+        self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+
+    # Write everything queued so far before returning (used by tests and scripts)
+    def flush(self, timeout=None):
+        if self._thread is None or not self._thread.is_alive():
+            self._drain()
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    # Drain the queue and stop the writer thread
+    def stop(self, timeout=None):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join(timeout)
+        else:
+            self._drain()
+
+    def metrics(self):
+        return {
+            'queue_depth': self._queue.qsize(),
+            'max_queue_depth': self.max_queue_depth,
+            'written': self.written,
+            'batches': self.batches,
+            'dropped': self.dropped,
+        }
+
+    # Start the thread on first use so forking servers start it per worker
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='movement-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            wait = None if not batch else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=wait)
+            except queue.Empty:
+                item = None  # flush interval elapsed
+
+            if isinstance(item, tuple):
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(item)
+                if len(batch) < self.batch_size:
+                    continue
+
+            if batch:
+                self._write(batch)
+                batch = []
+            if item is _STOP:
+                break
+            if isinstance(item, threading.Event):
+                item.set()
+
+    # Write whatever is queued from the calling thread (writer not running)
+    def _drain(self):
+        batch = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, tuple):
+                batch.append(item)
+            elif isinstance(item, threading.Event):
+                item.set()
+        if batch:
+            self._write(batch)
+
+    # Insert one batch in a single transaction; the writer retries while the
+    # database is busy, so a batch that still fails is dropped. A batch that
+    # clashes with the schema (e.g. a movement for an unknown boulder) is
+    # written again a row at a time, so only the bad rows are lost.
+    def _write(self, batch):
+        try:
+            self.storage.add_movements(batch)
+        except repository.Conflict:
+            self._write_rows(batch)
+            return
+        except (sqlite3.Error, db_writer.DatabaseBusy, repository.StorageError):
+            self.logger.exception('Movement log error: dropped a batch of %d rows', len(batch))
+            self.dropped += len(batch)
+            return
+        self.written += len(batch)
+        self.batches += 1
+
+    def _write_rows(self, batch):
+        for row in batch:
+            try:
+                self.storage.add_movements([row])
+            except (sqlite3.Error, db_writer.DatabaseBusy, repository.StorageError) as e:
+                self.logger.error('Movement log error: dropped %r: %s', row, e)
+                self.dropped += 1
+                continue
+            self.written += 1
+            self.batches += 1
+
+# Get the movement writer of the current app
+def get_writer():
+    return current_app.extensions['movement_writer']
+
+
+# Attach a movement writer to the Flask app and drain it on shutdown
+def init_app(app):
+    writer = MovementWriter(
+        app.extensions['storage'],
+        batch_size=app.config.get('MOVEMENT_BATCH_SIZE', 200),
+        flush_interval=app.config.get('MOVEMENT_FLUSH_INTERVAL', 1.0),
+        max_queue_size=app.config.get('MOVEMENT_QUEUE_SIZE', 10000),
+        logger=app.logger,
+    )
+    app.extensions['movement_writer'] = writer
+    atexit.register(writer.stop)
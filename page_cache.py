@@ -0,0 +1,132 @@
+import functools
+import hashlib
+import os
+
+from flask import Response, current_app, g, make_response, request
+
+import metrics
+from cache import LRUCache
+from db import get_db
+
+# Response cache for the stage pages. Every table a page reads has a version
+# counter in table_version, bumped by triggers in the same transaction as any
+# insert, update or delete, so no writer (route, bulk API, CLI command or
+# archive job, in any worker) can forget to. A page's ETag is a hash of the
+# versions of the tables it reads; a GET whose If-None-Match still matches
+# gets a 304 without touching anything else, and otherwise the rendered page
+# is served from an in-process LRU cache as long as the versions are
+# unchanged. Reading the versions is a single query on a table of a dozen
+# rows. Each app keeps its own cache (app.extensions['page_cache']), and the
+# ETag covers the database too, so apps on different databases never serve
+# each other's pages.
+
+# Tables with a version counter. cutting_machine is read by every page for the nav bar.
+TABLES = ('boulder', 'factory', 'cutting_machine', 'cutting_run', 'separation', 'polishing', 'edge_cutting_standard',
+          'edge_cutting_special_orders', 'bullnose', 'sealant', 'ready_slabs', 'slab_state')
+
+requests_total = metrics.Counter('page_cache_requests_total',
+                                 'Cacheable page requests, by endpoint and result (hit, miss, not_modified).',
+                                 ('endpoint', 'result'))
+metrics.REGISTRY.append(requests_total)
+
+
+# An app's rendered pages, by URL, and the fingerprint of its code
+class PageCache:
+    def __init__(self, database, code_version, maxsize=256):
+        self.pages = LRUCache(maxsize=maxsize)
+        self.prefix = f'{code_version}|{database}'
+
+
+# Create the version table and its triggers (migration 11)
+def create(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS table_version (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    for table in TABLES:
+        cursor.execute('INSERT OR IGNORE INTO table_version (name, version) VALUES (?, 0)', (table,))
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS version_{table}_{event.lower()} AFTER {event} ON {table} BEGIN
+                    UPDATE table_version SET version = version + 1 WHERE name = '{table}';
+                END
+            ''')
+
+
+# Current version of every counted table
+def versions(conn):
+    return dict(conn.execute('SELECT name, version FROM table_version'))
+
+
+# Called by a view once it has rendered a complete page; anything else it
+# returns (error text, redirects, streamed pages) is never cached
+def cacheable():
+    g.page_cacheable = True
+
+
+# Cache a view's GET responses by URL against the versions of `tables`
+# (cutting_machine is always included). POSTs go straight through.
+def cached(*tables):
+    tables = tuple(sorted(set(tables) | {'cutting_machine'}))
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET':
+                return view(*args, **kwargs)
+
+            cache = current_app.extensions['page_cache']
+            current = versions(get_db())
+            stamp = ','.join(f'{table}={current.get(table)}' for table in tables)
+            etag = hashlib.sha1(f'{cache.prefix}|{request.full_path}|{stamp}'.encode()).hexdigest()
+            if etag in request.if_none_match:
+                requests_total.inc(request.endpoint, 'not_modified')
+                return _response(b'', etag, 304)
+
+            entry = cache.pages.get(request.full_path)
+            if entry is not None and entry[0] == etag:
+                requests_total.inc(request.endpoint, 'hit')
+                return _response(entry[1], etag)
+
+            requests_total.inc(request.endpoint, 'miss')
+            g.page_cacheable = False
+            response = make_response(view(*args, **kwargs))
+            if g.page_cacheable and response.status_code == 200 and not response.is_streamed:
+                cache.pages.set(request.full_path, (etag, response.get_data()))
+                return _response(response.get_data(), etag)
+            return response
+        return wrapper
+    return decorator
+
+
+def _response(body, etag, status=200):
+    response = Response(body, status=status, mimetype='text/html')
+    response.set_etag(etag)
+    # Browsers keep the page but must ask before reusing it
+    response.cache_control.no_cache = True
+    return response
+
+
+# Hash of the code and templates, so a deploy changes every ETag even when no
+# table has changed
+def _fingerprint(root):
+    digest = hashlib.sha1()
+    for folder in (root, os.path.join(root, 'templates')):
+        for name in sorted(os.listdir(folder)):
+            if name.endswith(('.py', '.html')):
+                with open(os.path.join(folder, name), 'rb') as f:
+                    digest.update(name.encode() + f.read())
+    return digest.hexdigest()
+
+
+# Give the app its page cache, keyed by the fingerprint of the deployed code
+def init_app(app):
+    app.extensions['page_cache'] = PageCache(app.config['DATABASE'], _fingerprint(app.root_path),
+                                             app.config.get('PAGE_CACHE_SIZE', 256))
+
+
+# Drop every page the app has cached (for tests and benchmarks)
+def clear(app):
+    app.extensions['page_cache'].pages.clear()
@@ -0,0 +1,143 @@
+import datetime
+
+import archive
+import timestamps
+
+# History tables shown on the stage pages: table -> (timestamp column, description columns).
+# Pages are keyed on rowid, which is the autoincrement ID where a table has one.
+HISTORY_TABLES = {
+    'boulder': ('date', ('boulder_description', 'boulder_id')),
+    'factory': ('received_timestamp', ('boulder_description',)),
+    'cutting_run': ('start_time', ('boulder_description', 'boulder_id')),
+    'separation': ('separation_time', ('boulder_description', 'slab_description', 'slab_id', 'boulder_id')),
+    'polishing': ('polishing_time', ('polishing_description', 'slab_id')),
+    'edge_cutting_standard': ('edge_cutting_time', ('edge_cutting_description', 'slab_id')),
+    'edge_cutting_special_orders': ('edge_cutting_time', ('edge_cutting_description', 'special_order_details', 'slab_id')),
+    'bullnose': ('bullnose_time', ('bullnose_description', 'slab_id')),
+    'sealant': ('sealant_time', ('sealant_description', 'slab_id')),
+    'ready_slabs': ('ready_time', ('sealant_description', 'slab_id')),
+}
+
+MAX_PAGE_SIZE = 500
+
+
+# Read an integer query argument, falling back to None when missing or invalid
+def _int_arg(args, name):
+    try:
+        return int(args[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+# Read a YYYY-MM-DD query argument, falling back to None when missing or invalid
+def _date_arg(args, name):
+    try:
+        return datetime.date.fromisoformat(args[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+# Query arguments to carry over to the page links
+def _filter_args(args):
+    return {name: args[name] for name in ('date_from', 'date_to', 'q', 'page_size', 'archive') if args.get(name)}
+
+
+# Build the WHERE clause and parameters for the filters in args. `scope` maps
+# columns to the value every row must have, e.g. {'machine_id': 2}.
+def history_filters(table, args, scope=None):
+    time_column, description_columns = HISTORY_TABLES[table]
+    clauses = []
+    params = []
+    for column, value in (scope or {}).items():
+        clauses.append(f'{column} = ?')
+        params.append(value)
+
+    # Event times are epoch seconds (boulder.date is a plain date), so each
+    # bound is the start of a local day and the filter is an index range scan
+    bound = timestamps.day_start if time_column in timestamps.COLUMNS.get(table, ()) else datetime.date.isoformat
+    date_from = _date_arg(args, 'date_from')
+    if date_from:
+        clauses.append(f'{time_column} >= ?')
+        params.append(bound(date_from))
+    date_to = _date_arg(args, 'date_to')
+    if date_to:
+        # "Up to and including date_to" is "before the next day"
+        clauses.append(f'{time_column} < ?')
+        params.append(bound(date_to + datetime.timedelta(days=1)))
+    search = (args.get('q') or '').strip()
+    if search:
+        clauses.append('(' + ' OR '.join(f'{column} LIKE ?' for column in description_columns) + ')')
+        params.extend([f'%{search}%'] * len(description_columns))
+    return clauses, params
+
+
+# Columns and FROM source of a history query. With the archive the source is a
+# subquery that already has a rowid column (see archive.source).
+def _select(conn, table, with_archive):
+    source = archive.source(conn, table, with_archive)
+    return ('*, rowid' if source == table else '*'), source
+
+
+# Fetch one page of a history table, newest first. `before` pages towards older
+# rows and `after` towards newer ones; both are rowids from a previous page,
+# so each page is an index range scan however deep into the history it is.
+# Rows are the table's columns followed by the rowid. With `with_archive`
+# (the archive must be attached) archived rows are included.
+def history_page(conn, table, args, page_size=50, scope=None, with_archive=False):
+    requested = _int_arg(args, 'page_size')
+    page_size = max(1, min(page_size if requested is None else requested, MAX_PAGE_SIZE))
+    before = _int_arg(args, 'before')
+    after = _int_arg(args, 'after')
+    clauses, params = history_filters(table, args, scope)
+
+    if after is not None:
+        clauses.append('rowid > ?')
+        params.append(after)
+        order = 'ASC'
+    else:
+        if before is not None:
+            clauses.append('rowid < ?')
+            params.append(before)
+        order = 'DESC'
+
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    select, source = _select(conn, table, with_archive)
+    rows = conn.execute(
+        f'SELECT {select} FROM {source} {where} ORDER BY rowid {order} LIMIT ?',
+        params + [page_size + 1],
+    ).fetchall()
+
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+    if after is not None:
+        rows.reverse()
+        has_newer, has_older = more, True
+    else:
+        has_newer, has_older = before is not None, more
+
+    return {
+        'rows': rows,
+        'newer': rows[0][-1] if rows and has_newer else None,
+        'older': rows[-1][-1] if rows and has_older else None,
+        'filters': _filter_args(args),
+        'page_size': page_size,
+        'streamed': False,
+    }
+
+
+# The whole filtered history, newest first, as an open cursor rather than a
+# list; the template pulls rows from it while the response is being sent.
+# Same shape as history_page but without page links.
+def history_stream(conn, table, args, scope=None, with_archive=False):
+    clauses, params = history_filters(table, args, scope)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    select, source = _select(conn, table, with_archive)
+    rows = conn.execute(f'SELECT {select} FROM {source} {where} ORDER BY rowid DESC', params)
+    return {
+        'rows': rows,
+        'newer': None,
+        'older': None,
+        'filters': _filter_args(args),
+        'page_size': None,
+        'streamed': True,
+    }
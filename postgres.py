@@ -0,0 +1,513 @@
+import asyncio
+import re
+import threading
+
+import asyncpg
+
+import boulder_ids
+import slab_state
+import storage
+import transitions
+
+# PostgreSQL implementation of the repository in storage.py, groundwork for
+# when several sites write to the same system. The app cannot run on it yet
+# (storage.init_app always installs SQLiteRepository); it is exercised by
+# tests/test_conformance.py. It keeps the workflow tables only: the dashboard
+# rollups, search index, page-cache versions and archive are SQLite features
+# of the app and are not kept or updated here.
+#
+# Connections come from an asyncpg pool. The repository methods are plain
+# functions like SQLiteRepository's: each one runs its queries on a private
+# event loop thread, started on first use (so forking servers start one per
+# worker), and waits for the result. Every write is one transaction; slabs
+# are locked with SELECT ... FOR UPDATE before their stage is checked, so
+# concurrent writers cannot move the same slab twice.
+#
+#     repository = PostgresRepository('postgresql://inventory@db-host/inventory')
+#     repository.create_schema()
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS boulder (
+        boulder_id TEXT PRIMARY KEY,
+        date TEXT,
+        boulder_description TEXT,
+        color TEXT,
+        good_boulder INTEGER,
+        defect_line INTEGER,
+        natural_cracks INTEGER,
+        mining_cracks INTEGER,
+        undersize INTEGER,
+        total_boulders INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS ix_boulder_color ON boulder (color);
+
+    CREATE TABLE IF NOT EXISTS boulder_sequence (
+        prefix TEXT PRIMARY KEY,
+        last_number INTEGER NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS factory (
+        boulder_id TEXT PRIMARY KEY REFERENCES boulder (boulder_id),
+        boulder_description TEXT,
+        good_boulder INTEGER,
+        defect_line INTEGER,
+        natural_cracks INTEGER,
+        mining_cracks INTEGER,
+        undersize INTEGER,
+        total_boulders INTEGER,
+        received_timestamp BIGINT
+    );
+    CREATE INDEX IF NOT EXISTS ix_factory_received_timestamp ON factory (received_timestamp);
+
+    CREATE TABLE IF NOT EXISTS cutting_machine (
+        machine_id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    );
+    INSERT INTO cutting_machine (name) VALUES ('Cutting Machine 1'), ('Cutting Machine 2')
+    ON CONFLICT (name) DO NOTHING;
+
+    CREATE TABLE IF NOT EXISTS cutting_run (
+        run_id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        machine_id INTEGER NOT NULL REFERENCES cutting_machine (machine_id),
+        boulder_id TEXT REFERENCES boulder (boulder_id),
+        boulder_description TEXT,
+        num_slabs_cut INTEGER,
+        start_time BIGINT,
+        end_time BIGINT,
+        machine_hours DOUBLE PRECISION
+    );
+    CREATE INDEX IF NOT EXISTS ix_cutting_run_boulder_id ON cutting_run (boulder_id);
+    CREATE INDEX IF NOT EXISTS ix_cutting_run_machine_id ON cutting_run (machine_id);
+    CREATE INDEX IF NOT EXISTS ix_cutting_run_start_time ON cutting_run (start_time);
+    CREATE INDEX IF NOT EXISTS ix_cutting_run_end_time ON cutting_run (end_time);
+
+    CREATE TABLE IF NOT EXISTS separation (
+        separation_id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        boulder_id TEXT REFERENCES boulder (boulder_id),
+        boulder_description TEXT,
+        slab_id TEXT UNIQUE,
+        slab_description TEXT,
+        good_slabs INTEGER,
+        defect_line INTEGER,
+        natural_cracks INTEGER,
+        cutting_cracks INTEGER,
+        thickness_issue INTEGER,
+        total_slabs INTEGER,
+        separation_time BIGINT
+    );
+    CREATE INDEX IF NOT EXISTS ix_separation_boulder_id ON separation (boulder_id);
+    CREATE INDEX IF NOT EXISTS ix_separation_separation_time ON separation (separation_time);
+
+    CREATE TABLE IF NOT EXISTS polishing (
+        polishing_id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        slab_id TEXT UNIQUE,
+        slab_description TEXT,
+        original_status TEXT,
+        polishing_description TEXT,
+        good_slab INTEGER,
+        defect_line INTEGER,
+        natural_cracks INTEGER,
+        cutting_cracks INTEGER,
+        thickness_issue INTEGER,
+        polishing_time BIGINT
+    );
+    CREATE INDEX IF NOT EXISTS ix_polishing_polishing_time ON polishing (polishing_time);
+
+    CREATE TABLE IF NOT EXISTS edge_cutting_standard (
+        edge_cutting_id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        slab_id TEXT UNIQUE,
+        polishing_description TEXT,
+        edge_cutting_description TEXT,
+        good_slab INTEGER,
+        defect_line INTEGER,
+        natural_cracks INTEGER,
+        cutting_cracks INTEGER,
+        thickness_issue INTEGER,
+        edge_cutting_time BIGINT
+    );
+    CREATE INDEX IF NOT EXISTS ix_edge_cutting_standard_edge_cutting_time ON edge_cutting_standard (edge_cutting_time);
+
+    CREATE TABLE IF NOT EXISTS edge_cutting_special_orders (
+        edge_cutting_id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        slab_id TEXT UNIQUE,
+        polishing_description TEXT,
+        edge_cutting_description TEXT,
+        special_order_details TEXT,
+        good_slab INTEGER,
+        defect_line INTEGER,
+        natural_cracks INTEGER,
+        cutting_cracks INTEGER,
+        thickness_issue INTEGER,
+        edge_cutting_time BIGINT
+    );
+    CREATE INDEX IF NOT EXISTS ix_edge_cutting_special_orders_edge_cutting_time ON edge_cutting_special_orders (edge_cutting_time);
+
+    CREATE TABLE IF NOT EXISTS bullnose (
+        bullnose_id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        slab_id TEXT UNIQUE,
+        edge_cutting_description TEXT,
+        bullnose_description TEXT,
+        good_slab INTEGER,
+        defect_line INTEGER,
+        natural_cracks INTEGER,
+        cutting_cracks INTEGER,
+        thickness_issue INTEGER,
+        bullnose_time BIGINT
+    );
+    CREATE INDEX IF NOT EXISTS ix_bullnose_bullnose_time ON bullnose (bullnose_time);
+
+    CREATE TABLE IF NOT EXISTS sealant (
+        sealant_id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        slab_id TEXT UNIQUE,
+        bullnose_description TEXT,
+        sealant_description TEXT,
+        good_slab INTEGER,
+        defect_line INTEGER,
+        natural_cracks INTEGER,
+        cutting_cracks INTEGER,
+        thickness_issue INTEGER,
+        sealant_time BIGINT
+    );
+    CREATE INDEX IF NOT EXISTS ix_sealant_sealant_time ON sealant (sealant_time);
+
+    CREATE TABLE IF NOT EXISTS ready_slabs (
+        ready_slab_id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        slab_id TEXT UNIQUE,
+        sealant_description TEXT,
+        good_slab INTEGER,
+        defect_line INTEGER,
+        natural_cracks INTEGER,
+        cutting_cracks INTEGER,
+        thickness_issue INTEGER,
+        ready_time BIGINT
+    );
+    CREATE INDEX IF NOT EXISTS ix_ready_slabs_ready_time ON ready_slabs (ready_time);
+
+    CREATE TABLE IF NOT EXISTS inventory (
+        slab_id TEXT PRIMARY KEY,
+        slab_description TEXT,
+        stage TEXT,
+        good_slab INTEGER,
+        defect_line INTEGER,
+        natural_cracks INTEGER,
+        cutting_cracks INTEGER,
+        thickness_issue INTEGER
+    );
+
+    CREATE TABLE IF NOT EXISTS movement (
+        movement_id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        boulder_id TEXT REFERENCES boulder (boulder_id),
+        slab_id TEXT,
+        stage TEXT,
+        details TEXT,
+        date BIGINT
+    );
+    CREATE INDEX IF NOT EXISTS ix_movement_boulder_id ON movement (boulder_id);
+    CREATE INDEX IF NOT EXISTS ix_movement_slab_id ON movement (slab_id);
+    CREATE INDEX IF NOT EXISTS ix_movement_date ON movement (date);
+
+    CREATE TABLE IF NOT EXISTS slab_state (
+        slab_id TEXT PRIMARY KEY,
+        boulder_id TEXT,
+        stage TEXT NOT NULL,
+        description TEXT,
+        good_slab INTEGER,
+        defect_line INTEGER,
+        natural_cracks INTEGER,
+        cutting_cracks INTEGER,
+        thickness_issue INTEGER,
+        updated_at BIGINT
+    );
+    CREATE INDEX IF NOT EXISTS ix_slab_state_stage ON slab_state (stage);
+    CREATE INDEX IF NOT EXISTS ix_slab_state_boulder_id ON slab_state (boulder_id);
+    CREATE INDEX IF NOT EXISTS ix_slab_state_updated_at ON slab_state (updated_at);
+'''
+
+
+# The same statement with PostgreSQL's numbered parameters instead of ?, so
+# both backends share the SQL that is not SQLite-specific
+def _numbered(sql):
+    numbers = iter(range(1, sql.count('?') + 1))
+    return re.sub(r'\?', lambda match: f'${next(numbers)}', sql)
+
+
+RESERVE_SQL = _numbered(boulder_ids.RESERVE_SQL.replace('last_number + excluded', 'boulder_sequence.last_number + excluded'))
+BOULDER_INSERT_SQL = _numbered(storage.BOULDER_INSERT_SQL)
+SEPARATION_INSERT_SQL = _numbered(storage.SEPARATION_INSERT_SQL)
+SPECIAL_ORDER_INSERT_SQL = _numbered(storage.SPECIAL_ORDER_INSERT_SQL)
+MOVEMENT_INSERT_SQL = _numbered(storage.MOVEMENT_INSERT_SQL)
+SLAB_STATE_UPSERT_SQL = _numbered(slab_state.UPSERT_SQL)
+INVENTORY_UPSERT_SQL = _numbered(transitions.INVENTORY_SQL)
+SLAB_SQL = _numbered(storage.SLAB_SQL)
+RUN_INSERT_SQL = '''
+    INSERT INTO cutting_run (machine_id, boulder_id, boulder_description, num_slabs_cut, start_time, end_time, machine_hours)
+    VALUES ($1, $2, $3, $4, $5, $6, $7)
+'''
+FACTORY_UPSERT_SQL = '''
+    INSERT INTO factory
+    (boulder_id, boulder_description, good_boulder, defect_line, natural_cracks,
+    mining_cracks, undersize, total_boulders, received_timestamp)
+    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+    ON CONFLICT (boulder_id) DO UPDATE SET
+        boulder_description=excluded.boulder_description,
+        good_boulder=excluded.good_boulder,
+        defect_line=excluded.defect_line,
+        natural_cracks=excluded.natural_cracks,
+        mining_cracks=excluded.mining_cracks,
+        undersize=excluded.undersize,
+        total_boulders=excluded.total_boulders,
+        received_timestamp=excluded.received_timestamp
+'''
+
+
+async def _reserve(conn, prefix, count=1):
+    last = await conn.fetchval(RESERVE_SQL, prefix, count)
+    return range(last - count + 1, last + 1)
+
+
+# Write functions of PostgresRepository, each run in its own transaction
+
+async def _add_boulder(conn, date, description, flags):
+    color = description.split()[0]
+    prefix = boulder_ids.color_prefix(color)
+    boulder_id = f'M{prefix}{(await _reserve(conn, prefix))[0]:03d}'
+    await conn.execute(BOULDER_INSERT_SQL, boulder_id, date, description, color, *flags, sum(flags))
+    return boulder_id
+
+
+async def _import_boulders(conn, chunk):
+    per_prefix = {}
+    for _, row in chunk:
+        prefix = boulder_ids.color_prefix(row[2])
+        per_prefix[prefix] = per_prefix.get(prefix, 0) + 1
+    numbers = {prefix: iter(await _reserve(conn, prefix, count)) for prefix, count in per_prefix.items()}
+
+    rows = []
+    for line, (date, boulder_description, color, *flags) in chunk:
+        prefix = boulder_ids.color_prefix(color)
+        rows.append((line, (f"M{prefix}{next(numbers[prefix]):03d}", date, boulder_description, color, *flags)))
+
+    # Nested transactions are savepoints
+    errors = []
+    try:
+        async with conn.transaction():
+            await conn.executemany(BOULDER_INSERT_SQL, [row for _, row in rows])
+        imported = rows
+    except asyncpg.IntegrityConstraintViolationError:
+        imported = []
+        for line, row in rows:
+            try:
+                async with conn.transaction():
+                    await conn.execute(BOULDER_INSERT_SQL, *row)
+                imported.append((line, row))
+            except asyncpg.IntegrityConstraintViolationError as e:
+                errors.append((line, f'{row[0]}: {e}'))
+    return imported, errors
+
+
+async def _receive_boulder(conn, boulder_id, description, flags, timestamp):
+    await conn.execute(FACTORY_UPSERT_SQL, boulder_id, description, *flags, sum(flags), timestamp)
+
+
+async def _add_cutting_machine(conn, name):
+    return await conn.fetchval('INSERT INTO cutting_machine (name) VALUES ($1) RETURNING machine_id', name)
+
+
+async def _record_cutting_run(conn, machine_id, boulder_id, description, num_slabs_cut, start_time, end_time, machine_hours):
+    await conn.execute(RUN_INSERT_SQL, machine_id, boulder_id, description, num_slabs_cut, start_time, end_time,
+                       None if machine_hours is None else float(machine_hours))
+
+
+async def _separate(conn, rows, timestamp):
+    await conn.executemany(SEPARATION_INSERT_SQL, rows)
+    await conn.executemany(SLAB_STATE_UPSERT_SQL, [(row[2], row[0], 'separation', row[3], *row[4:9], timestamp) for row in rows])
+
+
+# Current (boulder_id, stage, description, flags) of each slab, locked until commit
+async def _lock_slabs(conn, slab_ids):
+    rows = await conn.fetch(f'''
+        SELECT slab_id, boulder_id, stage, description, {', '.join(transitions.FLAGS)}
+        FROM slab_state WHERE slab_id = ANY($1::text[])
+        ORDER BY slab_id
+        FOR UPDATE
+    ''', slab_ids)
+    return {row[0]: (row[1], row[2], row[3], list(row[4:])) for row in rows}
+
+
+async def _apply_transitions(conn, stage, batch, timestamp):
+    state = await _lock_slabs(conn, transitions.requested_slabs(batch))
+    stage_rows, state_rows, inventory_rows, movements = transitions.plan(stage, batch, state, timestamp)
+    await conn.executemany(_numbered(transitions.insert_sql(stage)), stage_rows)
+    await conn.executemany(SLAB_STATE_UPSERT_SQL, state_rows)
+    await conn.executemany(INVENTORY_UPSERT_SQL, inventory_rows)
+    return movements
+
+
+async def _cut_special_orders(conn, slab_id, orders, flags, timestamp):
+    state = (await _lock_slabs(conn, [slab_id])).get(slab_id)
+    if state is None or state[1] != 'polishing':
+        raise storage._not_polished(slab_id, state and state[1])
+    polishing_description = await conn.fetchval('SELECT polishing_description FROM polishing WHERE slab_id = $1', slab_id)
+    stage_rows, states, inventory_rows, movements = storage.plan_special_orders(slab_id, state[0], polishing_description, orders, flags, timestamp)
+    await conn.executemany(SPECIAL_ORDER_INSERT_SQL, stage_rows)
+
+    # The parent slab leaves the edge cutting queue; its children move on to bullnose
+    await conn.execute('UPDATE slab_state SET stage = $1, updated_at = $2 WHERE slab_id = $3', 'special_order_cut', timestamp, slab_id)
+    await conn.executemany(SLAB_STATE_UPSERT_SQL, states)
+    await conn.executemany(INVENTORY_UPSERT_SQL, inventory_rows)
+    return movements
+
+
+async def _add_movements(conn, rows):
+    await conn.executemany(MOVEMENT_INSERT_SQL, rows)
+
+
+class PostgresRepository:
+    # `schema`, if given, is put first on every connection's search_path
+    # (create_schema creates it)
+    def __init__(self, dsn, min_size=1, max_size=10, timeout=30, schema=None):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.schema = schema
+        self._pool = None
+        self._pool_lock = None
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    # Start the event loop thread on first use
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._loop = asyncio.new_event_loop()
+                self._pool = None
+                self._pool_lock = None
+                self._thread = threading.Thread(target=self._loop.run_forever, name='postgres', daemon=True)
+                self._thread.start()
+
+    # Run coroutine function fn(*args) on the loop thread and return its result
+    def _call(self, fn, *args):
+        self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(self._guarded(fn, *args), self._loop).result()
+
+    # The same, awaited from another event loop (the ASGI server's)
+    async def _call_async(self, fn, *args):
+        self._ensure_started()
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._guarded(fn, *args), self._loop))
+
+    async def _guarded(self, fn, *args):
+        try:
+            await self._connect()
+            return await fn(*args)
+        except asyncpg.IntegrityConstraintViolationError as e:
+            raise storage.Conflict(str(e)) from e
+        except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError) as e:
+            raise storage.StorageError(str(e)) from e
+
+    # Create the pool on the first call; later calls wait for it
+    async def _connect(self):
+        if self._pool_lock is None:
+            self._pool_lock = asyncio.Lock()
+        async with self._pool_lock:
+            if self._pool is None:
+                settings = {'search_path': f'"{self.schema}", public'} if self.schema else None
+                self._pool = await asyncpg.create_pool(self.dsn, min_size=self.min_size, max_size=self.max_size,
+                                                       command_timeout=self.timeout, server_settings=settings)
+
+    async def _execute(self, sql):
+        async with self._pool.acquire() as conn:
+            await conn.execute(sql)
+
+    async def _transaction(self, fn, *args):
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                return await fn(conn, *args)
+
+    async def _fetch(self, sql, *args):
+        async with self._pool.acquire() as conn:
+            return [tuple(row) for row in await conn.fetch(sql, *args)]
+
+    async def _queue(self, stage):
+        async with self._pool.acquire() as conn:
+            statement = await conn.prepare(storage.QUEUE_QUERIES[stage])
+            return [attribute.name for attribute in statement.get_attributes()], [tuple(row) for row in await statement.fetch()]
+
+    # Create the tables (and the schema, if one was given) when missing
+    def create_schema(self):
+        if self.schema:
+            self._call(self._execute, f'CREATE SCHEMA IF NOT EXISTS "{self.schema}"')
+        self._call(self._execute, SCHEMA)
+
+    # Close the pool and stop the loop thread
+    def close(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        if self._pool is not None:
+            asyncio.run_coroutine_threadsafe(self._pool.close(), self._loop).result()
+            self._pool = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        thread.join()
+        self._loop.close()
+
+    def add_boulder(self, date, description, flags):
+        return self._call(self._transaction, _add_boulder, date, description, flags)
+
+    def import_boulders(self, chunk):
+        return self._call(self._transaction, _import_boulders, chunk)
+
+    def receive_boulder(self, boulder_id, description, flags, timestamp):
+        self._call(self._transaction, _receive_boulder, boulder_id, description, flags, timestamp)
+
+    def cutting_machines(self):
+        return self._call(self._fetch, 'SELECT machine_id, name FROM cutting_machine ORDER BY machine_id')
+
+    def add_cutting_machine(self, name):
+        return self._call(self._transaction, _add_cutting_machine, name)
+
+    def record_cutting_run(self, machine_id, boulder_id, description, num_slabs_cut, start_time, end_time, machine_hours):
+        self._call(self._transaction, _record_cutting_run, machine_id, boulder_id, description, num_slabs_cut,
+                   start_time, end_time, machine_hours)
+
+    def separate(self, entries, timestamp):
+        rows, _, movements = storage.plan_separation(entries, timestamp)
+        self._call(self._transaction, _separate, rows, timestamp)
+        return movements
+
+    def apply_transitions(self, stage, batch, timestamp):
+        return self._call(self._transaction, _apply_transitions, stage, batch, timestamp)
+
+    async def apply_transitions_async(self, stage, batch, timestamp):
+        return await self._call_async(self._transaction, _apply_transitions, stage, batch, timestamp)
+
+    def cut_special_orders(self, slab_id, orders, flags, timestamp):
+        return self._call(self._transaction, _cut_special_orders, slab_id, orders, flags, timestamp)
+
+    def queue(self, stage):
+        return self._call(self._queue, stage)
+
+    async def queue_async(self, stage):
+        return await self._call_async(self._queue, stage)
+
+    def slab(self, slab_id):
+        rows = self._call(self._fetch, SLAB_SQL, slab_id)
+        return rows[0] if rows else None
+
+    def inventory(self):
+        return self._call(self._fetch, storage.INVENTORY_SQL)
+
+    def add_movements(self, rows):
+        self._call(self._transaction, _add_movements, rows)
+
+    def movements(self, boulder_id=None, slab_id=None):
+        sql, params = storage.MOVEMENTS_SQL, ()
+        if boulder_id is not None:
+            sql, params = sql + ' WHERE boulder_id = $1', (boulder_id,)
+        elif slab_id is not None:
+            sql, params = sql + ' WHERE slab_id = $1', (slab_id,)
+        return self._call(self._fetch, sql + ' ORDER BY movement_id', *params)
@@ -0,0 +1,287 @@
+import click
+
+import archive
+import db
+import timestamps
+
+# Daily production totals per stage, kept up to date by every stage write so
+# the dashboard never has to scan the stage tables.
+#
+# slab_rollup counts slabs entering each slab stage by grade; boulder_rollup
+# counts boulders at the quarry, factory, cutting and separation, with slabs
+# cut and machine hours for cutting (for separation, slabs_cut is the number
+# of slabs separated). machine_utilization keeps hourly runs, slabs cut and
+# busy hours per cutting machine for saw capacity planning.
+
+SLAB_STAGES = ('separation', 'polishing', 'edge_cutting', 'bullnose', 'sealant', 'ready')
+BOULDER_STAGES = ('quarry', 'factory', 'cutting', 'separation')
+
+SLAB_UPSERT_SQL = '''
+    INSERT INTO slab_rollup (day, stage, slabs, good, defect_line, natural_cracks, cutting_cracks, thickness_issue)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(day, stage) DO UPDATE SET
+        slabs = slabs + excluded.slabs,
+        good = good + excluded.good,
+        defect_line = defect_line + excluded.defect_line,
+        natural_cracks = natural_cracks + excluded.natural_cracks,
+        cutting_cracks = cutting_cracks + excluded.cutting_cracks,
+        thickness_issue = thickness_issue + excluded.thickness_issue
+'''
+
+BOULDER_UPSERT_SQL = '''
+    INSERT INTO boulder_rollup (day, stage, boulders, good, defect_line, natural_cracks, mining_cracks, undersize,
+                                slabs_cut, machine_hours)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(day, stage) DO UPDATE SET
+        boulders = boulders + excluded.boulders,
+        good = good + excluded.good,
+        defect_line = defect_line + excluded.defect_line,
+        natural_cracks = natural_cracks + excluded.natural_cracks,
+        mining_cracks = mining_cracks + excluded.mining_cracks,
+        undersize = undersize + excluded.undersize,
+        slabs_cut = slabs_cut + excluded.slabs_cut,
+        machine_hours = machine_hours + excluded.machine_hours
+'''
+
+UTILIZATION_UPSERT_SQL = '''
+    INSERT INTO machine_utilization (hour, machine_id, runs, slabs_cut, busy_hours)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(hour, machine_id) DO UPDATE SET
+        runs = runs + excluded.runs,
+        slabs_cut = slabs_cut + excluded.slabs_cut,
+        busy_hours = busy_hours + excluded.busy_hours
+'''
+
+
+# Sum rows of (good, defect_line, natural_cracks, cutting_cracks, thickness_issue) flags by day
+def _totals(days_and_flags):
+    totals = {}
+    for day, flags in days_and_flags:
+        counts = totals.setdefault(day, [0, 0, 0, 0, 0, 0])
+        counts[0] += 1
+        for i, flag in enumerate(flags, start=1):
+            counts[i] += flag or 0
+    return totals
+
+
+# Count slabs entering a slab stage; rows are (epoch timestamp, good, defect_line,
+# natural_cracks, cutting_cracks, thickness_issue). Runs on the caller's
+# connection so the totals commit with the stage rows.
+def add_slabs(conn, stage, rows):
+    totals = _totals((timestamps.day(timestamp), flags) for timestamp, *flags in rows)
+    conn.executemany(SLAB_UPSERT_SQL, [(day, stage, *counts) for day, counts in totals.items()])
+
+
+# Count boulders entering a boulder stage; rows are (epoch timestamp or
+# YYYY-MM-DD date, good, defect_line, natural_cracks, mining_cracks,
+# undersize, slabs_cut, machine_hours)
+def add_boulders(conn, stage, rows):
+    totals = {}
+    for timestamp, *values in rows:
+        counts = totals.setdefault(timestamps.day(timestamp), [0] * 8)
+        counts[0] += 1
+        for i, value in enumerate(values, start=1):
+            counts[i] += value or 0
+    conn.executemany(BOULDER_UPSERT_SQL, [(day, stage, *counts) for day, counts in totals.items()])
+
+
+# Split a run over the local clock hours it covers, as (hour, busy hours)
+# pairs with hours as YYYY-MM-DDTHH. Runs with unreadable times are booked
+# whole to the hour they started in.
+def _busy_hours(start_time, end_time, machine_hours):
+    start = timestamps.parse(start_time)
+    end = timestamps.parse(end_time)
+    if not isinstance(start, int):
+        return [(str(start_time)[:13], machine_hours or 0)]
+    if not isinstance(end, int):
+        return [(timestamps.hour(start), machine_hours or 0)]
+    if end <= start:
+        return [(timestamps.hour(start), 0.0)]
+    busy = []
+    hour = start - (start + timestamps.UTC_OFFSET) % 3600
+    while hour < end:
+        following = hour + 3600
+        busy.append((timestamps.hour(hour), (min(end, following) - max(start, hour)) / 3600))
+        hour = following
+    return busy
+
+
+# Book cutting runs to machine_utilization; rows are (machine_id, start_time,
+# end_time, num_slabs_cut, machine_hours). A run and its slabs count in the
+# hour it started; its busy time is spread over every hour it ran.
+def add_cutting_runs(conn, rows):
+    totals = {}
+    for machine_id, start_time, end_time, num_slabs_cut, machine_hours in rows:
+        for i, (hour, busy) in enumerate(_busy_hours(start_time, end_time, machine_hours)):
+            counts = totals.setdefault((hour, machine_id), [0, 0, 0.0])
+            if i == 0:
+                counts[0] += 1
+                counts[1] += num_slabs_cut or 0
+            counts[2] += busy
+    conn.executemany(UTILIZATION_UPSERT_SQL, [(hour, machine_id, *counts) for (hour, machine_id), counts in totals.items()])
+
+
+# Recompute every rollup from the stage tables (rows without a time are left
+# out), including archived rows when the archive is attached
+def rebuild(conn):
+    conn.execute('DELETE FROM slab_rollup')
+    conn.execute('DELETE FROM boulder_rollup')
+    conn.execute('DELETE FROM machine_utilization')
+    slab_sources = (
+        ('separation', 'separation', 'separation_time', 'good_slabs'),
+        ('polishing', 'polishing', 'polishing_time', 'good_slab'),
+        ('edge_cutting', 'edge_cutting_standard', 'edge_cutting_time', 'good_slab'),
+        ('edge_cutting', 'edge_cutting_special_orders', 'edge_cutting_time', 'good_slab'),
+        ('bullnose', 'bullnose', 'bullnose_time', 'good_slab'),
+        ('sealant', 'sealant', 'sealant_time', 'good_slab'),
+        ('ready', 'ready_slabs', 'ready_time', 'good_slab'),
+    )
+    for stage, table, time_column, good_column in slab_sources:
+        source = archive.source(conn, table)
+        conn.execute(f'''
+            INSERT INTO slab_rollup (day, stage, slabs, good, defect_line, natural_cracks, cutting_cracks, thickness_issue)
+            SELECT {timestamps.day_sql(time_column)}, '{stage}', COUNT(*), TOTAL({good_column}), TOTAL(defect_line),
+                   TOTAL(natural_cracks), TOTAL(cutting_cracks), TOTAL(thickness_issue)
+            FROM {source}
+            WHERE {time_column} IS NOT NULL
+            GROUP BY 1
+            ON CONFLICT(day, stage) DO UPDATE SET
+                slabs = slabs + excluded.slabs,
+                good = good + excluded.good,
+                defect_line = defect_line + excluded.defect_line,
+                natural_cracks = natural_cracks + excluded.natural_cracks,
+                cutting_cracks = cutting_cracks + excluded.cutting_cracks,
+                thickness_issue = thickness_issue + excluded.thickness_issue
+        ''')
+
+    boulder_sources = (
+        ('quarry', 'boulder', 'date', 'good_boulder, defect_line, natural_cracks, mining_cracks, undersize', '0, 0'),
+        ('factory', 'factory', 'received_timestamp', 'good_boulder, defect_line, natural_cracks, mining_cracks, undersize', '0, 0'),
+        ('cutting', 'cutting_run', 'start_time', '0, 0, 0, 0, 0', 'num_slabs_cut, machine_hours'),
+    )
+    for stage, table, time_column, flags, output in boulder_sources:
+        totals = ', '.join(f'TOTAL({column.strip()})' for column in f'{flags}, {output}'.split(','))
+        source = archive.source(conn, table)
+        conn.execute(f'''
+            INSERT INTO boulder_rollup (day, stage, boulders, good, defect_line, natural_cracks, mining_cracks, undersize,
+                                        slabs_cut, machine_hours)
+            SELECT {timestamps.day_sql(time_column)}, '{stage}', COUNT(*), {totals}
+            FROM {source}
+            WHERE {time_column} IS NOT NULL
+            GROUP BY 1
+        ''')
+    # Boulders separated, on the day their first slab was separated
+    conn.execute(f'''
+        INSERT INTO boulder_rollup (day, stage, boulders, good, defect_line, natural_cracks, mining_cracks, undersize,
+                                    slabs_cut, machine_hours)
+        SELECT day, 'separation', COUNT(*), 0, 0, 0, 0, 0, TOTAL(slabs), 0
+        FROM (
+            SELECT boulder_id, {timestamps.day_sql('MIN(separation_time)')} AS day, COUNT(*) AS slabs
+            FROM {archive.source(conn, 'separation')} GROUP BY boulder_id
+        )
+        WHERE day IS NOT NULL
+        GROUP BY day
+    ''')
+
+    # Fetched up front: migrations pass a cursor, which the upserts would reset
+    runs = conn.execute(f'''
+        SELECT machine_id, start_time, end_time, num_slabs_cut, machine_hours
+        FROM {archive.source(conn, 'cutting_run')} WHERE start_time IS NOT NULL
+    ''').fetchall()
+    add_cutting_runs(conn, runs)
+
+
+# Cutting machine utilization from `since` (YYYY-MM-DD) on, per hour or per
+# day: (period, machine_id, name, runs, slabs_cut, busy_hours, utilization),
+# newest first, where utilization is the share of the period the saw was busy
+def utilization(conn, since, by='day'):
+    period, capacity = ('hour', 1) if by == 'hour' else ('substr(hour, 1, 10)', 24)
+    return [
+        (*row, row[5] / capacity)
+        for row in conn.execute(f'''
+            SELECT {period} AS period, u.machine_id, m.name, SUM(u.runs), SUM(u.slabs_cut), SUM(u.busy_hours)
+            FROM machine_utilization u
+            LEFT JOIN cutting_machine m ON m.machine_id = u.machine_id
+            WHERE u.hour >= ?
+            GROUP BY period, u.machine_id
+            ORDER BY period DESC, u.machine_id
+        ''', (since,))
+    ]
+
+
+# Everything the dashboard shows for the `days` days from `since` (YYYY-MM-DD)
+# on, read from the rollup tables only
+def dashboard(conn, since, days):
+    stages = {stage: [0] * 6 for stage in SLAB_STAGES}
+    for stage, *counts in conn.execute('''
+        SELECT stage, SUM(slabs), SUM(good), SUM(defect_line), SUM(natural_cracks), SUM(cutting_cracks), SUM(thickness_issue)
+        FROM slab_rollup WHERE day >= ? GROUP BY stage
+    ''', (since,)):
+        stages[stage] = counts
+
+    boulders = {stage: [0] * 8 for stage in BOULDER_STAGES}
+    for stage, *counts in conn.execute('''
+        SELECT stage, SUM(boulders), SUM(good), SUM(defect_line), SUM(natural_cracks), SUM(mining_cracks), SUM(undersize),
+               SUM(slabs_cut), SUM(machine_hours)
+        FROM boulder_rollup WHERE day >= ? GROUP BY stage
+    ''', (since,)):
+        boulders[stage] = counts
+
+    daily = conn.execute('''
+        SELECT day,
+               SUM(CASE WHEN source = 'quarry' THEN count ELSE 0 END),
+               SUM(CASE WHEN source = 'separation' THEN count ELSE 0 END),
+               SUM(CASE WHEN source = 'ready' THEN count ELSE 0 END),
+               SUM(CASE WHEN source = 'ready' THEN good ELSE 0 END)
+        FROM (
+            SELECT day, stage AS source, boulders AS count, good FROM boulder_rollup WHERE stage = 'quarry' AND day >= ?
+            UNION ALL
+            SELECT day, stage, slabs, good FROM slab_rollup WHERE stage IN ('separation', 'ready') AND day >= ?
+        )
+        GROUP BY day ORDER BY day DESC
+    ''', (since, since)).fetchall()
+
+    # Every configured machine, including any that sat idle all window
+    machines = conn.execute('''
+        SELECT m.machine_id, m.name, TOTAL(u.runs), TOTAL(u.slabs_cut), TOTAL(u.busy_hours)
+        FROM cutting_machine m
+        LEFT JOIN machine_utilization u ON u.machine_id = m.machine_id AND u.hour >= ?
+        GROUP BY m.machine_id
+        ORDER BY m.machine_id
+    ''', (since,)).fetchall()
+
+    separated = boulders['separation']
+    return {
+        'since': since,
+        'stages': stages,
+        'boulders': boulders,
+        'daily': daily,
+        'machines': [(*row, row[4] / (days * 24)) for row in machines],
+        'machine_days': utilization(conn, since),
+        # Slabs per boulder separated, and good slabs per boulder at separation and when ready
+        'yield': {
+            'slabs_per_boulder': separated[6] / separated[0] if separated[0] else None,
+            'good_per_boulder': stages['separation'][1] / separated[0] if separated[0] else None,
+            'ready_good_per_boulder': stages['ready'][1] / separated[0] if separated[0] else None,
+        },
+    }
+
+
+# Register the rebuild-rollups command
+def init_app(app):
+    @app.cli.command('rebuild-rollups')
+    def rebuild_command():
+        """Recompute the production and utilization rollups from the stage tables."""
+        conn = db.connect(app.config['DATABASE'], app.config.get('DB_TIMEOUT', 30))
+        conn.isolation_level = None
+        archive.attach(conn, app.config.get('ARCHIVE_DATABASE'))
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            rebuild(conn)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        click.echo('Rebuilt the production rollups.')
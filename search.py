@@ -0,0 +1,177 @@
+import html
+import re
+
+import click
+
+import db
+
+# Full-text search over the free text operators type: boulder and slab
+# descriptions, stage descriptions, special-order details and the movement
+# log. Every source row has one entry in the FTS5 table search_index, kept in
+# step by triggers on the source tables, so a search is an index lookup
+# instead of LIKE scans across every table.
+#
+# An entry's rowid is the source row's rowid * 16 + the source's code, so the
+# triggers can find and replace an entry without scanning the index. VACUUM
+# may renumber the rowids of boulder (its key is not an INTEGER PRIMARY KEY),
+# so run `flask --app app rebuild-search-index` after one.
+
+# Indexed sources: table -> (code, indexed text columns, boulder_id expression, slab_id expression)
+SOURCES = {
+    'boulder': (1, ('boulder_description',), 'boulder_id', 'NULL'),
+    'separation': (2, ('slab_description', 'boulder_description'), 'boulder_id', 'slab_id'),
+    'polishing': (3, ('polishing_description',), 'NULL', 'slab_id'),
+    'edge_cutting_standard': (4, ('edge_cutting_description',), 'NULL', 'slab_id'),
+    'edge_cutting_special_orders': (5, ('edge_cutting_description', 'special_order_details'), 'NULL', 'slab_id'),
+    'bullnose': (6, ('bullnose_description',), 'NULL', 'slab_id'),
+    'sealant': (7, ('sealant_description',), 'NULL', 'slab_id'),
+    'movement': (8, ('details',), 'boulder_id', 'slab_id'),
+}
+
+# Stage page listing each source's rows, and the page for each slab_state stage
+SOURCE_PAGES = {
+    'boulder': 'quarry',
+    'separation': 'separation',
+    'polishing': 'polishing',
+    'edge_cutting_standard': 'edge_cutting_standard',
+    'edge_cutting_special_orders': 'edge_cutting_special_orders',
+    'bullnose': 'bullnose',
+    'sealant': 'sealant',
+}
+STAGE_PAGES = {
+    'separation': 'separation',
+    'polishing': 'polishing',
+    'edge_cutting': 'edge_cutting_standard',
+    'special_order_cut': 'edge_cutting_special_orders',
+    'bullnose': 'bullnose',
+    'sealant': 'sealant',
+    'ready': 'ready_slabs',
+}
+
+MAX_RESULTS = 200
+
+QUERY_SQL = '''
+    SELECT si.kind, si.boulder_id, si.slab_id, st.boulder_id, st.stage,
+           snippet(search_index, 0, char(2), char(3), '...', 16)
+    FROM search_index si
+    LEFT JOIN slab_state st ON st.slab_id = si.slab_id
+    WHERE search_index MATCH ?
+    ORDER BY rank
+    LIMIT ?
+'''
+
+
+def _body(prefix, columns):
+    return " || ' ' || ".join(f"COALESCE({prefix}.{column}, '')" for column in columns)
+
+
+def _entry_sql(table, prefix):
+    code, columns, boulder_id, slab_id = SOURCES[table]
+    boulder_id = 'NULL' if boulder_id == 'NULL' else f'{prefix}.{boulder_id}'
+    slab_id = 'NULL' if slab_id == 'NULL' else f'{prefix}.{slab_id}'
+    return f'''
+        INSERT INTO search_index (rowid, body, kind, boulder_id, slab_id)
+        VALUES ({prefix}.rowid * 16 + {code}, {_body(prefix, columns)}, '{table}', {boulder_id}, {slab_id});
+    '''
+
+
+# Create the index and its triggers (migration 10); fills it from the current rows
+def create(cursor):
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+            body, kind UNINDEXED, boulder_id UNINDEXED, slab_id UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+        )
+    ''')
+    for table, (code, columns, _, _) in SOURCES.items():
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS search_{table}_insert AFTER INSERT ON {table} BEGIN
+                {_entry_sql(table, 'NEW')}
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS search_{table}_delete AFTER DELETE ON {table} BEGIN
+                DELETE FROM search_index WHERE rowid = OLD.rowid * 16 + {code};
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS search_{table}_update AFTER UPDATE ON {table} BEGIN
+                DELETE FROM search_index WHERE rowid = OLD.rowid * 16 + {code};
+                {_entry_sql(table, 'NEW')}
+            END
+        ''')
+    rebuild(cursor)
+
+
+# Refill the index from the source tables
+def rebuild(conn):
+    conn.execute('DELETE FROM search_index')
+    for table, (code, columns, boulder_id, slab_id) in SOURCES.items():
+        conn.execute(f'''
+            INSERT INTO search_index (rowid, body, kind, boulder_id, slab_id)
+            SELECT rowid * 16 + {code}, {_body(table, columns)}, '{table}', {boulder_id}, {slab_id}
+            FROM {table}
+        ''')
+    conn.execute("INSERT INTO search_index (search_index) VALUES ('optimize')")
+
+
+# Turn what was typed into an FTS5 query: every word must match, the last one
+# as a prefix, and nothing typed is treated as query syntax
+def match_expression(text):
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+# Ranked hits for the text, best first, as dicts (see hit)
+def query(conn, text, limit=50):
+    expression = match_expression(text)
+    if expression is None:
+        return []
+    return [hit(row) for row in conn.execute(QUERY_SQL, (expression, min(limit, MAX_RESULTS)))]
+
+
+# One QUERY_SQL row as a dict with the source, boulder and slab IDs, the
+# slab's current stage, the stage page to open (the slab's current stage, or
+# the source's page for boulder and archived hits) and an HTML snippet with
+# the matching words in <mark>
+def hit(row):
+    kind, boulder_id, slab_id, slab_boulder_id, stage, snippet = row
+    boulder_id = boulder_id or slab_boulder_id
+    if slab_id and stage:
+        page = STAGE_PAGES[stage]
+        if page == 'edge_cutting_standard' and '_OS' in slab_id:
+            page = 'edge_cutting_special_orders'
+    else:
+        page = SOURCE_PAGES.get(kind, 'quarry')
+    return {
+        'kind': kind,
+        'boulder_id': boulder_id,
+        'slab_id': slab_id,
+        'stage': stage,
+        'page': page,
+        'page_filter': slab_id or boulder_id,
+        'snippet': html.escape(snippet).replace('\x02', '<mark>').replace('\x03', '</mark>'),
+    }
+
+
+# Register the rebuild-search-index command
+def init_app(app):
+    @app.cli.command('rebuild-search-index')
+    def rebuild_command():
+        """Rebuild the full-text search index from the source tables."""
+        conn = db.connect(app.config['DATABASE'], app.config.get('DB_TIMEOUT', 30))
+        conn.isolation_level = None
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            rebuild(conn)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        click.echo('Rebuilt the search index.')
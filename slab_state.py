@@ -0,0 +1,108 @@
+import click
+
+import db
+
+# Stages a slab can be in, in workflow order. A slab's stage is the last one
+# it completed; a polished slab cut into special orders stays behind as
+# 'special_order_cut' while its '<slab>_OS###' children move on.
+STAGES = ('separation', 'polishing', 'edge_cutting', 'special_order_cut', 'bullnose', 'sealant', 'ready')
+
+UPSERT_SQL = '''
+    INSERT INTO slab_state (slab_id, boulder_id, stage, description, good_slab, defect_line,
+                            natural_cracks, cutting_cracks, thickness_issue, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(slab_id) DO UPDATE SET
+        boulder_id=COALESCE(excluded.boulder_id, slab_state.boulder_id),
+        stage=excluded.stage,
+        description=excluded.description,
+        good_slab=excluded.good_slab,
+        defect_line=excluded.defect_line,
+        natural_cracks=excluded.natural_cracks,
+        cutting_cracks=excluded.cutting_cracks,
+        thickness_issue=excluded.thickness_issue,
+        updated_at=excluded.updated_at
+'''
+
+
+# Record slabs' new stage; rows are (slab_id, boulder_id, stage, description,
+# good_slab, defect_line, natural_cracks, cutting_cracks, thickness_issue, updated_at).
+# Runs on the caller's connection so it commits with the stage insert.
+def upsert(conn, rows):
+    conn.executemany(UPSERT_SQL, rows)
+
+
+# Move slabs to a stage without touching their description or flags
+def move(conn, slab_ids, stage, updated_at):
+    conn.executemany(
+        'UPDATE slab_state SET stage = ?, updated_at = ? WHERE slab_id = ?',
+        [(stage, updated_at, slab_id) for slab_id in slab_ids],
+    )
+
+
+# Recompute every row from the stage tables, replaying the stages in order
+def rebuild(conn):
+    conn.execute('DELETE FROM slab_state')
+    conn.execute('''
+        INSERT INTO slab_state (slab_id, boulder_id, stage, description, good_slab, defect_line,
+                                natural_cracks, cutting_cracks, thickness_issue, updated_at)
+        SELECT slab_id, boulder_id, 'separation', slab_description, good_slabs, defect_line,
+               natural_cracks, cutting_cracks, thickness_issue, separation_time
+        FROM separation
+    ''')
+    replay = (
+        ('polishing', 'polishing_description', 'polishing_time', 'polishing'),
+        ('edge_cutting', 'edge_cutting_description', 'edge_cutting_time', 'edge_cutting_standard'),
+        ('edge_cutting', 'edge_cutting_description', 'edge_cutting_time', 'edge_cutting_special_orders'),
+        ('bullnose', 'bullnose_description', 'bullnose_time', 'bullnose'),
+        ('sealant', 'sealant_description', 'sealant_time', 'sealant'),
+        ('ready', 'sealant_description', 'ready_time', 'ready_slabs'),
+    )
+    for stage, description, timestamp, table in replay:
+        if table == 'edge_cutting_special_orders':
+            # Parents of special-order slabs, then the children themselves
+            conn.execute('''
+                UPDATE slab_state SET stage = 'special_order_cut', updated_at = o.cut_time
+                FROM (
+                    SELECT substr(slab_id, 1, length(slab_id) - 6) AS parent_id, MAX(edge_cutting_time) AS cut_time
+                    FROM edge_cutting_special_orders
+                    GROUP BY parent_id
+                ) o
+                WHERE slab_state.slab_id = o.parent_id
+            ''')
+        conn.execute(f'''
+            INSERT INTO slab_state (slab_id, boulder_id, stage, description, good_slab, defect_line,
+                                    natural_cracks, cutting_cracks, thickness_issue, updated_at)
+            SELECT t.slab_id, p.boulder_id, '{stage}', t.{description}, t.good_slab, t.defect_line,
+                   t.natural_cracks, t.cutting_cracks, t.thickness_issue, t.{timestamp}
+            FROM {table} t
+            LEFT JOIN slab_state p ON p.slab_id = substr(t.slab_id, 1, length(t.slab_id) - 6)
+            WHERE true
+            ON CONFLICT(slab_id) DO UPDATE SET
+                stage=excluded.stage,
+                description=excluded.description,
+                good_slab=excluded.good_slab,
+                defect_line=excluded.defect_line,
+                natural_cracks=excluded.natural_cracks,
+                cutting_cracks=excluded.cutting_cracks,
+                thickness_issue=excluded.thickness_issue,
+                updated_at=excluded.updated_at
+        ''')
+
+
+# Register the rebuild-slab-state command
+def init_app(app):
+    @app.cli.command('rebuild-slab-state')
+    def rebuild_command():
+        """Recompute the slab_state table from the stage tables."""
+        conn = db.connect(app.config['DATABASE'], app.config.get('DB_TIMEOUT', 30))
+        conn.isolation_level = None
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            rebuild(conn)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        click.echo('Rebuilt slab_state.')
@@ -0,0 +1,430 @@
+import asyncio
+import sqlite3
+
+from flask import current_app
+
+import boulder_ids
+import cutting
+import db
+import rollups
+import slab_state
+import transitions
+
+# The workflow data (boulders, cutting runs, separation, the finishing
+# stages, inventory and the movement log) is read and written through a
+# repository, so the workflow routes hold no SQL of their own.
+# SQLiteRepository below is what the app runs on, and the only backend
+# init_app installs: the history pages, dashboard, search, exports, trace
+# and page cache still query SQLite through db.get_db(), and only the SQLite
+# writes maintain the dashboard rollups. postgres.PostgresRepository keeps
+# the workflow data in PostgreSQL as groundwork for a shared multi-site
+# database; it is not selectable in the app. Both take the same arguments,
+# return the same rows and raise the same errors, and
+# tests/test_conformance.py runs one workflow against both (PostgreSQL when
+# INVENTORY_TEST_PG_DSN is set).
+#
+# Repository methods:
+#
+#   add_boulder(date, description, flags)            -> boulder_id
+#   import_boulders(chunk)                           -> (imported, errors)
+#   receive_boulder(boulder_id, description, flags, timestamp)
+#   cutting_machines()                               -> [(machine_id, name)]
+#   add_cutting_machine(name)                        -> machine_id
+#   record_cutting_run(machine_id, boulder_id, description, num_slabs_cut, start_time, end_time, machine_hours)
+#   separate(entries, timestamp)                     -> movements
+#   apply_transitions(stage, transitions, timestamp) -> movements
+#   async apply_transitions_async(stage, transitions, timestamp) -> movements
+#   cut_special_orders(slab_id, orders, flags, timestamp) -> movements
+#   queue(stage)                                     -> (columns, rows)
+#   async queue_async(stage)                         -> (columns, rows)
+#   slab(slab_id)                                    -> (boulder_id, stage, description, *flags) or None
+#   inventory()                                      -> rows
+#   add_movements(rows)
+#   movements(boulder_id=None, slab_id=None)         -> rows
+#
+# Boulder flags are (good_boulder, defect_line, natural_cracks, mining_cracks,
+# undersize); slab flags are transitions.FLAGS. Movements to log are
+# (stage, details, boulder_id, slab_id); movement rows to add are
+# (boulder_id, slab_id, stage, details, date). Times are epoch seconds (see
+# timestamps.py). The async methods are for the ASGI serving mode (asgi.py)
+# and never block the event loop.
+
+# Work queue of every stage. Boulder queues are NOT EXISTS anti-joins against
+# the next stage; slab queues are equality lookups on slab_state.stage. Both
+# must stay index lookups (see `flask check-query-plans`).
+QUEUE_QUERIES = {
+    # Good boulders from the quarry that are not already in the factory
+    'factory': '''
+        SELECT b.boulder_id, b.boulder_description
+        FROM boulder b
+        WHERE b.good_boulder = 1
+        AND NOT EXISTS (SELECT 1 FROM factory f WHERE f.boulder_id = b.boulder_id)
+    ''',
+    # Boulders received in the factory that have not been cut yet
+    'cutting_machine': '''
+        SELECT f.boulder_id, f.boulder_description
+        FROM factory f
+        WHERE NOT EXISTS (SELECT 1 FROM cutting_run c WHERE c.boulder_id = f.boulder_id)
+    ''',
+    # Cut boulders that have not been separated, with the number of slabs cut
+    'separation': '''
+        SELECT c.boulder_id, MAX(c.boulder_description) AS boulder_description, SUM(c.num_slabs_cut) AS num_slabs_cut
+        FROM cutting_run c
+        WHERE NOT EXISTS (SELECT 1 FROM separation s WHERE s.boulder_id = c.boulder_id)
+        GROUP BY c.boulder_id
+    ''',
+    # Slabs that have been separated but not polished
+    'polishing': '''
+        SELECT st.slab_id, st.description,
+               CASE
+                   WHEN st.good_slab = 1 THEN 'Good'
+                   WHEN st.defect_line = 1 THEN 'Defect Line'
+                   WHEN st.natural_cracks = 1 THEN 'Natural Cracks'
+                   WHEN st.cutting_cracks = 1 THEN 'Cutting Cracks'
+                   WHEN st.thickness_issue = 1 THEN 'Thickness Issue'
+                   ELSE 'Unknown'
+               END as original_status
+        FROM slab_state st
+        WHERE st.stage = 'separation'
+    ''',
+    # Slabs that have been polished but not edge cut
+    'edge_cutting': '''
+        SELECT st.slab_id, st.description
+        FROM slab_state st
+        WHERE st.stage = 'polishing'
+    ''',
+    # Slabs that have been edge cut (standard or special order) but not bullnosed
+    'bullnose': '''
+        SELECT st.slab_id, st.description
+        FROM slab_state st
+        WHERE st.stage = 'edge_cutting'
+    ''',
+    # Slabs that have been bullnosed but not sealed
+    'sealant': '''
+        SELECT st.slab_id, st.description
+        FROM slab_state st
+        WHERE st.stage = 'bullnose'
+    ''',
+    # Slabs that have been sealed but not marked as ready
+    'ready_slabs': '''
+        SELECT st.slab_id, st.description
+        FROM slab_state st
+        WHERE st.stage = 'sealant'
+    ''',
+}
+
+BOULDER_INSERT_SQL = '''
+    INSERT INTO boulder
+    (boulder_id, date, boulder_description, color, good_boulder, defect_line, natural_cracks, mining_cracks, undersize, total_boulders)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+SEPARATION_INSERT_SQL = '''
+    INSERT INTO separation
+    (boulder_id, boulder_description, slab_id, slab_description, good_slabs, defect_line, natural_cracks, cutting_cracks,
+    thickness_issue, total_slabs, separation_time)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+SPECIAL_ORDER_INSERT_SQL = '''
+    INSERT INTO edge_cutting_special_orders (slab_id, polishing_description, edge_cutting_description,
+                                             special_order_details, good_slab, defect_line, natural_cracks, cutting_cracks,
+                                             thickness_issue, edge_cutting_time)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+MOVEMENT_INSERT_SQL = 'INSERT INTO movement (boulder_id, slab_id, stage, details, date) VALUES (?, ?, ?, ?, ?)'
+
+SLAB_SQL = f'SELECT boulder_id, stage, description, {", ".join(transitions.FLAGS)} FROM slab_state WHERE slab_id = ?'
+
+INVENTORY_SQL = f'SELECT slab_id, slab_description, stage, {", ".join(transitions.FLAGS)} FROM inventory ORDER BY slab_id'
+
+MOVEMENTS_SQL = 'SELECT boulder_id, slab_id, stage, details, date FROM movement'
+
+
+# Base of the repository errors
+class StorageError(Exception):
+    pass
+
+
+# A write clashed with existing rows (a duplicate ID or a missing parent row)
+class Conflict(StorageError):
+    pass
+
+
+# Expand per-category slab counts into one
+# (good, defect_line, natural_cracks, cutting_cracks, thickness_issue) flag tuple per slab
+def slab_flags(good_slabs, defect_line, natural_cracks, cutting_cracks, thickness_issue):
+    counts = (good_slabs, defect_line, natural_cracks, cutting_cracks, thickness_issue)
+    for category, count in enumerate(counts):
+        flags = tuple(1 if i == category else 0 for i in range(len(counts)))
+        for _ in range(count):
+            yield flags
+
+
+# Build the separation rows, per-boulder slab totals and movements for
+# separating boulders. entries are (boulder_id, boulder_description,
+# slab_description, counts) with one count per slab flag; a boulder listed
+# twice is only separated once. Slab IDs are <boulder>_S<color letter><nnn>.
+# Raises TransitionError if any entry has a blank slab description.
+def plan_separation(entries, timestamp):
+    rows = []
+    totals = {}
+    movements = []
+    errors = []
+    seen = set()
+    for index, (boulder_id, boulder_description, slab_description, counts) in enumerate(entries):
+        if not boulder_id or boulder_id in seen:
+            continue
+        seen.add(boulder_id)
+        if not slab_description or not slab_description.strip():
+            errors.append({'index': index, 'boulder_id': boulder_id, 'error': 'slab description is required'})
+            continue
+
+        # The slab color's first letter goes into the slab IDs
+        slab_color_prefix = slab_description.split()[0][0].upper()
+
+        total_slabs = sum(counts)
+        if total_slabs:
+            totals[boulder_id] = total_slabs
+        for number, flags in enumerate(slab_flags(*counts), start=1):
+            slab_id = f"{boulder_id}_S{slab_color_prefix}{number:03d}"
+            rows.append((boulder_id, boulder_description, slab_id, slab_description, *flags, total_slabs, timestamp))
+            movements.append(("Separation", f"Slab {slab_id} from Boulder {boulder_id} separated.", boulder_id, slab_id))
+    if errors:
+        raise transitions.TransitionError(errors)
+    return rows, totals, movements
+
+
+# Build the rows for cutting a polished slab into special orders: orders are
+# (size, description) pairs and each becomes a <slab>_OS<nnn> child slab that
+# moves on to bullnose. Returns (stage rows, slab_state rows, inventory rows,
+# movements).
+def plan_special_orders(slab_id, boulder_id, polishing_description, orders, flags, timestamp):
+    stage_rows = []
+    states = []
+    inventory_rows = []
+    movements = []
+    for i, (size, description) in enumerate(orders):
+        special_slab_id = f"{slab_id}_OS{(i + 1):03d}"
+        stage_rows.append((special_slab_id, polishing_description, description, size, *flags, timestamp))
+        states.append((special_slab_id, boulder_id, 'edge_cutting', description, *flags, timestamp))
+        inventory_rows.append((special_slab_id, description, 'Awaiting Bullnose', *flags))
+        movements.append(("Edge Cutting Special Orders", f"Special Order Slab {special_slab_id} edge cut from {slab_id} with size: {size}.", None, special_slab_id))
+    return stage_rows, states, inventory_rows, movements
+
+
+# Raised by cut_special_orders for a slab that is not waiting for edge cutting
+def _not_polished(slab_id, stage):
+    error = 'unknown slab' if stage is None else f"slab is at stage '{stage}', expected 'polishing'"
+    return transitions.TransitionError([{'index': 0, 'slab_id': slab_id, 'error': error}])
+
+
+# Write functions of SQLiteRepository; each runs in its own transaction on the
+# app's writer thread (see writer.py)
+
+def _add_boulder(conn, date, description, flags):
+    color = description.split()[0]
+    # Generate boulder_id from the color's sequence (same transaction as the insert)
+    boulder_id = boulder_ids.allocate(conn, color)[0]
+    conn.execute(BOULDER_INSERT_SQL, (boulder_id, date, description, color, *flags, sum(flags)))
+    rollups.add_boulders(conn, 'quarry', [(date, *flags, 0, 0)])
+    return boulder_id
+
+
+def _import_boulders(conn, chunk):
+    per_prefix = {}
+    for _, row in chunk:
+        prefix = boulder_ids.color_prefix(row[2])
+        per_prefix[prefix] = per_prefix.get(prefix, 0) + 1
+    numbers = {prefix: iter(boulder_ids.reserve(conn, prefix, count)) for prefix, count in per_prefix.items()}
+
+    rows = []
+    for line, (date, boulder_description, color, *flags) in chunk:
+        prefix = boulder_ids.color_prefix(color)
+        rows.append((line, (f"M{prefix}{next(numbers[prefix]):03d}", date, boulder_description, color, *flags)))
+
+    conn.execute('SAVEPOINT boulder_chunk')
+    errors = []
+    try:
+        conn.executemany(BOULDER_INSERT_SQL, [row for _, row in rows])
+        imported = rows
+    except sqlite3.IntegrityError:
+        conn.execute('ROLLBACK TO boulder_chunk')
+        imported = []
+        for line, row in rows:
+            try:
+                conn.execute(BOULDER_INSERT_SQL, row)
+                imported.append((line, row))
+            except sqlite3.IntegrityError as e:
+                errors.append((line, f'{row[0]}: {e}'))
+    conn.execute('RELEASE boulder_chunk')
+    rollups.add_boulders(conn, 'quarry', [(row[1], *row[4:9], 0, 0) for _, row in imported])
+    return imported, errors
+
+
+def _receive_boulder(conn, boulder_id, description, flags, timestamp):
+    conn.execute('''
+        INSERT INTO factory
+        (boulder_id, boulder_description, good_boulder, defect_line, natural_cracks,
+        mining_cracks, undersize, total_boulders, received_timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(boulder_id) DO UPDATE SET
+            boulder_description=excluded.boulder_description,
+            good_boulder=excluded.good_boulder,
+            defect_line=excluded.defect_line,
+            natural_cracks=excluded.natural_cracks,
+            mining_cracks=excluded.mining_cracks,
+            undersize=excluded.undersize,
+            total_boulders=excluded.total_boulders,
+            received_timestamp=excluded.received_timestamp
+    ''', (boulder_id, description, *flags, sum(flags), timestamp))
+    rollups.add_boulders(conn, 'factory', [(timestamp, *flags, 0, 0)])
+
+
+def _add_cutting_machine(conn, name):
+    return conn.execute('INSERT INTO cutting_machine (name) VALUES (?) RETURNING machine_id', (name,)).fetchone()[0]
+
+
+def _separate(conn, rows, totals, timestamp):
+    conn.executemany(SEPARATION_INSERT_SQL, rows)
+    slab_state.upsert(conn, [(row[2], row[0], 'separation', row[3], *row[4:9], timestamp) for row in rows])
+    rollups.add_slabs(conn, 'separation', [(timestamp, *row[4:9]) for row in rows])
+    rollups.add_boulders(conn, 'separation', [(timestamp, 0, 0, 0, 0, 0, total, 0) for total in totals.values()])
+
+
+def _cut_special_orders(conn, slab_id, orders, flags, timestamp):
+    state = conn.execute('SELECT boulder_id, stage FROM slab_state WHERE slab_id = ?', (slab_id,)).fetchone()
+    if state is None or state[1] != 'polishing':
+        raise _not_polished(slab_id, state and state[1])
+    polishing_description = conn.execute('SELECT polishing_description FROM polishing WHERE slab_id = ?', (slab_id,)).fetchone()[0]
+    stage_rows, states, inventory_rows, movements = plan_special_orders(slab_id, state[0], polishing_description, orders, flags, timestamp)
+    conn.executemany(SPECIAL_ORDER_INSERT_SQL, stage_rows)
+
+    # The parent slab leaves the edge cutting queue; its children move on to bullnose
+    slab_state.move(conn, [slab_id], 'special_order_cut', timestamp)
+    slab_state.upsert(conn, states)
+    rollups.add_slabs(conn, 'edge_cutting', [(timestamp, *flags)] * len(states))
+    transitions.upsert_inventory(conn, inventory_rows)
+    return movements
+
+
+def _add_movements(conn, rows):
+    conn.executemany(MOVEMENT_INSERT_SQL, rows)
+
+
+def _queue(conn, stage):
+    cursor = conn.execute(QUEUE_QUERIES[stage])
+    return [column[0] for column in cursor.description], cursor.fetchall()
+
+
+# Run write function fn on the writer's connection, reporting a constraint
+# violation as Conflict (the writer rolls the transaction back either way)
+def _checked(conn, fn, *args):
+    try:
+        return fn(conn, *args)
+    except sqlite3.IntegrityError as e:
+        raise Conflict(str(e)) from e
+
+
+# The app's SQLite database. Writes go through the app's writer (see
+# writer.py); reads use the request's pooled connection (db.get_db), so they
+# need an app context. The async reads use `readers`, a pool of aiosqlite
+# connections that asgi.py sets up, or else a connection of their own on a
+# worker thread.
+class SQLiteRepository:
+    def __init__(self, writer):
+        self.writer = writer
+        self.readers = None
+
+    def _write(self, fn, *args):
+        return self.writer.run(_checked, fn, *args)
+
+    def add_boulder(self, date, description, flags):
+        return self._write(_add_boulder, date, description, flags)
+
+    # Write one chunk of parsed quarry manifest rows, (line, (date,
+    # description, color, *flags, total)), reserving one block of IDs per
+    # color prefix. If a row clashes with an existing boulder the chunk is
+    # retried row by row. Returns the imported (line, row) pairs and the
+    # (line, error) of each row that failed.
+    def import_boulders(self, chunk):
+        return self._write(_import_boulders, chunk)
+
+    def receive_boulder(self, boulder_id, description, flags, timestamp):
+        self._write(_receive_boulder, boulder_id, description, flags, timestamp)
+
+    def cutting_machines(self):
+        return cutting.machines(db.get_db())
+
+    def add_cutting_machine(self, name):
+        return self._write(_add_cutting_machine, name)
+
+    def record_cutting_run(self, machine_id, boulder_id, description, num_slabs_cut, start_time, end_time, machine_hours):
+        self._write(cutting.record_run, machine_id, boulder_id, description, num_slabs_cut, start_time, end_time, machine_hours)
+
+    def separate(self, entries, timestamp):
+        rows, totals, movements = plan_separation(entries, timestamp)
+        self._write(_separate, rows, totals, timestamp)
+        return movements
+
+    # The writer takes the write lock first (BEGIN IMMEDIATE), so no other
+    # writer can move these slabs between the stage check and the inserts
+    def apply_transitions(self, stage, batch, timestamp):
+        return self._write(transitions.apply, stage, batch, timestamp)
+
+    async def apply_transitions_async(self, stage, batch, timestamp):
+        return await asyncio.wrap_future(self.writer.submit(_checked, transitions.apply, stage, batch, timestamp))
+
+    def cut_special_orders(self, slab_id, orders, flags, timestamp):
+        return self._write(_cut_special_orders, slab_id, orders, flags, timestamp)
+
+    def queue(self, stage):
+        return _queue(db.get_db(), stage)
+
+    async def queue_async(self, stage):
+        if self.readers is None:
+            return await asyncio.to_thread(self._queue_on_own_connection, stage)
+        async with self.readers.connection() as conn:
+            async with conn.execute(QUEUE_QUERIES[stage]) as cursor:
+                return [column[0] for column in cursor.description], list(await cursor.fetchall())
+
+    def _queue_on_own_connection(self, stage):
+        conn = db.connect(self.writer.database)
+        try:
+            return _queue(conn, stage)
+        finally:
+            conn.close()
+
+    def slab(self, slab_id):
+        return db.get_db().execute(SLAB_SQL, (slab_id,)).fetchone()
+
+    def inventory(self):
+        return db.get_db().execute(INVENTORY_SQL).fetchall()
+
+    def add_movements(self, rows):
+        self._write(_add_movements, rows)
+
+    def movements(self, boulder_id=None, slab_id=None):
+        sql, params = MOVEMENTS_SQL, ()
+        if boulder_id is not None:
+            sql, params = sql + ' WHERE boulder_id = ?', (boulder_id,)
+        elif slab_id is not None:
+            sql, params = sql + ' WHERE slab_id = ?', (slab_id,)
+        return db.get_db().execute(sql + ' ORDER BY movement_id', params).fetchall()
+
+
+# Get the repository of the current app
+def get_storage():
+    return get_storage_of(current_app)
+
+
+# Get the repository of a Flask app, outside its app context
+def get_storage_of(app):
+    return app.extensions['storage']
+
+
+# Attach the SQLite repository to the Flask app (after writer.init_app). The
+# app runs on SQLite only; see the note at the top of this module.
+def init_app(app):
+    app.extensions['storage'] = SQLiteRepository(app.extensions['writer'])
@@ -0,0 +1,232 @@
+import argparse
+import datetime
+import random
+
+import boulder_ids
+import db
+import migrations
+import rollups
+import slab_state
+import timestamps
+
+# Fill a scratch database with boulders pushed through every stage, for
+# benchmarks and load testing. Never point this at the real inventory.db.
+#
+#     python synthetic.py /tmp/scratch.db --slabs 10000
+
+COLORS = ('Black', 'Grey', 'White', 'Red', 'Green')
+
+# Share of boulders/slabs in each defect category, in column order
+BOULDER_DEFECTS = (0.80, 0.08, 0.06, 0.04, 0.02)   # good, defect line, natural cracks, mining cracks, undersize
+SLAB_DEFECTS = (0.85, 0.05, 0.04, 0.04, 0.02)      # good, defect line, natural cracks, cutting cracks, thickness
+STATUSES = ('Good', 'Defect Line', 'Natural Cracks', 'Cutting Cracks', 'Thickness Issue')
+
+ADVANCE = 0.9          # chance that an item has moved on to the next stage
+REGRADE = 0.05         # chance that a finishing stage finds a new defect
+SPECIAL_ORDER = 0.05   # share of polished slabs cut into special orders
+SLABS_PER_BOULDER = (8, 16)
+
+INSERTS = {
+    'boulder': '''INSERT INTO boulder (boulder_id, date, boulder_description, color, good_boulder, defect_line,
+                  natural_cracks, mining_cracks, undersize, total_boulders) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+    'factory': '''INSERT INTO factory (boulder_id, boulder_description, good_boulder, defect_line, natural_cracks,
+                  mining_cracks, undersize, total_boulders, received_timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+    'cutting_run': '''INSERT INTO cutting_run (machine_id, boulder_id, boulder_description, num_slabs_cut, start_time,
+                      end_time, machine_hours) VALUES (?, ?, ?, ?, ?, ?, ?)''',
+    'separation': '''INSERT INTO separation (boulder_id, boulder_description, slab_id, slab_description, good_slabs,
+                     defect_line, natural_cracks, cutting_cracks, thickness_issue, total_slabs, separation_time)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+    'polishing': '''INSERT INTO polishing (slab_id, slab_description, original_status, polishing_description, good_slab,
+                    defect_line, natural_cracks, cutting_cracks, thickness_issue, polishing_time)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+    'edge_cutting_standard': '''INSERT INTO edge_cutting_standard (slab_id, polishing_description, edge_cutting_description,
+                                good_slab, defect_line, natural_cracks, cutting_cracks, thickness_issue, edge_cutting_time)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+    'edge_cutting_special_orders': '''INSERT INTO edge_cutting_special_orders (slab_id, polishing_description,
+                                      edge_cutting_description, special_order_details, good_slab, defect_line,
+                                      natural_cracks, cutting_cracks, thickness_issue, edge_cutting_time)
+                                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+    'bullnose': '''INSERT INTO bullnose (slab_id, edge_cutting_description, bullnose_description, good_slab, defect_line,
+                   natural_cracks, cutting_cracks, thickness_issue, bullnose_time) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+    'sealant': '''INSERT INTO sealant (slab_id, bullnose_description, sealant_description, good_slab, defect_line,
+                  natural_cracks, cutting_cracks, thickness_issue, sealant_time) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+    'ready_slabs': '''INSERT INTO ready_slabs (slab_id, sealant_description, good_slab, defect_line, natural_cracks,
+                      cutting_cracks, thickness_issue, ready_time) VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+    'inventory': '''INSERT OR REPLACE INTO inventory (slab_id, slab_description, stage, good_slab, defect_line,
+                    natural_cracks, cutting_cracks, thickness_issue) VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+    'movement': 'INSERT INTO movement (boulder_id, slab_id, stage, details, date) VALUES (?, ?, ?, ?, ?)',
+}
+
+
+def _one_hot(rng, weights):
+    category = rng.choices(range(len(weights)), weights)[0]
+    return tuple(1 if i == category else 0 for i in range(len(weights)))
+
+
+# Epoch seconds of a Nairobi wall-clock datetime
+def _stamp(moment):
+    return timestamps.parse(moment)
+
+
+class Generator:
+    def __init__(self, conn, seed=0, start=datetime.datetime(2024, 1, 1, 7, 0)):
+        self.conn = conn
+        self.rng = random.Random(seed)
+        self.clock = start
+        self.rows = {table: [] for table in INSERTS}
+        self.slabs = 0
+        self.boulders = 0
+
+    def flush(self):
+        for table, rows in self.rows.items():
+            if rows:
+                self.conn.executemany(INSERTS[table], rows)
+                rows.clear()
+
+    def move(self, stage, details, moment, boulder_id=None, slab_id=None):
+        self.rows['movement'].append((boulder_id, slab_id, stage, details, _stamp(moment)))
+
+    # Later stages happen a few hours to a few days after the previous one
+    def later(self, moment):
+        return moment + datetime.timedelta(minutes=self.rng.randint(30, 3 * 24 * 60))
+
+    # Keep a slab's grade through a stage, occasionally finding a new defect
+    def regrade(self, flags):
+        return _one_hot(self.rng, SLAB_DEFECTS) if self.rng.random() < REGRADE else flags
+
+    def boulder(self):
+        rng = self.rng
+        self.clock += datetime.timedelta(minutes=rng.randint(5, 120))
+        color = rng.choice(COLORS)
+        boulder_id = boulder_ids.allocate(self.conn, color)[0]
+        description = f'{color} {rng.randint(180, 320)}x{rng.randint(90, 180)}x{rng.randint(90, 180)}'
+        flags = _one_hot(rng, BOULDER_DEFECTS)
+        self.boulders += 1
+        self.rows['boulder'].append((boulder_id, self.clock.date().isoformat(), description, color, *flags, 1))
+        self.move('Quarry', f'Boulder {boulder_id} added to the quarry.', self.clock, boulder_id=boulder_id)
+        if not flags[0] or rng.random() > ADVANCE:
+            return
+
+        moment = self.later(self.clock)
+        self.rows['factory'].append((boulder_id, description, *flags, 1, _stamp(moment)))
+        self.move('Factory', f'Boulder {boulder_id} received at the factory.', moment, boulder_id=boulder_id)
+        if rng.random() > ADVANCE:
+            return
+
+        machine = rng.choice((1, 2))
+        num_slabs_cut = rng.randint(*SLABS_PER_BOULDER)
+        start = self.later(moment)
+        hours = rng.uniform(1, 6)
+        end = start + datetime.timedelta(hours=hours)
+        self.rows['cutting_run'].append(
+            (machine, boulder_id, description, num_slabs_cut, _stamp(start), _stamp(end), hours))
+        self.move(f'Cutting Machine {machine}', f'Boulder {boulder_id} cut with {num_slabs_cut} slabs.', end, boulder_id=boulder_id)
+        if rng.random() > ADVANCE:
+            return
+
+        moment = self.later(end)
+        slab_description = f'{color} {rng.choice((2400, 2700, 3000))}x{rng.choice((600, 900, 1400))}'
+        for number in range(1, num_slabs_cut + 1):
+            slab_id = f'{boulder_id}_S{color[0].upper()}{number:03d}'
+            flags = _one_hot(rng, SLAB_DEFECTS)
+            self.rows['separation'].append(
+                (boulder_id, description, slab_id, slab_description, *flags, num_slabs_cut, _stamp(moment)))
+            self.move('Separation', f'Slab {slab_id} from Boulder {boulder_id} separated.', moment, boulder_id, slab_id)
+            self.slabs += 1
+            self.slab(boulder_id, slab_id, slab_description, flags, moment)
+
+    def slab(self, boulder_id, slab_id, slab_description, flags, moment):
+        rng = self.rng
+        if rng.random() > ADVANCE:
+            return
+        moment = self.later(moment)
+        status = STATUSES[flags.index(1)]
+        polishing_description = rng.choice(('Gloss', 'Honed', 'Leathered'))
+        flags = self.regrade(flags)
+        self.rows['polishing'].append((slab_id, slab_description, status, polishing_description, *flags, _stamp(moment)))
+        self.move('Polishing', f'Slab {slab_id} polished with description: {polishing_description}.', moment, slab_id=slab_id)
+        if rng.random() > ADVANCE:
+            return
+
+        moment = self.later(moment)
+        if rng.random() < SPECIAL_ORDER:
+            for number in range(1, rng.randint(2, 4) + 1):
+                child_id = f'{slab_id}_OS{number:03d}'
+                description = f'Special order {rng.randint(400, 1200)}x{rng.randint(300, 900)}'
+                child_flags = self.regrade(flags)
+                self.rows['edge_cutting_special_orders'].append(
+                    (child_id, polishing_description, description, str(number), *child_flags, _stamp(moment)))
+                self.rows['inventory'].append((child_id, description, 'Awaiting Bullnose', *child_flags))
+                self.move('Edge Cutting Special Orders', f'Special Order Slab {child_id} edge cut from {slab_id} with size: {number}.',
+                          moment, slab_id=child_id)
+                self.finish(child_id, description, child_flags, moment)
+            return
+
+        description = rng.choice(('Straight edge', 'Mitred edge', 'Eased edge'))
+        flags = self.regrade(flags)
+        self.rows['edge_cutting_standard'].append((slab_id, polishing_description, description, *flags, _stamp(moment)))
+        self.rows['inventory'].append((slab_id, description, 'Awaiting Bullnose', *flags))
+        self.move('Edge Cutting Standard', f'Slab {slab_id} edge cut with description: {description}.', moment, slab_id=slab_id)
+        self.finish(slab_id, description, flags, moment)
+
+    # Bullnose, sealant and ready, each reached with probability ADVANCE
+    def finish(self, slab_id, edge_description, flags, moment):
+        rng = self.rng
+        if rng.random() > ADVANCE:
+            return
+        moment = self.later(moment)
+        bullnose_description = rng.choice(('Full bullnose', 'Half bullnose'))
+        flags = self.regrade(flags)
+        self.rows['bullnose'].append((slab_id, edge_description, bullnose_description, *flags, _stamp(moment)))
+        self.move('Bullnose', f'Slab {slab_id} bullnosed with description: {bullnose_description}.', moment, slab_id=slab_id)
+        if rng.random() > ADVANCE:
+            return
+
+        moment = self.later(moment)
+        sealant_description = rng.choice(('Penetrating sealer', 'Enhancing sealer'))
+        flags = self.regrade(flags)
+        self.rows['sealant'].append((slab_id, bullnose_description, sealant_description, *flags, _stamp(moment)))
+        self.move('Sealant', f'Slab {slab_id} sealed with description: {sealant_description}.', moment, slab_id=slab_id)
+        if rng.random() > ADVANCE:
+            return
+
+        moment = self.later(moment)
+        self.rows['ready_slabs'].append((slab_id, sealant_description, *flags, _stamp(moment)))
+        self.move('Ready Slabs', f'Slab {slab_id} ready with description: {sealant_description}.', moment, slab_id=slab_id)
+
+
+# Generate boulders until at least `slabs` slabs have been separated (or
+# exactly `boulders` boulders if given) into a migrated database. Returns the
+# number of boulders and slabs created.
+def generate(database, slabs=1000, boulders=None, seed=0):
+    migrations.migrate(database)
+    conn = db.connect(database)
+    conn.isolation_level = None
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        generator = Generator(conn, seed)
+        while (generator.boulders < boulders) if boulders is not None else (generator.slabs < slabs):
+            generator.boulder()
+            if generator.boulders % 1000 == 0:
+                generator.flush()
+        generator.flush()
+        slab_state.rebuild(conn)
+        rollups.rebuild(conn)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+    return generator.boulders, generator.slabs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fill a scratch database with synthetic workflow data.')
+    parser.add_argument('database', help='SQLite file to create or extend (not the real inventory)')
+    parser.add_argument('--slabs', type=int, default=1000, help='separate at least this many slabs')
+    parser.add_argument('--boulders', type=int, help='create exactly this many boulders instead')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    created_boulders, created_slabs = generate(args.database, args.slabs, args.boulders, args.seed)
+    print(f'Created {created_boulders} boulders and {created_slabs} slabs in {args.database}')
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as inventory  # noqa: E402
+import migrations  # noqa: E402
+
+
+# The app on a fresh, migrated database in a temporary folder
+@pytest.fixture
+def app(tmp_path):
+    database = str(tmp_path / 'inventory.db')
+    migrations.migrate(database)
+    flask_app = inventory.create_app({
+        'DATABASE': database,
+        'ARCHIVE_DATABASE': str(tmp_path / 'archive.db'),
+        'LOG_FILE': str(tmp_path / 'app.log'),
+        'TESTING': True,
+    })
+    yield flask_app
+    flask_app.extensions['movement_writer'].stop()
+    flask_app.extensions['writer'].stop()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
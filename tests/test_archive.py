@@ -0,0 +1,164 @@
+import datetime
+
+import pytest
+
+import archive
+import db
+import pagination
+import storage
+import timestamps
+
+TODAY = datetime.date(2024, 6, 10)
+T0 = 1717200000
+GOOD = (1, 0, 0, 0, 0)
+STAGES = (('polishing', 'Polished'), ('edge_cutting', 'Edged'), ('bullnose', 'Round'), ('sealant', 'Sealed'))
+
+
+# MB001 with both slabs ready; MB002 has one slab polished and one separated
+@pytest.fixture
+def database(app):
+    with app.app_context():
+        repository = storage.get_storage()
+        for boulder_id in ('MB001', 'MB002'):
+            assert repository.add_boulder('2024-06-01', 'Black Galaxy', GOOD) == boulder_id
+            repository.receive_boulder(boulder_id, 'Black Galaxy', GOOD, T0)
+            repository.record_cutting_run(1, boulder_id, 'Black Galaxy', 2, T0 + 60, T0 + 3660, 1.0)
+        repository.separate([(boulder_id, 'Black Galaxy', 'Black Slab', (2, 0, 0, 0, 0)) for boulder_id in ('MB001', 'MB002')], T0 + 3700)
+        repository.add_movements([('MB001', None, 'Quarry', 'Boulder MB001 added to the quarry.', T0)])
+        slabs = ['MB001_SB001', 'MB001_SB002', 'MB002_SB001']
+        for step, (stage, description) in enumerate(STAGES):
+            repository.apply_transitions(stage, [{'slab_id': slab_id, 'description': description} for slab_id in slabs], T0 + 4000 + step)
+            slabs = slabs[:2]
+        repository.apply_transitions('ready', [{'slab_id': slab_id} for slab_id in slabs], T0 + 5000)
+    return app.config['DATABASE'], app.config['ARCHIVE_DATABASE']
+
+
+def count(conn, table, boulder_id, schema='main'):
+    return conn.execute(f'SELECT COUNT(*) FROM {schema}.{table} WHERE boulder_id = ?', (boulder_id,)).fetchone()[0]
+
+
+# A boulder whose slabs are all ready moves to the archive; the other stays hot
+def test_run_moves_ready_boulders(database):
+    path, archive_path = database
+    conn = db.connect(path)
+    try:
+        boulders, totals = archive.run(conn, archive_path, T0 + 6000)
+        assert boulders == 1
+        assert (totals['boulder'], totals['separation'], totals['ready_slabs'], totals['movement']) == (1, 2, 2, 1)
+
+        for table in ('boulder', 'factory', 'cutting_run', 'separation', 'slab_state', 'movement'):
+            assert (count(conn, table, 'MB001'), count(conn, table, 'MB001', 'archive')) == (0, totals[table])
+        assert conn.execute("SELECT COUNT(*) FROM main.ready_slabs WHERE slab_id LIKE 'MB001%'").fetchone()[0] == 0
+        assert conn.execute('SELECT boulder_id, boulder_description FROM archived_boulder').fetchall() == [('MB001', 'Black Galaxy')]
+
+        ready = f"SELECT slab_id FROM {archive.source(conn, 'ready_slabs', with_archive=True)} ORDER BY slab_id"
+        assert conn.execute(ready).fetchall() == [('MB001_SB001',), ('MB001_SB002',)]
+        slabs = f"SELECT slab_id, stage FROM {archive.source(conn, 'slab_state', with_archive=True)} ORDER BY slab_id"
+        assert conn.execute(slabs).fetchall() == [
+            ('MB001_SB001', 'ready'), ('MB001_SB002', 'ready'), ('MB002_SB001', 'polishing'), ('MB002_SB002', 'separation'),
+        ]
+
+        for table in ('boulder', 'factory', 'cutting_run', 'separation', 'slab_state'):
+            assert count(conn, table, 'MB002') > 0
+            assert count(conn, table, 'MB002', 'archive') == 0
+    finally:
+        conn.close()
+
+
+# Boulders that became ready at or after the cutoff stay hot
+def test_run_keeps_boulders_ready_after_the_cutoff(database):
+    path, archive_path = database
+    conn = db.connect(path)
+    try:
+        assert archive.run(conn, archive_path, T0 + 5000)[0] == 0
+        assert count(conn, 'boulder', 'MB001') == 1
+    finally:
+        conn.close()
+
+
+# Commits a row between the copy and the delete of the first batch, as a
+# late write from another worker would
+class LateWrite:
+    def __init__(self, conn, sql):
+        self.__dict__.update(conn=conn, sql=sql, begins=0)
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    # isolation_level and the like go to the connection
+    def __setattr__(self, name, value):
+        setattr(self.conn, name, value)
+
+    def execute(self, sql, *args):
+        if sql == 'BEGIN IMMEDIATE':
+            self.__dict__['begins'] += 1
+            # run() begins once to sync the schema, then twice per batch
+            if self.begins == 3:
+                self.conn.execute(self.sql)
+        return self.conn.execute(sql, *args)
+
+
+# A late row fails the delete's foreign key check; the batch is rolled back,
+# copied again with the late row and then deleted
+def test_run_retries_a_batch_changed_while_copying(database):
+    path, archive_path = database
+    conn = db.connect(path)
+    try:
+        late = "INSERT INTO movement (boulder_id, stage, details, date) VALUES ('MB001', 'Ready Slabs', 'Late.', 0)"
+        late_write = LateWrite(conn, late)
+        assert archive.run(late_write, archive_path, T0 + 6000)[0] == 1
+        assert late_write.begins == 5
+        assert count(conn, 'movement', 'MB001') == 0
+        assert conn.execute("SELECT details FROM archive.movement WHERE boulder_id = 'MB001' ORDER BY date").fetchall() == [
+            ('Late.',), ('Boulder MB001 added to the quarry.',),
+        ]
+        assert count(conn, 'boulder', 'MB001') == 0
+    finally:
+        conn.close()
+
+
+# Archived boulders keep rowids of their own, so paging the quarry history
+# with the archive neither repeats nor skips rows once new boulders reuse the
+# archived boulders' hot rowids
+def test_history_pages_over_archived_boulders(app):
+    with app.app_context():
+        repository = storage.get_storage()
+        for number in range(1, 4):
+            boulder_id = repository.add_boulder('2024-06-01', 'Black Galaxy', GOOD)
+            repository.receive_boulder(boulder_id, 'Black Galaxy', GOOD, T0)
+            repository.record_cutting_run(1, boulder_id, 'Black Galaxy', 1, T0 + 60, T0 + 3660, 1.0)
+            repository.separate([(boulder_id, 'Black Galaxy', 'Black Slab', (1, 0, 0, 0, 0))], T0 + 3700)
+            slab = [{'slab_id': f'{boulder_id}_SB001', 'description': 'Done'}]
+            for step, (stage, _) in enumerate(STAGES):
+                repository.apply_transitions(stage, slab, T0 + 4000 + step)
+            repository.apply_transitions('ready', slab, T0 + 5000)
+        conn = db.connect(app.config['DATABASE'])
+        try:
+            assert archive.run(conn, app.config['ARCHIVE_DATABASE'], T0 + 6000)[0] == 3
+            for _ in range(3):
+                repository.add_boulder('2024-06-02', 'Black Galaxy', GOOD)
+
+            seen = []
+            args = {'page_size': '2'}
+            while True:
+                page = pagination.history_page(conn, 'boulder', args, with_archive=True)
+                seen.append([row[0] for row in page['rows']])
+                if page['older'] is None:
+                    break
+                args = {'page_size': '2', 'before': page['older']}
+            assert seen == [['MB006', 'MB005'], ['MB004', 'MB003'], ['MB002', 'MB001']]
+
+            args = {'page_size': '2', 'after': page['rows'][0][-1]}
+            assert [row[0] for row in pagination.history_page(conn, 'boulder', args, with_archive=True)['rows']] == ['MB004', 'MB003']
+        finally:
+            conn.close()
+
+
+# --days N keeps today and the N full days before it
+def test_ready_cutoff_keeps_n_full_days():
+    assert archive.ready_cutoff(30, TODAY) == timestamps.day_start(datetime.date(2024, 5, 11))
+
+
+# --days 0 archives everything finished before today, never today's boulders
+def test_ready_cutoff_zero_keeps_today():
+    assert archive.ready_cutoff(0, TODAY) == timestamps.day_start(TODAY)
@@ -0,0 +1,90 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+pytest.importorskip('starlette')
+pytest.importorskip('aiosqlite')
+httpx = pytest.importorskip('httpx')
+asgi_lifespan = pytest.importorskip('asgi_lifespan')
+
+import asgi  # noqa: E402
+import migrations  # noqa: E402
+import storage  # noqa: E402
+
+T0 = 1717200000
+
+
+# The ASGI app on a fresh database holding MB001, separated into two slabs
+@pytest.fixture
+def asgi_app(tmp_path):
+    database = str(tmp_path / 'inventory.db')
+    migrations.migrate(database)
+    asgi_app = asgi.create_app({
+        'DATABASE': database,
+        'ARCHIVE_DATABASE': str(tmp_path / 'archive.db'),
+        'LOG_FILE': str(tmp_path / 'app.log'),
+        'TESTING': True,
+    })
+    flask_app = asgi_app.state.flask
+    with flask_app.app_context():
+        repository = storage.get_storage()
+        repository.add_boulder('2024-06-01', 'Black Galaxy', (1, 0, 0, 0, 0))
+        repository.record_cutting_run(1, 'MB001', 'Black Galaxy', 2, T0, T0 + 3600, 1.0)
+        repository.separate([('MB001', 'Black Galaxy', 'Black Slab', (2, 0, 0, 0, 0))], T0 + 3700)
+    yield asgi_app
+    flask_app.extensions['movement_writer'].stop()
+    flask_app.extensions['writer'].stop()
+
+
+# Send requests through the app, with its lifespan (the read pool) running
+def requests(asgi_app, send):
+    async def run():
+        async with asgi_lifespan.LifespanManager(asgi_app):
+            transport = httpx.ASGITransport(app=asgi_app)
+            async with httpx.AsyncClient(transport=transport, base_url='http://inventory') as client:
+                return await send(client)
+    return asyncio.run(run())
+
+
+def test_async_queue_and_transitions(asgi_app):
+    async def send(client):
+        queue = await client.get('/api/stages/polishing/queue')
+        moved = await client.post('/api/stages/polishing/transitions', json=[{'slab_id': 'MB001_SB001', 'description': 'Polished'}])
+        again = await client.post('/api/stages/polishing/transitions', json=[{'slab_id': 'MB001_SB001', 'description': 'Polished'}])
+        after = await client.get('/api/stages/polishing/queue')
+        return queue, moved, again, after
+
+    queue, moved, again, after = requests(asgi_app, send)
+    assert queue.status_code == 200
+    assert [row['slab_id'] for row in queue.json()] == ['MB001_SB001', 'MB001_SB002']
+    assert moved.status_code == 200
+    assert moved.json()['applied'] == 1
+    assert again.status_code == 409
+    assert again.json()['errors'][0]['slab_id'] == 'MB001_SB001'
+    assert [row['slab_id'] for row in after.json()] == ['MB001_SB002']
+
+    conn = sqlite3.connect(asgi_app.state.flask.config['DATABASE'])
+    try:
+        assert conn.execute("SELECT stage FROM slab_state WHERE slab_id = 'MB001_SB001'").fetchone() == ('polishing',)
+    finally:
+        conn.close()
+
+
+def test_unknown_stage(asgi_app):
+    async def send(client):
+        return await client.get('/api/stages/lapping/queue')
+
+    assert requests(asgi_app, send).status_code == 404
+
+
+# Every other route is the Flask app behind the WSGI adapter
+def test_flask_routes_are_mounted(asgi_app):
+    async def send(client):
+        return await client.get('/export/separation.csv'), await client.get('/metrics')
+
+    export, metrics = requests(asgi_app, send)
+    assert export.status_code == 200
+    assert export.headers['content-type'].startswith('text/csv')
+    assert export.text.splitlines()[1].split(',')[3] == 'MB001_SB001'
+    assert metrics.status_code == 200
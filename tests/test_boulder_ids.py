@@ -0,0 +1,50 @@
+import sqlite3
+
+import pytest
+
+import boulder_ids
+import storage
+
+
+@pytest.fixture
+def conn(app):
+    conn = sqlite3.connect(app.config['DATABASE'])
+    yield conn
+    conn.close()
+
+
+# Each color prefix counts on its own
+def test_numbers_are_per_prefix(conn):
+    assert boulder_ids.allocate(conn, 'Black', 2) == ['MB001', 'MB002']
+    assert boulder_ids.allocate(conn, 'white') == ['MW001']
+    assert boulder_ids.allocate(conn, 'Blue') == ['MB003']
+    assert list(boulder_ids.reserve(conn, 'W', 3)) == [2, 3, 4]
+
+
+# A rolled back reservation hands its numbers back
+def test_rollback_returns_the_numbers(conn):
+    boulder_ids.allocate(conn, 'Black')
+    conn.commit()
+    boulder_ids.allocate(conn, 'Black', 5)
+    conn.rollback()
+    assert boulder_ids.allocate(conn, 'Black') == ['MB002']
+
+
+# Deleted boulders do not give their IDs back
+def test_ids_are_not_reused(app, conn):
+    with app.app_context():
+        repository = storage.get_storage()
+        assert repository.add_boulder('2024-06-01', 'Black Galaxy', (1, 0, 0, 0, 0)) == 'MB001'
+        conn.execute("DELETE FROM boulder WHERE boulder_id = 'MB001'")
+        conn.commit()
+        assert repository.add_boulder('2024-06-01', 'Black Galaxy', (1, 0, 0, 0, 0)) == 'MB002'
+
+
+# Seeding starts each prefix after the highest current or archived number
+def test_seed(conn):
+    conn.execute('DELETE FROM boulder_sequence')
+    conn.executemany('INSERT INTO boulder (boulder_id) VALUES (?)', [('MB007',), ('MW002',), ('legacy-1',)])
+    conn.execute("INSERT INTO archived_boulder (boulder_id) VALUES ('MB012')")
+    boulder_ids.seed(conn)
+    assert dict(conn.execute('SELECT prefix, last_number FROM boulder_sequence')) == {'B': 12, 'W': 2}
+    assert boulder_ids.allocate(conn, 'Black') == ['MB013']
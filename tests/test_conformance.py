@@ -0,0 +1,250 @@
+import asyncio
+import os
+import uuid
+
+import pytest
+
+import storage
+import transitions
+
+# One workflow run against every storage backend (see storage.py), so the
+# SQLite and PostgreSQL repositories are held to the same behaviour. The
+# PostgreSQL case runs in a scratch schema that is dropped afterwards, and
+# only when INVENTORY_TEST_PG_DSN is set:
+#
+#     INVENTORY_TEST_PG_DSN=postgresql://inventory@localhost/db python -m pytest tests/test_conformance.py
+
+T0 = 1717200000
+
+GOOD = (1, 0, 0, 0, 0)
+DEFECT = (0, 1, 0, 0, 0)
+
+
+# The app's SQLite repository on a fresh database
+@pytest.fixture
+def sqlite_repository(app):
+    with app.app_context():
+        yield storage.get_storage()
+
+
+# A PostgreSQL repository in a scratch schema
+@pytest.fixture
+def postgres_repository():
+    dsn = os.environ.get('INVENTORY_TEST_PG_DSN')
+    if not dsn:
+        pytest.skip('INVENTORY_TEST_PG_DSN is not set')
+    postgres = pytest.importorskip('postgres')
+
+    schema = f'conformance_{uuid.uuid4().hex[:12]}'
+    repository = postgres.PostgresRepository(dsn, schema=schema)
+    try:
+        repository.create_schema()
+        yield repository
+    finally:
+        repository._call(repository._execute, f'DROP SCHEMA IF EXISTS "{schema}" CASCADE')
+        repository.close()
+
+
+@pytest.fixture(params=['sqlite', 'postgres'])
+def repository(request):
+    return request.getfixturevalue(f'{request.param}_repository')
+
+
+def rows(result):
+    return sorted(tuple(row) for row in result)
+
+
+def queue(repository, stage):
+    columns, result = repository.queue(stage)
+    return columns, rows(result)
+
+
+# Quarry: IDs are sequential per color prefix (Black and Blue share B)
+def add_boulders(repository):
+    assert [
+        repository.add_boulder('2024-06-01', 'Black Galaxy', GOOD),
+        repository.add_boulder('2024-06-01', 'Black Galaxy', DEFECT),
+        repository.add_boulder('2024-06-01', 'White Marble', GOOD),
+    ] == ['MB001', 'MB002', 'MW001']
+    imported, failed = repository.import_boulders([
+        (2, ('2024-06-02', 'Blue Pearl', 'Blue', *GOOD, 1)),
+        (3, ('2024-06-02', 'Black Pearl', 'Black', *DEFECT, 1)),
+    ])
+    assert [(line, row[0]) for line, row in imported] == [(2, 'MB003'), (3, 'MB004')]
+    assert failed == []
+    assert queue(repository, 'factory') == (
+        ['boulder_id', 'boulder_description'],
+        [('MB001', 'Black Galaxy'), ('MB003', 'Blue Pearl'), ('MW001', 'White Marble')],
+    )
+
+
+# Factory and cutting; receiving a boulder twice replaces the first record
+def cut_boulder(repository):
+    repository.receive_boulder('MB001', 'Black Galaxy', GOOD, T0)
+    repository.receive_boulder('MB001', 'Black Galaxy', GOOD, T0 + 60)
+    assert queue(repository, 'factory')[1] == [('MB003', 'Blue Pearl'), ('MW001', 'White Marble')]
+    assert queue(repository, 'cutting_machine')[1] == [('MB001', 'Black Galaxy')]
+    assert rows(repository.cutting_machines()) == [(1, 'Cutting Machine 1'), (2, 'Cutting Machine 2')]
+    assert repository.add_cutting_machine('Cutting Machine 3') == 3
+    with pytest.raises(storage.Conflict):
+        repository.add_cutting_machine('Cutting Machine 3')
+    repository.record_cutting_run(1, 'MB001', 'Black Galaxy', 3, T0 + 120, T0 + 3720, 1.0)
+    with pytest.raises(storage.Conflict):
+        repository.record_cutting_run(1, 'MX999', 'Unknown', 1, T0, T0 + 60, 0.5)
+    assert queue(repository, 'cutting_machine')[1] == []
+    assert queue(repository, 'separation') == (
+        ['boulder_id', 'boulder_description', 'num_slabs_cut'], [('MB001', 'Black Galaxy', 3)],
+    )
+
+
+# Separation: a boulder listed twice is separated once
+def separate(repository):
+    entry = ('MB001', 'Black Galaxy', 'Black Slab', (2, 1, 0, 0, 0))
+    movements = repository.separate([entry, entry], T0 + 3800)
+    assert [m[3] for m in movements] == ['MB001_SB001', 'MB001_SB002', 'MB001_SB003']
+    with pytest.raises(storage.Conflict):
+        repository.separate([entry], T0 + 3900)
+    with pytest.raises(transitions.TransitionError) as error:
+        repository.separate([('MB001', 'Black Galaxy', '  ', (1, 0, 0, 0, 0))], T0 + 3900)
+    assert error.value.errors == [{'index': 0, 'boulder_id': 'MB001', 'error': 'slab description is required'}]
+    assert queue(repository, 'polishing') == (
+        ['slab_id', 'description', 'original_status'],
+        [('MB001_SB001', 'Black Slab', 'Good'), ('MB001_SB002', 'Black Slab', 'Good'), ('MB001_SB003', 'Black Slab', 'Defect Line')],
+    )
+
+
+def polish(repository):
+    movements = repository.apply_transitions('polishing', [
+        {'slab_id': 'MB001_SB001', 'description': 'Polished A'},
+        {'slab_id': 'MB001_SB002', 'description': 'Polished B', 'cutting_cracks': '1', 'good_slab': '0'},
+    ], T0 + 4000)
+    assert movements == [
+        ('Polishing', 'Slab MB001_SB001 polished with description: Polished A.', 'MB001', 'MB001_SB001'),
+        ('Polishing', 'Slab MB001_SB002 polished with description: Polished B.', 'MB001', 'MB001_SB002'),
+    ]
+
+
+# The whole workflow up to a slab on every finishing stage
+def finish(repository):
+    repository.apply_transitions('edge_cutting', [{'slab_id': 'MB001_SB001', 'description': 'Edged A'}], T0 + 4200)
+    repository.cut_special_orders('MB001_SB002', [('60x60', 'Tile'), ('30x30', 'Trim')], [1, 0, 0, 0, 0], T0 + 4300)
+    repository.apply_transitions('bullnose', [{'slab_id': 'MB001_SB001', 'description': 'Round A'}], T0 + 4500)
+
+
+def test_quarry(repository):
+    add_boulders(repository)
+
+
+def test_factory_and_cutting(repository):
+    add_boulders(repository)
+    cut_boulder(repository)
+
+
+def test_separation(repository):
+    add_boulders(repository)
+    cut_boulder(repository)
+    separate(repository)
+
+
+def test_polishing(repository):
+    add_boulders(repository)
+    cut_boulder(repository)
+    separate(repository)
+    polish(repository)
+    assert queue(repository, 'edge_cutting')[1] == [('MB001_SB001', 'Polished A'), ('MB001_SB002', 'Polished B')]
+
+
+# A batch with any bad transition is rejected whole, with every error listed
+def test_invalid_transitions(repository):
+    add_boulders(repository)
+    cut_boulder(repository)
+    separate(repository)
+    polish(repository)
+    with pytest.raises(transitions.TransitionError) as error:
+        repository.apply_transitions('polishing', [
+            {'slab_id': 'MB001_SB003', 'description': 'Polished C'},
+            {'slab_id': 'MB001_SB001', 'description': 'Polished again'},
+            {'slab_id': 'MB009_SB001', 'description': 'Missing'},
+            {'slab_id': 'MB001_SB003', 'description': 'Twice'},
+            {'description': 'No slab'},
+        ], T0 + 4100)
+    assert error.value.errors == [
+        {'index': 3, 'slab_id': 'MB001_SB003', 'error': 'slab_id appears more than once'},
+        {'index': 4, 'error': 'slab_id is required'},
+        {'index': 1, 'slab_id': 'MB001_SB001', 'error': "slab is at stage 'polishing', expected 'separation'"},
+        {'index': 2, 'slab_id': 'MB009_SB001', 'error': 'unknown slab'},
+    ]
+    assert queue(repository, 'polishing')[1] == [('MB001_SB003', 'Black Slab', 'Defect Line')]
+
+
+def test_special_orders(repository):
+    add_boulders(repository)
+    cut_boulder(repository)
+    separate(repository)
+    polish(repository)
+    repository.apply_transitions('edge_cutting', [{'slab_id': 'MB001_SB001', 'description': 'Edged A'}], T0 + 4200)
+    movements = repository.cut_special_orders('MB001_SB002', [('60x60', 'Tile'), ('30x30', 'Trim')], [1, 0, 0, 0, 0], T0 + 4300)
+    assert [m[3] for m in movements] == ['MB001_SB002_OS001', 'MB001_SB002_OS002']
+    with pytest.raises(transitions.TransitionError) as error:
+        repository.cut_special_orders('MB001_SB002', [('10x10', 'Chip')], [1, 0, 0, 0, 0], T0 + 4400)
+    assert error.value.errors == [
+        {'index': 0, 'slab_id': 'MB001_SB002', 'error': "slab is at stage 'special_order_cut', expected 'polishing'"},
+    ]
+    with pytest.raises(transitions.TransitionError) as error:
+        repository.cut_special_orders('MB009_SB001', [('10x10', 'Chip')], [1, 0, 0, 0, 0], T0 + 4400)
+    assert error.value.errors == [{'index': 0, 'slab_id': 'MB009_SB001', 'error': 'unknown slab'}]
+    assert tuple(repository.slab('MB001_SB002_OS001')) == ('MB001', 'edge_cutting', 'Tile', 1, 0, 0, 0, 0)
+    assert tuple(repository.slab('MB001_SB002'))[:2] == ('MB001', 'special_order_cut')
+    assert repository.slab('MB009_SB001') is None
+    assert queue(repository, 'bullnose')[1] == [
+        ('MB001_SB001', 'Edged A'), ('MB001_SB002_OS001', 'Tile'), ('MB001_SB002_OS002', 'Trim'),
+    ]
+
+
+# The async methods used by the ASGI serving mode, then the last stage
+def test_sealant_and_ready(repository):
+    add_boulders(repository)
+    cut_boulder(repository)
+    separate(repository)
+    polish(repository)
+    finish(repository)
+    movements = asyncio.run(repository.apply_transitions_async('sealant', [{'slab_id': 'MB001_SB001', 'description': 'Sealed A'}], T0 + 4600))
+    assert [m[3] for m in movements] == ['MB001_SB001']
+    with pytest.raises(transitions.TransitionError) as error:
+        asyncio.run(repository.apply_transitions_async('sealant', [{'slab_id': 'MB001_SB001', 'description': 'Again'}], T0 + 4650))
+    assert error.value.errors == [
+        {'index': 0, 'slab_id': 'MB001_SB001', 'error': "slab is at stage 'sealant', expected 'bullnose'"},
+    ]
+    columns, result = asyncio.run(repository.queue_async('ready_slabs'))
+    assert (columns, rows(result)) == (['slab_id', 'description'], [('MB001_SB001', 'Sealed A')])
+    assert queue(repository, 'ready_slabs')[1] == [('MB001_SB001', 'Sealed A')]
+    movements = repository.apply_transitions('ready', [{'slab_id': 'MB001_SB001'}], T0 + 4700)
+    assert movements == [('Ready Slabs', 'Slab MB001_SB001 ready with description: Sealed A.', 'MB001', 'MB001_SB001')]
+    assert tuple(repository.slab('MB001_SB001'))[:3] == ('MB001', 'ready', 'Sealed A')
+    assert [tuple(row) for row in repository.inventory()] == [
+        ('MB001_SB001', 'Edged A', 'Awaiting Bullnose', 0, 0, 0, 0, 0),
+        ('MB001_SB002_OS001', 'Tile', 'Awaiting Bullnose', 1, 0, 0, 0, 0),
+        ('MB001_SB002_OS002', 'Trim', 'Awaiting Bullnose', 1, 0, 0, 0, 0),
+    ]
+
+
+def test_movement_log(repository):
+    add_boulders(repository)
+    cut_boulder(repository)
+    separate(repository)
+    polish(repository)
+    finish(repository)
+    repository.add_movements([
+        ('MB001', None, 'Quarry', 'Boulder MB001 added to the quarry.', T0),
+        ('MB001', 'MB001_SB001', 'Separation', 'Slab MB001_SB001 from Boulder MB001 separated.', T0 + 3800),
+        (None, 'MB001_SB002_OS001', 'Edge Cutting Special Orders', 'Special order.', T0 + 4300),
+    ])
+    assert [tuple(row) for row in repository.movements()][-3:] == [
+        ('MB001', None, 'Quarry', 'Boulder MB001 added to the quarry.', T0),
+        ('MB001', 'MB001_SB001', 'Separation', 'Slab MB001_SB001 from Boulder MB001 separated.', T0 + 3800),
+        (None, 'MB001_SB002_OS001', 'Edge Cutting Special Orders', 'Special order.', T0 + 4300),
+    ]
+    assert [row[1] for row in repository.movements(boulder_id='MB001')] == [None, 'MB001_SB001']
+    assert [row[2] for row in repository.movements(slab_id='MB001_SB002_OS001')] == ['Edge Cutting Special Orders']
+    with pytest.raises(storage.Conflict):
+        repository.add_movements([('MX999', None, 'Quarry', 'Unknown.', T0)])
@@ -0,0 +1,101 @@
+import csv
+import io
+import json
+
+import pytest
+
+import archive
+import db
+import storage
+
+T0 = 1717200000  # 2024-06-01 03:00 local
+DAY = 86400
+GOOD = (1, 0, 0, 0, 0)
+
+
+# MB001 with its one slab ready, and a movement on each of three days
+@pytest.fixture
+def database(app):
+    with app.app_context():
+        repository = storage.get_storage()
+        repository.add_boulder('2024-06-01', 'Black Galaxy', GOOD)
+        repository.record_cutting_run(1, 'MB001', 'Black Galaxy', 1, T0, T0 + 3600, 1.0)
+        repository.separate([('MB001', 'Black Galaxy', 'Black Slab', (1, 0, 0, 0, 0))], T0 + 3700)
+        for step, stage in enumerate(('polishing', 'edge_cutting', 'bullnose', 'sealant', 'ready')):
+            repository.apply_transitions(stage, [{'slab_id': 'MB001_SB001', 'description': stage}], T0 + 4000 + step)
+        repository.add_movements([
+            ('MB001', None, 'Quarry', 'Boulder MB001 added to the quarry.', T0),
+            ('MB001', None, 'Factory', 'Boulder MB001 received at the factory.', T0 + DAY),
+            ('MB001', 'MB001_SB001', 'Polishing', 'Slab MB001_SB001 polished.', T0 + 2 * DAY),
+        ])
+    return app.config['DATABASE'], app.config['ARCHIVE_DATABASE']
+
+
+def csv_rows(response):
+    return list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+
+
+def test_csv_export(client, database):
+    response = client.get('/export/movement.csv')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    assert response.headers['Content-Disposition'] == 'attachment; filename=movement.csv'
+    rows = csv_rows(response)
+    assert rows[0] == ['movement_id', 'boulder_id', 'slab_id', 'stage', 'details', 'date']
+    assert rows[1] == ['1', 'MB001', '', 'Quarry', 'Boulder MB001 added to the quarry.', '2024-06-01 03:00:00']
+    assert len(rows) == 4
+
+
+def test_ndjson_export(client, database):
+    response = client.get('/export/movement.ndjson')
+    assert response.mimetype == 'application/x-ndjson'
+    lines = response.get_data(as_text=True).splitlines()
+    assert len(lines) == 3
+    assert json.loads(lines[2]) == {
+        'movement_id': 3, 'boulder_id': 'MB001', 'slab_id': 'MB001_SB001', 'stage': 'Polishing',
+        'details': 'Slab MB001_SB001 polished.', 'date': '2024-06-03 03:00:00',
+    }
+
+
+# Dates are inclusive local days; stage only keeps rows at that stage
+@pytest.mark.parametrize('query, stages', [
+    ('date_from=2024-06-02', ['Factory', 'Polishing']),
+    ('date_to=2024-06-02', ['Quarry', 'Factory']),
+    ('date_from=2024-06-02&date_to=2024-06-02', ['Factory']),
+    ('stage=Polishing', ['Polishing']),
+    ('date_to=2024-06-01&stage=Polishing', []),
+])
+def test_filters(client, database, query, stages):
+    rows = csv_rows(client.get(f'/export/movement.csv?{query}'))
+    assert [row[3] for row in rows[1:]] == stages
+
+
+# Date filters on tables with epoch event times compare against local day starts
+def test_date_filter_on_epoch_column(client, database):
+    response = client.get('/export/separation.csv?date_from=2024-06-01&date_to=2024-06-01')
+    rows = csv.DictReader(io.StringIO(response.get_data(as_text=True)))
+    assert [(row['slab_id'], row['separation_time']) for row in rows] == [('MB001_SB001', '2024-06-01 04:01:40')]
+    assert csv_rows(client.get('/export/separation.csv?date_from=2024-06-02'))[1:] == []
+
+
+def test_bad_requests(client, database):
+    assert client.get('/export/movement.csv?date_from=June').status_code == 400
+    assert client.get('/export/movement.xml').status_code == 404
+    assert client.get('/export/secrets.csv').status_code == 404
+
+
+# Archived rows are only exported with archive=1
+def test_export_with_archive(client, database):
+    path, archive_path = database
+    conn = db.connect(path)
+    try:
+        assert archive.run(conn, archive_path, T0 + 3 * DAY)[0] == 1
+    finally:
+        conn.close()
+
+    assert csv_rows(client.get('/export/movement.csv'))[1:] == []
+    rows = csv_rows(client.get('/export/movement.csv?archive=1&date_from=2024-06-02'))
+    assert [(row[1], row[3]) for row in rows[1:]] == [('MB001', 'Factory'), ('MB001', 'Polishing')]
+    assert client.get('/export/ready_slabs.ndjson').get_data(as_text=True) == ''
+    lines = client.get('/export/ready_slabs.ndjson?archive=1').get_data(as_text=True).splitlines()
+    assert [json.loads(line)['slab_id'] for line in lines] == ['MB001_SB001']
@@ -0,0 +1,101 @@
+import sqlite3
+
+import pytest
+
+import storage
+
+HEADER = 'date,boulder_description,good_boulder,defect_line,natural_cracks,mining_cracks,undersize\n'
+
+
+@pytest.fixture
+def conn(app):
+    conn = sqlite3.connect(app.config['DATABASE'])
+    yield conn
+    conn.close()
+
+
+def post_manifest(client, *rows):
+    return client.post('/quarry/import', data=HEADER + ''.join(row + '\n' for row in rows), content_type='text/csv')
+
+
+def test_manifest_is_imported(app, client, conn):
+    response = post_manifest(client, '2024-06-01,Black Galaxy,Yes,No,No,No,No', '2024-06-01,White Ice,No,Yes,No,No,Yes')
+    assert response.status_code == 200
+    assert response.get_json() == {'imported': 2, 'failed': 0, 'errors': []}
+    assert conn.execute('SELECT * FROM boulder ORDER BY boulder_id').fetchall() == [
+        ('MB001', '2024-06-01', 'Black Galaxy', 'Black', 1, 0, 0, 0, 0, 1),
+        ('MW001', '2024-06-01', 'White Ice', 'White', 0, 1, 0, 0, 1, 2),
+    ]
+    assert conn.execute("SELECT day, boulders, good, undersize FROM boulder_rollup WHERE stage = 'quarry'").fetchall() == [
+        ('2024-06-01', 2, 1, 1),
+    ]
+    app.extensions['movement_writer'].flush()
+    assert conn.execute("SELECT boulder_id FROM movement WHERE stage = 'Quarry' ORDER BY boulder_id").fetchall() == [
+        ('MB001',), ('MW001',),
+    ]
+
+
+# Unparseable rows are reported by line number and the rest still import
+def test_bad_rows_are_reported(client, conn):
+    response = post_manifest(client, '2024-06-01,Black Galaxy,Yes,No,No,No,No', '06/01/2024,Black Pearl,Yes,No,No,No,No',
+                             '2024-06-01,,Yes,No,No,No,No', '2024-06-02,Black Forest,No,No,No,No,No')
+    assert response.get_json() == {'imported': 2, 'failed': 2, 'errors': [
+        {'line': 3, 'error': "invalid date '06/01/2024' (expected YYYY-MM-DD)"},
+        {'line': 4, 'error': 'boulder_description is required'},
+    ]}
+    assert conn.execute('SELECT boulder_id, boulder_description FROM boulder ORDER BY boulder_id').fetchall() == [
+        ('MB001', 'Black Galaxy'), ('MB002', 'Black Forest'),
+    ]
+
+
+def test_missing_columns(client):
+    response = client.post('/quarry/import', data='date,color\n2024-06-01,Black\n', content_type='text/csv')
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'missing column(s): boulder_description'
+
+
+# A row that violates a constraint rolls the chunk back to its savepoint and the
+# chunk is retried row by row, so only that row fails
+def test_chunk_falls_back_to_row_by_row(app, client, conn):
+    conn.execute("INSERT INTO boulder (boulder_id, boulder_description) VALUES ('MB002', 'Inserted by hand')")
+    conn.commit()
+    response = post_manifest(client, '2024-06-01,Black Galaxy,Yes,No,No,No,No', '2024-06-01,Black Pearl,Yes,No,No,No,No',
+                             '2024-06-01,Black Forest,Yes,No,No,No,No')
+    report = response.get_json()
+    assert (report['imported'], report['failed']) == (2, 1)
+    assert report['errors'][0]['line'] == 3
+    assert report['errors'][0]['error'].startswith('MB002: UNIQUE constraint failed')
+    assert conn.execute('SELECT boulder_id, boulder_description FROM boulder ORDER BY boulder_id').fetchall() == [
+        ('MB001', 'Black Galaxy'), ('MB002', 'Inserted by hand'), ('MB003', 'Black Forest'),
+    ]
+    assert conn.execute("SELECT boulders FROM boulder_rollup WHERE stage = 'quarry'").fetchone() == (2,)
+
+
+# Each IMPORT_CHUNK_SIZE rows are written in their own transaction
+def test_manifest_is_written_in_chunks(app, client, conn, monkeypatch):
+    chunks = []
+    import_boulders = storage.SQLiteRepository.import_boulders
+
+    def record(self, chunk):
+        chunks.append([line for line, _ in chunk])
+        return import_boulders(self, chunk)
+
+    monkeypatch.setattr(storage.SQLiteRepository, 'import_boulders', record)
+    app.config['IMPORT_CHUNK_SIZE'] = 2
+    response = post_manifest(client, *[f'2024-06-01,Black {n},Yes,No,No,No,No' for n in range(5)])
+    assert response.get_json()['imported'] == 5
+    assert chunks == [[2, 3], [4, 5], [6]]
+    assert conn.execute('SELECT last_number FROM boulder_sequence WHERE prefix = ?', ('B',)).fetchone() == (5,)
+
+
+# Receiving a boulder twice updates its factory row instead of adding a second one
+def test_receive_boulder_upserts(app, conn):
+    with app.app_context():
+        repository = storage.get_storage()
+        repository.add_boulder('2024-06-01', 'Black Galaxy', (1, 0, 0, 0, 0))
+        repository.receive_boulder('MB001', 'Black Galaxy', (1, 0, 0, 0, 0), 1717200000)
+        repository.receive_boulder('MB001', 'Black Galaxy, chipped', (0, 1, 0, 1, 0), 1717203600)
+    assert conn.execute('''
+        SELECT boulder_id, boulder_description, good_boulder, defect_line, mining_cracks, total_boulders, received_timestamp
+        FROM factory
+    ''').fetchall() == [('MB001', 'Black Galaxy, chipped', 0, 1, 1, 2, 1717203600)]
@@ -0,0 +1,46 @@
+import metrics
+
+BOULDER = {'date': '2024-06-01', 'boulder_description': 'Black Galaxy', 'good_boulder': 'Yes',
+           'defect_line': 'No', 'natural_cracks': 'No', 'mining_cracks': 'No', 'undersize': 'No'}
+
+
+def statements(endpoint):
+    return metrics.sql_statements._values.get((endpoint,), 0)
+
+
+# Writes run on the writer thread but count for the endpoint that made them
+def test_write_statements_count_for_their_endpoint(client):
+    before = statements('quarry')
+    response = client.post('/quarry', data=BOULDER)
+    assert response.status_code == 302
+    assert statements('quarry') - before >= 3
+
+
+# Slow statements go to LOG_FILE only, not also to stderr through the root logger
+def test_slow_query_log_does_not_propagate(app):
+    assert metrics.slow_query_log.handlers
+    assert metrics.slow_query_log.propagate is False
+
+
+# A write that never gets the lock is logged through the app's logger, not printed
+def test_database_busy_is_logged(app, client, monkeypatch, caplog):
+    import storage
+    import writer
+
+    def busy(*args):
+        raise writer.DatabaseBusy('database still locked after 5 attempts')
+
+    monkeypatch.setattr(storage.get_storage_of(app), 'add_boulder', busy)
+    response = client.post('/quarry', data=BOULDER)
+    assert response.status_code == 503
+    assert 'Database busy on /quarry' in caplog.text
+    assert any(handler in app.logger.handlers for handler in metrics.slow_query_log.handlers)
+
+
+# Each app reports the gauges of its own trace cache
+def test_gauges_are_per_app(app, client):
+    client.post('/quarry', data=BOULDER)
+    client.get('/api/trace/MB001')
+    client.get('/api/trace/MB001')
+    assert app.extensions['trace_cache'].hits == 1
+    assert 'trace_cache_hits_total 1\n' in client.get('/metrics').get_data(as_text=True)
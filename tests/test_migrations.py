@@ -0,0 +1,55 @@
+import sqlite3
+
+import migrations
+
+
+# A database created before the cutting_run table (version 6) upgrades through
+# the shipped migrations 7 and 8 with its cutting rollups intact
+def test_upgrade_from_per_machine_cutting_tables(tmp_path, monkeypatch):
+    database = str(tmp_path / 'v6.db')
+    monkeypatch.setattr(migrations, 'MIGRATIONS', migrations.MIGRATIONS[:6])
+    migrations.migrate(database)
+    conn = sqlite3.connect(database)
+    with conn:
+        conn.execute("INSERT INTO boulder (boulder_id, date, boulder_description, color, good_boulder, total_boulders) "
+                     "VALUES ('MB001', '2024-06-01', 'Black Galaxy', 'Black', 1, 1)")
+        conn.execute("INSERT INTO cutting_machine_1 (boulder_id, boulder_description, num_slabs_cut, start_time, end_time, "
+                     "machine_hours) VALUES ('MB001', 'Black Galaxy', 5, '2024-06-02 08:00:00', '2024-06-02 10:00:00', 2.0)")
+    conn.close()
+
+    monkeypatch.undo()
+    migrations.migrate(database)
+    conn = sqlite3.connect(database)
+    try:
+        assert conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0] == migrations.LATEST_VERSION
+        assert conn.execute("SELECT boulders, slabs_cut, machine_hours FROM boulder_rollup WHERE stage = 'cutting'").fetchall() == [(1, 5, 2.0)]
+        assert conn.execute('SELECT machine_id, num_slabs_cut FROM cutting_run').fetchall() == [(1, 5)]
+    finally:
+        conn.close()
+
+
+# A baseline database that recorded the same slab twice at one stage keeps the
+# earliest row and still reaches the latest version
+def test_upgrade_drops_duplicate_stage_rows(tmp_path, monkeypatch):
+    database = str(tmp_path / 'v1.db')
+    monkeypatch.setattr(migrations, 'MIGRATIONS', migrations.MIGRATIONS[:1])
+    migrations.migrate(database)
+    conn = sqlite3.connect(database)
+    with conn:
+        conn.execute("INSERT INTO boulder (boulder_id, date, boulder_description, color, good_boulder, total_boulders) "
+                     "VALUES ('MB001', '2024-06-01', 'Black Galaxy', 'Black', 1, 1)")
+        conn.execute("INSERT INTO separation (boulder_id, boulder_description, slab_id, slab_description, separation_time) "
+                     "VALUES ('MB001', 'Black Galaxy', 'MB001_SB001', 'Black Galaxy', '2024-06-02 08:00:00')")
+        conn.executemany("INSERT INTO polishing (slab_id, slab_description, polishing_description, polishing_time) "
+                         "VALUES ('MB001_SB001', 'Black Galaxy', ?, ?)",
+                         [('first', '2024-06-03 08:00:00'), ('again', '2024-06-03 09:00:00')])
+    conn.close()
+
+    monkeypatch.undo()
+    migrations.migrate(database)
+    migrations.check_schema(database)
+    conn = sqlite3.connect(database)
+    try:
+        assert conn.execute('SELECT polishing_description FROM polishing').fetchall() == [('first',)]
+    finally:
+        conn.close()
@@ -0,0 +1,69 @@
+import logging
+import sqlite3
+
+import pytest
+
+import movement_log
+import storage
+
+T0 = 1717200000
+
+
+@pytest.fixture
+def conn(app):
+    with app.app_context():
+        storage.get_storage().add_boulder('2024-06-01', 'Black Galaxy', (1, 0, 0, 0, 0))
+    conn = sqlite3.connect(app.config['DATABASE'])
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def writer(app):
+    writer = movement_log.MovementWriter(app.extensions['storage'], batch_size=3, flush_interval=60)
+    yield writer
+    writer.stop()
+
+
+def movement(n, boulder_id='MB001'):
+    return (boulder_id, None, 'Quarry', f'movement {n}', T0 + n)
+
+
+def details(conn):
+    return [row[0] for row in conn.execute('SELECT details FROM movement ORDER BY movement_id')]
+
+
+# Full batches are written as soon as they fill; flush writes the rest
+def test_rows_are_written_in_batches(conn, writer):
+    writer.submit(movement(n) for n in range(7))
+    assert writer.flush(5)
+    assert details(conn) == [f'movement {n}' for n in range(7)]
+    assert writer.metrics()['written'] == 7
+    assert writer.metrics()['batches'] == 3
+    assert writer.metrics()['queue_depth'] == 0
+
+
+# With the thread stopped, flush writes what is queued from the calling thread
+def test_flush_without_the_thread(conn, writer):
+    writer.stop()
+    writer._queue.put(movement(0))
+    assert writer.flush()
+    assert details(conn) == ['movement 0']
+
+
+# A row the database rejects costs only that row, not its whole batch
+def test_bad_row_only_drops_itself(conn, writer, caplog):
+    with caplog.at_level(logging.ERROR, logger='movement_log'):
+        writer.submit([movement(0), movement(1, boulder_id='MX999'), movement(2)])
+        assert writer.flush(5)
+    assert details(conn) == ['movement 0', 'movement 2']
+    assert writer.metrics()['written'] == 2
+    assert writer.metrics()['dropped'] == 1
+    assert 'MX999' in caplog.text
+
+
+def test_app_writer_is_flushed(app, conn):
+    with app.app_context():
+        movement_log.get_writer().submit([movement(0)])
+        assert movement_log.get_writer().flush(5)
+    assert details(conn) == ['movement 0']
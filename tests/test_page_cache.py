@@ -0,0 +1,45 @@
+import app as inventory
+import migrations
+
+BOULDER = {'date': '2024-06-01', 'boulder_description': 'Black Galaxy', 'good_boulder': 'Yes',
+           'defect_line': 'No', 'natural_cracks': 'No', 'mining_cracks': 'No', 'undersize': 'No'}
+
+
+# An unchanged page answers If-None-Match with a 304 and no body
+def test_unchanged_page_is_not_modified(client):
+    first = client.get('/quarry')
+    assert first.status_code == 200 and first.headers['ETag']
+    again = client.get('/quarry', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+    assert again.data == b''
+
+
+# A write to a table the page reads changes its ETag and its content
+def test_write_invalidates_the_page(client):
+    before = client.get('/quarry')
+    client.post('/quarry', data=BOULDER)
+    after = client.get('/quarry', headers={'If-None-Match': before.headers['ETag']})
+    assert after.status_code == 200
+    assert after.headers['ETag'] != before.headers['ETag']
+    assert b'MB001' in after.data and b'MB001' not in before.data
+
+
+# Two apps on different databases never serve each other's pages or ETags
+def test_apps_keep_their_own_pages(app, client, tmp_path):
+    database = str(tmp_path / 'other.db')
+    migrations.migrate(database)
+    other = inventory.create_app({'DATABASE': database, 'ARCHIVE_DATABASE': str(tmp_path / 'other-archive.db'),
+                                  'LOG_FILE': str(tmp_path / 'other.log'), 'TESTING': True})
+    try:
+        other_client = other.test_client()
+        other_client.post('/quarry', data=BOULDER)
+        client.post('/quarry', data={**BOULDER, 'boulder_description': 'Green Marble'})
+
+        page = client.get('/quarry')
+        other_page = other_client.get('/quarry')
+        assert b'MG001' in page.data and b'MB001' not in page.data
+        assert b'MB001' in other_page.data and b'MG001' not in other_page.data
+        assert page.headers['ETag'] != other_page.headers['ETag']
+    finally:
+        other.extensions['movement_writer'].stop()
+        other.extensions['writer'].stop()
@@ -0,0 +1,33 @@
+import sqlite3
+
+import pytest
+
+import pagination
+
+
+@pytest.fixture
+def conn(app):
+    conn = sqlite3.connect(app.config['DATABASE'])
+    with conn:
+        conn.executemany('INSERT INTO boulder (boulder_id, date, boulder_description, color) VALUES (?, ?, ?, ?)',
+                         [(f'MB{n:03d}', '2024-06-01', 'Black Galaxy', 'Black') for n in range(1, 21)])
+    yield conn
+    conn.close()
+
+
+# A zero or negative page_size must not turn into an unlimited LIMIT
+@pytest.mark.parametrize('page_size', ['0', '-5', '-1'])
+def test_page_size_has_a_lower_bound(conn, page_size):
+    page = pagination.history_page(conn, 'boulder', {'page_size': page_size}, page_size=5)
+    assert page['page_size'] == 1
+    assert len(page['rows']) == 1
+
+
+def test_page_size_has_an_upper_bound(conn):
+    page = pagination.history_page(conn, 'boulder', {'page_size': '100000'}, page_size=5)
+    assert page['page_size'] == pagination.MAX_PAGE_SIZE
+
+
+def test_missing_page_size_uses_the_default(conn):
+    page = pagination.history_page(conn, 'boulder', {}, page_size=5)
+    assert len(page['rows']) == 5
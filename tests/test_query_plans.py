@@ -0,0 +1,16 @@
+import sqlite3
+
+import app as inventory
+import migrations
+
+
+# Every stage queue lookup is an index SEARCH on a freshly migrated database
+def test_queue_queries_use_an_index(tmp_path):
+    database = str(tmp_path / 'inventory.db')
+    migrations.migrate(database)
+    conn = sqlite3.connect(database)
+    try:
+        assert inventory.QUEUE_QUERIES
+        assert inventory.queue_query_problems(conn) == []
+    finally:
+        conn.close()
@@ -0,0 +1,72 @@
+import sqlite3
+
+import pytest
+
+import rollups
+import timestamps
+
+NOW = 1717236000  # 2024-06-01 13:00 local
+BOULDER_FLAGS = {'good_boulder': 'Yes', 'defect_line': 'No', 'natural_cracks': 'No', 'mining_cracks': 'Yes', 'undersize': 'No'}
+SLAB_FLAGS = {'good_slab': 'No', 'defect_line': 'No', 'natural_cracks': 'Yes', 'cutting_cracks': 'No', 'thickness_issue': 'No'}
+
+
+@pytest.fixture
+def conn(app, monkeypatch):
+    monkeypatch.setattr(timestamps, 'now', lambda: NOW)
+    conn = sqlite3.connect(app.config['DATABASE'])
+    yield conn
+    conn.close()
+
+
+def boulder_rollup(conn):
+    return {row[0]: row[1:] for row in conn.execute('''
+        SELECT stage, boulders, good, mining_cracks, slabs_cut, machine_hours FROM boulder_rollup WHERE day = '2024-06-01'
+    ''')}
+
+
+def slab_rollup(conn):
+    return {row[0]: row[1:] for row in conn.execute('''
+        SELECT stage, slabs, good, natural_cracks FROM slab_rollup WHERE day = '2024-06-01'
+    ''')}
+
+
+def snapshot(conn):
+    return [sorted(conn.execute(f'SELECT * FROM {table}')) for table in ('boulder_rollup', 'slab_rollup', 'machine_utilization')]
+
+
+# Each stage form adds its boulder or slabs to the day's totals as it is
+# posted, and the totals match a rebuild from the stage tables
+def test_stage_posts_update_the_rollups(client, conn):
+    client.post('/quarry', data={'date': '2024-06-01', 'boulder_description': 'Black Galaxy', **BOULDER_FLAGS})
+    assert boulder_rollup(conn) == {'quarry': (1, 1, 1, 0, 0)}
+
+    client.post('/factory', data={'boulder_id': 'MB001', **BOULDER_FLAGS})
+    assert boulder_rollup(conn)['factory'] == (1, 1, 1, 0, 0)
+
+    client.post('/cutting_machine_1', data={'boulder_id': 'MB001', 'start_time': '2024-06-01T10:30',
+                                            'end_time': '2024-06-01T12:00', 'num_slabs_cut': '2'})
+    assert boulder_rollup(conn)['cutting'] == (1, 0, 0, 2, 1.5)
+    assert conn.execute('SELECT hour, runs, slabs_cut, busy_hours FROM machine_utilization ORDER BY hour').fetchall() == [
+        ('2024-06-01T10', 1, 2, 0.5), ('2024-06-01T11', 0, 0, 1.0),
+    ]
+
+    client.post('/separation', data={'boulder_id': 'MB001', 'slab_description': 'Black Slab', 'good_slabs': '1',
+                                     'defect_line': '0', 'natural_cracks': '1', 'cutting_cracks': '0', 'thickness_issue': '0'})
+    assert boulder_rollup(conn)['separation'] == (1, 0, 0, 2, 0)
+    assert slab_rollup(conn) == {'separation': (2, 1, 1)}
+
+    client.post('/polishing', data={'slab_id': 'MB001_SB002', 'polishing_description': 'Polished', **SLAB_FLAGS})
+    assert slab_rollup(conn)['polishing'] == (1, 0, 1)
+    client.post('/polishing', data={'slab_id': 'MB001_SB001', 'polishing_description': 'Polished', **SLAB_FLAGS, 'good_slab': 'Yes',
+                                    'natural_cracks': 'No'})
+    assert slab_rollup(conn)['polishing'] == (2, 1, 1)
+
+    posted = snapshot(conn)
+    rollups.rebuild(conn)
+    assert snapshot(conn) == posted
+
+
+# A rejected post leaves the totals alone
+def test_rejected_post_is_not_counted(client, conn):
+    client.post('/polishing', data={'slab_id': 'MB404_SB001', 'polishing_description': 'Polished', **SLAB_FLAGS})
+    assert slab_rollup(conn) == {}
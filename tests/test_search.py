@@ -0,0 +1,34 @@
+import sqlite3
+
+import pytest
+
+import search
+
+
+@pytest.fixture
+def conn(app):
+    conn = sqlite3.connect(app.config['DATABASE'])
+    with conn:
+        conn.execute("INSERT INTO boulder (boulder_id, date, boulder_description, color) "
+                     "VALUES ('MB001', '2024-06-01', 'Black Galaxy', 'Black')")
+        conn.execute("INSERT INTO separation (boulder_id, boulder_description, slab_id, slab_description) "
+                     "VALUES ('MB001', 'Black Galaxy', 'MB001_SB002', 'Speckled slab')")
+        conn.execute("INSERT INTO slab_state (slab_id, boulder_id, stage, description) "
+                     "VALUES ('MB001_SB002', 'MB001', 'ready', 'Speckled slab')")
+    yield conn
+    conn.close()
+
+
+# A hit on an earlier stage's text opens the page of the slab's current stage
+def test_slab_hit_links_to_current_stage(conn):
+    [hit] = search.query(conn, 'speckled')
+    assert (hit['kind'], hit['stage'], hit['page']) == ('separation', 'ready', 'ready_slabs')
+    assert hit['page_filter'] == 'MB001_SB002'
+
+
+# Boulder hits, and slabs no longer in slab_state, open the source's page
+def test_boulder_and_archived_hits_link_to_source_page(conn):
+    with conn:
+        conn.execute("DELETE FROM slab_state WHERE slab_id = 'MB001_SB002'")
+    hits = {hit['kind']: hit['page'] for hit in search.query(conn, 'galaxy')}
+    assert hits == {'boulder': 'quarry', 'separation': 'separation'}
@@ -0,0 +1,29 @@
+import app as inventory
+
+BOULDER = {'date': '2024-06-01', 'boulder_description': 'Black Galaxy', 'good_boulder': 'Yes',
+           'defect_line': 'No', 'natural_cracks': 'No', 'mining_cracks': 'No', 'undersize': 'No'}
+
+
+def cut(client, slabs):
+    return client.post('/cutting_machine_1', data={
+        'boulder_id': 'MB001', 'description': 'Black Galaxy', 'start_time': '2024-06-02T08:00',
+        'end_time': '2024-06-02T09:00', 'num_slabs_cut': str(slabs),
+    })
+
+
+# Counts are cached once read, and the cutting machine POST drops the boulder's
+def test_slabs_cut_is_cached_and_invalidated_by_cutting(app, client):
+    client.post('/quarry', data=BOULDER)
+    client.post('/quarry', data=BOULDER)
+    assert cut(client, 4).status_code == 302
+
+    cache = app.extensions['slabs_cut_cache']
+    with app.app_context():
+        assert inventory.get_slabs_cut(['MB001', 'MB002']) == {'MB001': 4}
+        assert 'MB001' in cache and 'MB002' not in cache
+        assert inventory.get_num_slabs_cut('MB002') == 0
+
+    assert cut(client, 2).status_code == 302
+    assert 'MB001' not in cache
+    with app.app_context():
+        assert inventory.get_num_slabs_cut('MB001') == 6
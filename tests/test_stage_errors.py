@@ -0,0 +1,28 @@
+FLAGS = {'good_boulder': 'Yes', 'defect_line': 'No', 'natural_cracks': 'No', 'mining_cracks': 'No', 'undersize': 'No'}
+
+
+# A stale or forged boulder_id breaks a foreign key; the page reports the
+# failed write instead of answering 500
+def test_factory_with_unknown_boulder(client):
+    response = client.post('/factory', data={'boulder_id': 'MX999', 'description': 'Unknown', **FLAGS})
+    assert response.status_code == 200
+    assert b'An error occurred' in response.data
+
+
+def test_cutting_run_with_unknown_boulder(client):
+    response = client.post('/cutting_machine_1', data={
+        'boulder_id': 'MX999', 'description': 'Unknown', 'start_time': '2024-06-01T08:00',
+        'end_time': '2024-06-01T09:00', 'num_slabs_cut': '4',
+    })
+    assert response.status_code == 200
+    assert b'An error occurred' in response.data
+
+
+# A blank slab description is reported, not a 500 from building the slab IDs
+def test_separation_with_blank_description(client):
+    response = client.post('/separation', data={
+        'boulder_id[]': 'MB001', 'slab_description[]': ' ', 'good_slabs[]': '1', 'defect_line[]': '0',
+        'natural_cracks[]': '0', 'cutting_cracks[]': '0', 'thickness_issue[]': '0',
+    })
+    assert response.status_code == 200
+    assert b'An error occurred' in response.data
@@ -0,0 +1,61 @@
+import datetime
+import sqlite3
+
+import pytest
+
+import storage
+import timestamps
+
+T0 = 1717200000  # 2024-06-01 00:00 UTC, 03:00 in Nairobi
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('2024-06-01 03:00:00', T0),
+    ('2024-06-01T03:00', T0),
+    ('2024-06-01', T0 - 3 * 3600),
+    ('2024-06-01T00:00:00+00:00', T0),
+    (datetime.datetime(2024, 6, 1, 3, 0, 5), T0 + 5),
+    (T0, T0),
+    (None, None),
+    ('not a time', 'not a time'),
+])
+def test_parse(value, expected):
+    assert timestamps.parse(value) == expected
+
+
+def test_to_text():
+    assert timestamps.to_text(T0) == '2024-06-01 03:00:00'
+    assert timestamps.to_text(T0 + 21 * 3600 + 59) == '2024-06-02 00:00:59'
+    assert timestamps.to_text(None) is None
+    assert timestamps.to_text('2023-12-31 10:00:00') == '2023-12-31 10:00:00'
+
+
+def test_days_and_hours():
+    assert timestamps.day(T0 + 20 * 3600 + 59 * 60) == '2024-06-01'
+    assert timestamps.day(T0 + 21 * 3600) == '2024-06-02'
+    assert timestamps.day('2024-06-01') == '2024-06-01'
+    assert timestamps.hour(T0 + 3599) == '2024-06-01T03'
+    assert timestamps.day_start('2024-06-01') == T0 - 3 * 3600
+
+
+def test_day_sql_matches_day():
+    conn = sqlite3.connect(':memory:')
+    sql = f"SELECT {timestamps.day_sql('value')} FROM (SELECT ? AS value)"
+    for value in (T0 - 3 * 3600 - 1, T0 - 3 * 3600, T0 + 21 * 3600, '2023-12-31 10:00:00'):
+        assert conn.execute(sql, (value,)).fetchone()[0] == timestamps.day(value)
+
+
+# Times typed on a page are stored as epochs and shown back as local text
+def test_ui_round_trip(client, app):
+    with app.app_context():
+        storage.get_storage().add_boulder('2024-06-01', 'Black Galaxy', (1, 0, 0, 0, 0))
+    client.post('/cutting_machine_1', data={'boulder_id': 'MB001', 'start_time': '2024-06-01T03:00',
+                                            'end_time': '2024-06-01T04:30', 'num_slabs_cut': '2'})
+    conn = sqlite3.connect(app.config['DATABASE'])
+    try:
+        assert conn.execute('SELECT start_time, end_time, machine_hours FROM cutting_run').fetchall() == [(T0, T0 + 5400, 1.5)]
+    finally:
+        conn.close()
+    page = client.get('/cutting_machine_1').get_data(as_text=True)
+    assert '<td>2024-06-01 03:00:00</td>' in page
+    assert '<td>2024-06-01 04:30:00</td>' in page
@@ -0,0 +1,30 @@
+import sqlite3
+
+BOULDER = {'date': '2024-06-01', 'boulder_description': 'Black Galaxy', 'good_boulder': 'Yes',
+           'defect_line': 'No', 'natural_cracks': 'No', 'mining_cracks': 'No', 'undersize': 'No'}
+
+
+# A write from another process (here a plain connection, as a CLI command or
+# another worker would make) must not leave a stale tree in the cache
+def test_trace_sees_writes_from_other_connections(app, client):
+    client.post('/quarry', data=BOULDER)
+    before = client.get('/api/trace/MB001').get_json()
+
+    conn = sqlite3.connect(app.config['DATABASE'])
+    with conn:
+        conn.execute("UPDATE boulder SET boulder_description = 'Black Pearl' WHERE boulder_id = 'MB001'")
+    conn.close()
+
+    after = client.get('/api/trace/MB001').get_json()
+    assert before != after
+    assert 'Black Pearl' in str(after)
+
+
+# A write to one boulder leaves the cached trees of the others in place
+def test_trace_stays_cached_across_other_boulders(app, client):
+    client.post('/quarry', data=BOULDER)
+    client.get('/api/trace/MB001')
+    client.post('/quarry', data=BOULDER)
+    hits = app.extensions['trace_cache'].hits
+    client.get('/api/trace/MB001')
+    assert app.extensions['trace_cache'].hits == hits + 1
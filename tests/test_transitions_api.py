@@ -0,0 +1,73 @@
+import sqlite3
+
+import pytest
+
+import storage
+
+T0 = 1717200000
+
+
+# MB001 cut and separated into three slabs waiting for polishing
+@pytest.fixture
+def conn(app):
+    with app.app_context():
+        repository = storage.get_storage()
+        repository.add_boulder('2024-06-01', 'Black Galaxy', (1, 0, 0, 0, 0))
+        repository.record_cutting_run(1, 'MB001', 'Black Galaxy', 3, T0, T0 + 3600, 1.0)
+        repository.separate([('MB001', 'Black Galaxy', 'Black Slab', (3, 0, 0, 0, 0))], T0 + 3700)
+    conn = sqlite3.connect(app.config['DATABASE'])
+    yield conn
+    conn.close()
+
+
+def stages(conn):
+    return dict(conn.execute('SELECT slab_id, stage FROM slab_state'))
+
+
+def test_batch_moves_every_slab(app, client, conn):
+    response = client.post('/api/stages/polishing/transitions', json=[
+        {'slab_id': 'MB001_SB001', 'description': 'Polished A'},
+        {'slab_id': 'MB001_SB002', 'description': 'Polished B', 'cutting_cracks': 1, 'good_slab': 0},
+    ])
+    assert response.status_code == 200
+    assert response.get_json()['applied'] == 2
+
+    assert stages(conn) == {'MB001_SB001': 'polishing', 'MB001_SB002': 'polishing', 'MB001_SB003': 'separation'}
+    assert conn.execute("SELECT good_slab, cutting_cracks FROM slab_state WHERE slab_id = 'MB001_SB002'").fetchone() == (0, 1)
+    assert conn.execute('SELECT slab_id, polishing_description FROM polishing ORDER BY slab_id').fetchall() == [
+        ('MB001_SB001', 'Polished A'), ('MB001_SB002', 'Polished B'),
+    ]
+    app.extensions['movement_writer'].flush()
+    assert conn.execute("SELECT boulder_id, slab_id, stage, details FROM movement WHERE stage = 'Polishing' ORDER BY slab_id").fetchall() == [
+        ('MB001', 'MB001_SB001', 'Polishing', 'Slab MB001_SB001 polished with description: Polished A.'),
+        ('MB001', 'MB001_SB002', 'Polishing', 'Slab MB001_SB002 polished with description: Polished B.'),
+    ]
+
+
+# One slab in the wrong stage rejects the whole batch with a 409 listing it
+def test_batch_is_all_or_nothing(app, client, conn):
+    client.post('/api/stages/polishing/transitions', json=[{'slab_id': 'MB001_SB001', 'description': 'Polished A'}])
+    response = client.post('/api/stages/polishing/transitions', json={'transitions': [
+        {'slab_id': 'MB001_SB003', 'description': 'Polished C'},
+        {'slab_id': 'MB001_SB001', 'description': 'Polished again'},
+    ]})
+    assert response.status_code == 409
+    assert response.get_json() == {
+        'error': '1 invalid transition(s)',
+        'errors': [{'index': 1, 'slab_id': 'MB001_SB001', 'error': "slab is at stage 'polishing', expected 'separation'"}],
+    }
+
+    assert stages(conn)['MB001_SB003'] == 'separation'
+    assert conn.execute("SELECT COUNT(*) FROM polishing WHERE slab_id = 'MB001_SB003'").fetchone()[0] == 0
+    app.extensions['movement_writer'].flush()
+    assert conn.execute("SELECT slab_id FROM movement WHERE stage = 'Polishing'").fetchall() == [('MB001_SB001',)]
+
+
+@pytest.mark.parametrize('body, status', [([], 400), ({'transitions': 'x'}, 400)])
+def test_malformed_batches_are_rejected(client, conn, body, status):
+    assert client.post('/api/stages/polishing/transitions', json=body).status_code == status
+
+
+def test_unknown_stage(client, conn):
+    response = client.post('/api/stages/lapping/transitions', json=[{'slab_id': 'MB001_SB001'}])
+    assert response.status_code == 404
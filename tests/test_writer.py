@@ -0,0 +1,24 @@
+import concurrent.futures
+import sqlite3
+
+import pytest
+
+import writer
+
+
+# A writer whose connection cannot be opened fails the writes already queued
+# instead of leaving their callers waiting, and connects again once it can
+def test_writes_fail_while_the_writer_cannot_connect(tmp_path):
+    w = writer.Writer(str(tmp_path / 'missing' / 'inventory.db'))
+    queued = concurrent.futures.Future()
+    w._queue.put((lambda conn: None, (), queued, None))
+    w._run()
+    with pytest.raises(sqlite3.OperationalError):
+        queued.result(timeout=0)
+    with pytest.raises(sqlite3.OperationalError):
+        w.run(lambda conn: None)
+
+    w._thread.join(5)
+    (tmp_path / 'missing').mkdir()
+    assert w.run(lambda conn: conn.execute('SELECT 1').fetchone()[0]) == 1
+    w.stop(timeout=5)
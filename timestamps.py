@@ -0,0 +1,100 @@
+import datetime
+import functools
+import time
+import zoneinfo
+
+# Event times are stored as INTEGER Unix epoch seconds, so they compare and
+# index as plain numbers and writing one is a single time() call. They are
+# turned into Africa/Nairobi wall-clock text only for display, through a
+# formatter that caches each minute's text. Calendar dates typed in by people
+# (boulder.date) stay YYYY-MM-DD text.
+
+ZONE = zoneinfo.ZoneInfo('Africa/Nairobi')
+
+# Nairobi keeps UTC+3 all year (no daylight saving), so SQL can get local
+# days with a fixed offset
+UTC_OFFSET = 3 * 3600
+
+# Epoch columns: table -> columns
+COLUMNS = {
+    'factory': ('received_timestamp',),
+    'cutting_run': ('start_time', 'end_time'),
+    'separation': ('separation_time',),
+    'polishing': ('polishing_time',),
+    'edge_cutting_standard': ('edge_cutting_time',),
+    'edge_cutting_special_orders': ('edge_cutting_time',),
+    'bullnose': ('bullnose_time',),
+    'sealant': ('sealant_time',),
+    'ready_slabs': ('ready_time',),
+    'movement': ('date',),
+    'slab_state': ('updated_at',),
+}
+
+
+# The current time as epoch seconds
+def now():
+    return int(time.time())
+
+
+# Epoch seconds of a Nairobi wall-clock time given as a naive datetime or ISO
+# text ('2024-01-05 14:28:05', '2024-01-05T14:28' or a bare date). Epochs and
+# None pass through; text that is not a time is returned unchanged.
+def parse(value):
+    if value is None or isinstance(value, int):
+        return value
+    try:
+        moment = value if isinstance(value, datetime.datetime) else datetime.datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return value
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=ZONE)
+    return int(moment.timestamp())
+
+
+# Epoch seconds of the start of a local day (a date or YYYY-MM-DD)
+def day_start(day):
+    if isinstance(day, str):
+        day = datetime.date.fromisoformat(day)
+    return int(datetime.datetime.combine(day, datetime.time(), ZONE).timestamp())
+
+
+# Today's local date
+def today():
+    return datetime.datetime.now(ZONE).date()
+
+
+@functools.lru_cache(maxsize=4096)
+def _minute(minute):
+    return datetime.datetime.fromtimestamp(minute * 60, ZONE).strftime('%Y-%m-%d %H:%M')
+
+
+# Local 'YYYY-MM-DD HH:MM:SS' text of an epoch; anything else (None, dates,
+# legacy text) is returned as it is
+def to_text(value):
+    if not isinstance(value, int):
+        return value
+    return f'{_minute(value // 60)}:{value % 60:02d}'
+
+
+# Local YYYY-MM-DD of an epoch, or the first ten characters of a date text
+def day(value):
+    if isinstance(value, int):
+        return _minute(value // 60)[:10]
+    return value[:10]
+
+
+# Local YYYY-MM-DDTHH of an epoch
+def hour(value):
+    return _minute(value // 60)[:13].replace(' ', 'T')
+
+
+# SQL expression for the local YYYY-MM-DD of an epoch expression (or of a
+# time still stored as text, for databases before migration 12)
+def day_sql(expression):
+    return (f"CASE WHEN typeof({expression}) = 'integer' THEN date({expression} + {UTC_OFFSET}, 'unixepoch') "
+            f"ELSE substr({expression}, 1, 10) END")
+
+
+# Register the localtime template filter
+def init_app(app):
+    app.add_template_filter(to_text, 'localtime')
@@ -0,0 +1,175 @@
+import rollups
+import slab_state
+
+FLAGS = ('good_slab', 'defect_line', 'natural_cracks', 'cutting_cracks', 'thickness_issue')
+
+# Finishing stages that take slabs one-to-one from the previous stage:
+# stage -> (previous stage, table, previous description column, description
+# column, time column, movement stage, movement verb, inventory stage).
+# Special-order edge cutting splits a slab into several and is not included.
+TRANSITIONS = {
+    'polishing': ('separation', 'polishing', 'slab_description', 'polishing_description', 'polishing_time',
+                  'Polishing', 'polished', None),
+    'edge_cutting': ('polishing', 'edge_cutting_standard', 'polishing_description', 'edge_cutting_description', 'edge_cutting_time',
+                     'Edge Cutting Standard', 'edge cut', 'Awaiting Bullnose'),
+    'bullnose': ('edge_cutting', 'bullnose', 'edge_cutting_description', 'bullnose_description', 'bullnose_time',
+                 'Bullnose', 'bullnosed', None),
+    'sealant': ('bullnose', 'sealant', 'bullnose_description', 'sealant_description', 'sealant_time',
+                'Sealant', 'sealed', None),
+    'ready': ('sealant', 'ready_slabs', 'sealant_description', None, 'ready_time',
+              'Ready Slabs', 'ready', None),
+}
+
+INVENTORY_SQL = '''
+    INSERT INTO inventory (slab_id, slab_description, stage, good_slab, defect_line, natural_cracks, cutting_cracks, thickness_issue)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(slab_id) DO UPDATE SET
+        slab_description=excluded.slab_description,
+        stage=excluded.stage,
+        good_slab=excluded.good_slab,
+        defect_line=excluded.defect_line,
+        natural_cracks=excluded.natural_cracks,
+        cutting_cracks=excluded.cutting_cracks,
+        thickness_issue=excluded.thickness_issue
+'''
+
+
+# Raised with a list of per-transition errors when a batch cannot be applied
+class TransitionError(ValueError):
+    def __init__(self, errors):
+        super().__init__(f'{len(errors)} invalid transition(s)')
+        self.errors = errors
+
+
+# Upsert inventory rows of (slab_id, description, stage, good_slab, defect_line,
+# natural_cracks, cutting_cracks, thickness_issue) on the caller's connection
+def upsert_inventory(conn, rows):
+    conn.executemany(INVENTORY_SQL, rows)
+
+
+# The status a slab was separated with, as shown on the polishing page
+def original_status(good_slab, defect_line, natural_cracks, cutting_cracks, thickness_issue):
+    for flag, status in zip((good_slab, defect_line, natural_cracks, cutting_cracks, thickness_issue),
+                            ('Good', 'Defect Line', 'Natural Cracks', 'Cutting Cracks', 'Thickness Issue')):
+        if flag == 1:
+            return status
+    return 'Unknown'
+
+
+# A defect flag from JSON: 0/1, true/false or "yes"/"no"; None when invalid
+def _flag(value):
+    if isinstance(value, str):
+        value = {'yes': 1, 'no': 0, '1': 1, '0': 0}.get(value.strip().lower())
+    if value in (0, 1):
+        return int(value)
+    return None
+
+
+# Current (boulder_id, stage, description, flags) of each slab, in chunked IN queries
+def _current_state(conn, slab_ids):
+    state = {}
+    for start in range(0, len(slab_ids), 500):
+        chunk = slab_ids[start:start + 500]
+        placeholders = ', '.join('?' * len(chunk))
+        for slab_id, boulder_id, stage, description, *flags in conn.execute(f'''
+            SELECT slab_id, boulder_id, stage, description, {', '.join(FLAGS)}
+            FROM slab_state WHERE slab_id IN ({placeholders})
+        ''', chunk):
+            state[slab_id] = (boulder_id, stage, description, flags)
+    return state
+
+
+# Slab IDs a batch refers to, for looking up their current state
+def requested_slabs(transitions):
+    return [t['slab_id'] for t in transitions if isinstance(t, dict) and isinstance(t.get('slab_id'), str) and t['slab_id']]
+
+
+# INSERT statement of a stage table, taking the stage rows built by plan()
+def insert_sql(stage):
+    previous, table, previous_column, description_column, time_column = TRANSITIONS[stage][:5]
+    columns = ['slab_id', previous_column]
+    if stage == 'polishing':
+        columns.append('original_status')
+    if description_column:
+        columns.append(description_column)
+    columns += [*FLAGS, time_column]
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+
+# Check a batch of transitions into `stage` against the slabs' current state
+# ({slab_id: (boulder_id, stage, description, flags)}, see _current_state)
+# and build its rows as (stage rows, slab_state rows, inventory rows,
+# movements). Each transition is a dict with slab_id, the stage's
+# description (not used for 'ready') and optional defect flags. Every slab
+# must currently be in the previous stage; if any transition is invalid
+# TransitionError lists the problems. Shared by the storage backends.
+def plan(stage, transitions, state, timestamp):
+    previous, table, previous_column, description_column, time_column, movement_stage, verb, inventory_stage = TRANSITIONS[stage]
+
+    errors = []
+    seen = set()
+    candidates = []
+    for index, transition in enumerate(transitions):
+        slab_id = transition.get('slab_id') if isinstance(transition, dict) else None
+        if not isinstance(slab_id, str) or not slab_id:
+            errors.append({'index': index, 'error': 'slab_id is required'})
+            continue
+        if slab_id in seen:
+            errors.append({'index': index, 'slab_id': slab_id, 'error': 'slab_id appears more than once'})
+            continue
+        seen.add(slab_id)
+        candidates.append((index, slab_id, transition))
+
+    stage_rows = []
+    state_rows = []
+    inventory_rows = []
+    movements = []
+    for index, slab_id, transition in candidates:
+        if slab_id not in state:
+            errors.append({'index': index, 'slab_id': slab_id, 'error': 'unknown slab'})
+            continue
+        boulder_id, current, previous_description, previous_flags = state[slab_id]
+        if current != previous:
+            errors.append({'index': index, 'slab_id': slab_id, 'error': f"slab is at stage '{current}', expected '{previous}'"})
+            continue
+
+        flags = [_flag(transition.get(name, 0)) for name in FLAGS]
+        if None in flags:
+            errors.append({'index': index, 'slab_id': slab_id, 'error': 'defect flags must be 0 or 1'})
+            continue
+
+        if description_column is None:
+            description = previous_description
+            row = (slab_id, previous_description, *flags, timestamp)
+        else:
+            description = transition.get('description')
+            if not isinstance(description, str) or not description.strip():
+                errors.append({'index': index, 'slab_id': slab_id, 'error': 'description is required'})
+                continue
+            if stage == 'polishing':
+                row = (slab_id, previous_description, original_status(*previous_flags), description, *flags, timestamp)
+            else:
+                row = (slab_id, previous_description, description, *flags, timestamp)
+
+        stage_rows.append(row)
+        state_rows.append((slab_id, None, stage, description, *flags, timestamp))
+        if inventory_stage:
+            inventory_rows.append((slab_id, description, inventory_stage, *flags))
+        movements.append((movement_stage, f"Slab {slab_id} {verb} with description: {description}.", boulder_id, slab_id))
+
+    if errors:
+        raise TransitionError(errors)
+    return stage_rows, state_rows, inventory_rows, movements
+
+
+# Move a batch of slabs into `stage` on the caller's connection (see plan()).
+# If any transition is invalid nothing is written. Returns the movement rows
+# to log once the caller has committed.
+def apply(conn, stage, transitions, timestamp):
+    state = _current_state(conn, requested_slabs(transitions))
+    stage_rows, state_rows, inventory_rows, movements = plan(stage, transitions, state, timestamp)
+    conn.executemany(insert_sql(stage), stage_rows)
+    slab_state.upsert(conn, state_rows)
+    rollups.add_slabs(conn, stage, [(timestamp, *row[4:9]) for row in state_rows])
+    upsert_inventory(conn, inventory_rows)
+    return movements
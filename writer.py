@@ -0,0 +1,169 @@
+import atexit
+import concurrent.futures
+import queue
+import random
+import sqlite3
+import threading
+import time
+
+from flask import current_app
+
+import db
+import metrics
+
+# Every write of a process runs on one writer thread with its own connection.
+# Requests hand it a function to run inside BEGIN IMMEDIATE and wait for the
+# result, so the threads of one process never queue on the SQLite write lock
+# among themselves; only other processes (more server workers, CLI commands,
+# the archive job) can hold it. If one does and the lock is not free within
+# WRITE_BUSY_TIMEOUT seconds, the transaction is rolled back and run again
+# after an exponential backoff with jitter, at most WRITE_ATTEMPTS times in
+# all, before DatabaseBusy is raised. A write function can therefore run more
+# than once: it must only touch the connection it is given, and anything
+# outside the database (movement logging, cache invalidation) happens after
+# it returns.
+
+# Queue marker understood by the writer thread
+_STOP = object()
+
+busy_retries = metrics.Counter('sqlite_busy_retries_total',
+                               'Write transactions retried because the database was locked (SQLITE_BUSY).')
+metrics.REGISTRY.append(busy_retries)
+
+
+# Raised when a write still finds the database locked after every attempt
+class DatabaseBusy(Exception):
+    pass
+
+
+# Whether an error means another connection holds the lock
+def is_busy(error):
+    code = getattr(error, 'sqlite_errorcode', None)
+    if code is not None:
+        return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return 'database is locked' in str(error) or 'database is busy' in str(error)
+
+
+class Writer:
+    def __init__(self, database, busy_timeout=5, attempts=5, backoff=0.05, max_backoff=2.0):
+        self.database = database
+        self.busy_timeout = busy_timeout
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._error = None
+
+    # Queue fn(conn, *args) to run in its own transaction; returns a
+    # concurrent.futures.Future with its result (asgi.py awaits it). Raises
+    # sqlite3.OperationalError if the writer thread has just failed to
+    # connect; the next call starts a new thread that tries again.
+    def submit(self, fn, *args):
+        future = concurrent.futures.Future()
+        self._ensure_started()
+        with self._lock:
+            if self._error is not None:
+                raise sqlite3.OperationalError(f'database writer is not running: {self._error}') from self._error
+            self._queue.put((fn, args, future, metrics.current_stats()))
+        return future
+
+    # Run fn(conn, *args) in its own transaction and return its result
+    def run(self, fn, *args):
+        if threading.current_thread() is self._thread:
+            raise RuntimeError('a write function cannot start another write')
+        return self.submit(fn, *args).result()
+
+    # Finish the queued writes and stop the writer thread
+    def stop(self, timeout=None):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join(timeout)
+
+    # Start the thread on first use so forking servers start it per worker
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                # A new thread tries to connect again
+                self._error = None
+                self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        try:
+            conn = db.connect(self.database, self.busy_timeout)
+        except BaseException as e:
+            self._fail(e)
+            return
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _STOP:
+                    break
+                fn, args, future, stats = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    with metrics.bound(stats):
+                        result = self._transaction(conn, fn, args)
+                    future.set_result(result)
+                except BaseException as e:
+                    future.set_exception(e)
+        finally:
+            conn.close()
+
+    # The thread could not connect: fail every queued write with the error,
+    # and have submit() refuse new ones until a new thread is started,
+    # instead of leaving callers waiting
+    def _fail(self, error):
+        with self._lock:
+            self._error = error
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not _STOP and item[2].set_running_or_notify_cancel():
+                    item[2].set_exception(error)
+
+    def _transaction(self, conn, fn, args):
+        for attempt in range(self.attempts):
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    result = fn(conn, *args)
+                    conn.commit()
+                except BaseException:
+                    conn.rollback()
+                    raise
+                return result
+            except sqlite3.OperationalError as e:
+                if not is_busy(e):
+                    raise
+                if attempt + 1 == self.attempts:
+                    raise DatabaseBusy(f'database still locked after {self.attempts} attempts') from e
+                busy_retries.inc()
+                time.sleep(min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0))
+
+
+# Get the writer of the current app
+def get_writer():
+    return current_app.extensions['writer']
+
+
+# Attach a writer to the Flask app and finish its queue on shutdown
+def init_app(app):
+    writer = Writer(
+        app.config['DATABASE'],
+        busy_timeout=app.config.get('WRITE_BUSY_TIMEOUT', 5),
+        attempts=app.config.get('WRITE_ATTEMPTS', 5),
+        backoff=app.config.get('WRITE_BACKOFF', 0.05),
+        max_backoff=app.config.get('WRITE_MAX_BACKOFF', 2.0),
+    )
+    app.extensions['writer'] = writer
+    atexit.register(writer.stop)